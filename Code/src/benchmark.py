@@ -0,0 +1,283 @@
+"""
+Script to benchmark the hot paths of the network, solver and export pipeline
+over grids of topologies. Wall time and peak allocated memory of each stage
+are recorded, and compared against a stored baseline so that regressions are
+flagged.
+
+Usage:
+    python benchmark.py                 # quick suite, compared to baseline
+    python benchmark.py --suite full    # grids from 2x2 to 10x10
+    python benchmark.py --save          # store results as the new baseline
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import scipy
+import networkx as nx
+
+from network import Network, mat_conv
+from solver import Solver
+from to_matlab import ToMatlab
+
+STAGES = [
+    'init',
+    'compute_spl_matrix',
+    'find_all_paths',
+    'generate_od_pairs',
+    'compute_path_assignment_matrix',
+    'generate_random_proportions',
+    'compute_assignment_matrix',
+    'mat_conv',
+    'single_step_constraints',
+    'multi_step_constraints',
+    'convert_data'
+]
+# Suites are lists of parameter grids. With tau_max set to 'mpl', all
+# shortest paths are enumerated, whose number explodes with the grid size
+SUITES = {
+    'quick': [{
+        'sizes': [(2,2), (3,3), (5,5)],
+        'directions': ['uni', 'bi'],
+        'costs': ['rigid', 'real'],
+        'tau_maxs': [4]
+    }],
+    'full': [{
+        'sizes': [(2,2), (3,3), (4,4), (5,5), (6,6), (8,8), (10,10)],
+        'directions': ['uni', 'bi'],
+        'costs': ['rigid', 'mult_int', 'real'],
+        'tau_maxs': [4]
+    }, {
+        'sizes': [(2,2), (3,3), (4,4), (5,5)],
+        'directions': ['uni', 'bi'],
+        'costs': ['rigid', 'mult_int', 'real'],
+        'tau_maxs': ['mpl']
+    }]
+}
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+# Relative slowdown or memory growth flagged as a regression, and wall time
+# below which stages are too short to be compared reliably
+TIME_TOL = 0.25
+MEMORY_TOL = 0.25
+MIN_TIME = 5e-3
+
+def expand_cases(sizes, directions, costs, tau_maxs):
+    """Returns benchmark cases for all combinations of parameters. Shortest
+    path assignment is benchmarked for all link costs, and random assignment
+    for rigid costs and numeric tau_max only, as it is only supported for
+    rigid costs and enumerates all simple paths.
+
+    Returns:
+        {dict list} -- Cases, with keys uni_bi, h, w, costs, assignment and
+            tau_max.
+    """
+    cases = []
+    for (h, w) in sizes:
+        for uni_bi in directions:
+            for tau_max in tau_maxs:
+                for cst in costs:
+                    assignments = ['shortest_path']
+                    if cst == 'rigid' and tau_max != 'mpl':
+                        assignments.append('random')
+                    for assignment in assignments:
+                        cases.append({
+                            'uni_bi': uni_bi, 'h': h, 'w': w, 'costs': cst,
+                            'assignment': assignment, 'tau_max': tau_max
+                        })
+    return cases
+
+def case_key(case):
+    return '{uni_bi}_{h}x{w}_{costs}_{assignment}_tau{tau_max}'.format(**case)
+
+def run_pipeline(case, measure, n_t=1000, trials=2, seed=0):
+    """Runs every stage of the pipeline once on a case.
+
+    Arguments:
+        case {dict} -- Benchmark case.
+        measure {function} -- Function called as measure(fun) for each stage,
+            which runs fun and returns its result with the measure of the
+            stage.
+
+    Keyword Arguments:
+        n_t {int} -- Number of time samples convolved by mat_conv
+            (default: {1000})
+        trials {int} -- Number of trials exported by convert_data
+            (default: {2})
+        seed {int} -- Seed of the network (default: {0})
+
+    Returns:
+        {dict} -- Measure of each stage, and size counters of the network.
+    """
+    out = {}
+    def stage(name, fun):
+        (ret, out[name]) = measure(fun)
+        return ret
+
+    with tempfile.TemporaryDirectory() as m_dir:
+        net = stage('init', lambda: Network(
+            case['uni_bi'], h=case['h'], w=case['w'], seed=seed
+        ))
+        net.assign_link_costs(case['costs'])
+        stage('compute_spl_matrix', net.compute_spl_matrix)
+        stage('find_all_paths', lambda: net.find_all_paths(
+            tau_max=case['tau_max'], assignment=case['assignment']
+        ))
+        stage('generate_od_pairs', net.generate_od_pairs)
+        stage('compute_path_assignment_matrix', net.compute_path_assignment_matrix)
+        stage('generate_random_proportions', net.generate_random_proportions)
+        stage('compute_assignment_matrix', net.compute_assignment_matrix)
+        X = np.random.RandomState(seed).rand(n_t, len(net.origins))
+        stage('mat_conv', lambda: mat_conv(net.P_ms, X))
+        stage('single_step_constraints', lambda: Solver(net).get_single_step_constraints())
+        stage('multi_step_constraints', lambda: Solver(net).get_multi_step_constraints())
+        stage('convert_data', lambda: ToMatlab(
+            net, step='multi', trials=trials, m_dir=m_dir + os.sep
+        ).convert_data())
+    out['counts'] = {
+        'nodes': len(net.nodes),
+        'links': len(net.links),
+        'paths': len(net.paths),
+        'od_pairs': len(net.od_pairs),
+        'tau_max': net.tau_max
+    }
+    return out
+
+def timed(fun):
+    start = time.perf_counter()
+    ret = fun()
+    return (ret, time.perf_counter() - start)
+
+def traced(fun):
+    """Runs fun while tracemalloc is tracing, and returns the peak memory
+    allocated above the memory allocated before the call.
+    """
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    ret = fun()
+    return (ret, tracemalloc.get_traced_memory()[1] - current)
+
+def run_case(case, repeat=3, **kwargs):
+    """Benchmarks a case. Wall times are the minimum over repeat runs, and
+    peak memory is measured in a separate run traced by tracemalloc, which
+    would otherwise slow the timed runs down.
+
+    Arguments:
+        case {dict} -- Benchmark case.
+
+    Keyword Arguments:
+        repeat {int} -- Number of timed runs (default: {3})
+
+    Returns:
+        {dict} -- Time in seconds and peak memory in bytes of each stage, and
+            size counters of the network.
+    """
+    times = [run_pipeline(case, timed, **kwargs) for _ in range(repeat)]
+    tracemalloc.start()
+    try:
+        peaks = run_pipeline(case, traced, **kwargs)
+    finally:
+        tracemalloc.stop()
+    return {
+        'stages': {
+            s: {'time': min(t[s] for t in times), 'peak': int(peaks[s])}
+            for s in STAGES
+        },
+        'counts': peaks['counts']
+    }
+
+def run_suite(cases, repeat=3, verbose=True, **kwargs):
+    """Benchmarks all cases of a suite.
+
+    Returns:
+        {dict} -- Results of run_case by case key, and versions of the
+            environment.
+    """
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'networkx': nx.__version__,
+            'machine': platform.machine()
+        },
+        'cases': {}
+    }
+    for case in cases:
+        key = case_key(case)
+        results['cases'][key] = run_case(case, repeat=repeat, **kwargs)
+        if verbose:
+            total = sum(r['time'] for r in results['cases'][key]['stages'].values())
+            print('{key}: {t:.3f} s, {p} paths'.format(
+                key=key, t=total, p=results['cases'][key]['counts']['paths']
+            ))
+    return results
+
+def compare(results, baseline, time_tol=TIME_TOL, memory_tol=MEMORY_TOL, min_time=MIN_TIME):
+    """Compares results to a baseline, stage by stage, for the cases found in
+    both.
+
+    Returns:
+        {str list} -- Description of each regression: stages slower than the
+            baseline by more than time_tol, or allocating more memory by more
+            than memory_tol.
+    """
+    regressions = []
+    for (key, case) in results['cases'].items():
+        if key not in baseline['cases']:
+            continue
+        for (s, r) in case['stages'].items():
+            b = baseline['cases'][key]['stages'].get(s)
+            if b is None:
+                continue
+            if r['time'] > max(b['time'], min_time)*(1 + time_tol):
+                regressions.append('{key} {s}: time {t:.4f} s, baseline {b:.4f} s ({x:+.0%})'.format(
+                    key=key, s=s, t=r['time'], b=b['time'], x=r['time']/b['time'] - 1
+                ))
+            if r['peak'] > max(b['peak'], 2**16)*(1 + memory_tol):
+                regressions.append('{key} {s}: peak memory {m} B, baseline {b} B ({x:+.0%})'.format(
+                    key=key, s=s, m=r['peak'], b=b['peak'], x=r['peak']/max(b['peak'], 1) - 1
+                ))
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the network pipeline')
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true', help='store results as the baseline')
+    parser.add_argument('--output', help='also write results to this JSON file')
+    args = parser.parse_args()
+
+    cases = [c for grid in SUITES[args.suite] for c in expand_cases(**grid)]
+    results = run_suite(cases, repeat=args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.save:
+        # Cases of other suites already in the baseline are kept
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            baseline['cases'].update(results['cases'])
+            baseline['environment'] = results['environment']
+        else:
+            baseline = results
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=1)
+        print('Baseline saved to {b}'.format(b=args.baseline))
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline)
+        for r in regressions:
+            print('REGRESSION: ' + r)
+        print('{n} regressions against {b}'.format(n=len(regressions), b=args.baseline))
+        sys.exit(1 if regressions else 0)
+    else:
+        print('No baseline found at {b}, run with --save to store one'.format(b=args.baseline))
@@ -0,0 +1,143 @@
+"""
+StreamConvolver class is declared in this file. It computes link counts of a
+network online, as flow samples arrive one time step at a time.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from numpy.lib.stride_tricks import as_strided
+from network import conv_link_counts, stack_ms, CONV_BLOCK_BYTES
+
+class StreamConvolver():
+    """
+    Stateful convolution of a multi-step assignment matrix with a stream of
+    flow vectors. Only the tau_max most recent flow vectors are kept, in a ring
+    buffer which is stored twice in a row, so that the latest tau_max samples
+    always form a contiguous window in chronological order. The link counts of
+    a time step are then a single product between the window and the
+    multi-step matrix laid out horizontally, from step tau_max-1 to step 0.
+
+    For sparse networks, the multi-step matrix is kept as a single CSR matrix,
+    so memory and the cost of a time step scale with its number of nonzeros.
+    """
+
+    def __init__(self, net, matrix='P_ms'):
+        """Builds convolver from the assignment matrices of a network
+
+        Arguments:
+            net {Network} -- Network instance, where assignment matrices have
+                already been computed.
+
+        Keyword Arguments:
+            matrix {str} -- Multi-step assignment matrix to convolve flows
+                with, either 'P_ms' for O-flows or 'A_ms' for OD flows
+                (default: {'P_ms'})
+        """
+        if matrix not in ('P_ms', 'A_ms'):
+            raise ValueError('Matrix \'{m}\' is not recognised'.format(m=matrix))
+        M = getattr(net, matrix)
+        self.tau_max = len(M)
+        (self.n_l, self.n_in) = M[0].shape
+        # M[tau_max-1], ..., M[0] side by side, matching the window order
+        self.sparse = sp.issparse(M[0])
+        if self.sparse:
+            self.M_row = sp.csr_matrix(sp.hstack(M[::-1]), dtype=float)
+            self.M_row.sum_duplicates()
+            self.M = None
+        else:
+            self.M_row = np.hstack(M[::-1]).astype(float)
+            # Dense steps for block convolution
+            self.M = stack_ms(M)
+        self.buffer = np.zeros((2*self.tau_max, self.n_in))
+        self.y = np.zeros(self.n_l)
+        self.t = 0
+
+    def reset(self):
+        """
+        Clears flow history, as if no sample had been pushed.
+        """
+        self.buffer[:] = 0
+        self.t = 0
+
+    def window(self):
+        """Returns the tau_max most recent flow vectors, oldest first, as a
+        view of the ring buffer.
+        """
+        pos = (self.t - 1) % self.tau_max
+        return self.buffer[pos+1:pos+1+self.tau_max]
+
+    def push(self, x):
+        """Adds the flow vector of the next time step and returns the link
+        counts for that step. The returned array is reused, and overwritten
+        by the next call to push.
+
+        Arguments:
+            x {np.ndarray} -- Flow vector of the current time step.
+
+        Returns:
+            {np.ndarray} -- Link counts of the current time step.
+        """
+        pos = self.t % self.tau_max
+        self.buffer[pos] = x
+        self.buffer[pos+self.tau_max] = x
+        self.t += 1
+        window = self.window().reshape(-1)
+        if self.sparse:
+            self.y[:] = self.M_row @ window
+        else:
+            np.dot(self.M_row, window, out=self.y)
+        return self.y
+
+    def push_many(self, X):
+        """Adds the flow vectors of several consecutive time steps and returns
+        the link counts for all of them.
+
+        Arguments:
+            X {np.ndarray} -- Flow vectors of shape (n, n_in).
+
+        Returns:
+            {np.ndarray} -- Link counts of shape (n, n_l).
+        """
+        X = np.asarray(X, dtype=float)
+        n = X.shape[0]
+        if n == 0:
+            return np.zeros((0, self.n_l))
+        # Prepend the samples still in the ring buffer, then drop their counts
+        history = self.window()[1:]
+        flows = np.concatenate((history, X), axis=0)
+        if self.sparse:
+            Y = self.sparse_conv(flows)
+        else:
+            Y = conv_link_counts(self.M, flows)[self.tau_max-1:]
+        # Only the last tau_max samples remain in the ring buffer
+        kept = min(n, self.tau_max)
+        self.t += n - kept
+        for x in X[n-kept:]:
+            pos = self.t % self.tau_max
+            self.buffer[pos] = x
+            self.buffer[pos+self.tau_max] = x
+            self.t += 1
+        return Y
+
+    def sparse_conv(self, flows):
+        """Returns the link counts of the windows of tau_max consecutive flow
+        vectors, as products of the CSR matrix with blocks of windows.
+
+        Arguments:
+            flows {np.ndarray} -- Flow vectors of shape (n+tau_max-1, n_in).
+
+        Returns:
+            {np.ndarray} -- Link counts of shape (n, n_l).
+        """
+        n = flows.shape[0] - self.tau_max + 1
+        Y = np.empty((n, self.n_l))
+        # Window t is flows[t:t+tau_max], flattened, as a view
+        windows = as_strided(
+            flows, shape=(n, self.tau_max*self.n_in),
+            strides=(flows.strides[0], flows.strides[1]), writeable=False
+        )
+        block = max(1, CONV_BLOCK_BYTES // (8*self.tau_max*self.n_in))
+        for start in range(0, n, block):
+            stop = min(start+block, n)
+            Y[start:stop] = (self.M_row @ windows[start:stop].T).T
+        return Y
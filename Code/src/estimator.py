@@ -0,0 +1,638 @@
+"""
+Estimator class is declared in this file. O-flows X and O-flow assignment
+matrices P are estimated from link counts Y by alternating least squares, as in
+the Matlab CVX routines, directly from a Network and its Solver constraints.
+"""
+
+import numpy as np
+import scipy.sparse as sp
+import scipy.optimize as opt
+from scipy.linalg import solveh_banded, LinAlgError
+from scipy.linalg.blas import dsbmv
+from scipy.fft import dct, idct
+from scipy.sparse.linalg import LinearOperator
+from network import conv_link_counts, stack_ms, to_dense
+from operators import ToeplitzP, ToeplitzX
+
+def link_counts(P, X):
+    """Generates link counts from O-flow assignment matrices and O-flows, as
+    MVconv02pick. Boundary samples, where the convolution does not cover all
+    time steps of P, are set to zero.
+
+    Arguments:
+        P {np.ndarray} -- Multi-step O-flow assignment matrix of shape
+            (tau_max, n_l, n_o).
+        X {np.ndarray} -- O-flows of shape (n_o, n_t).
+
+    Returns:
+        {np.ndarray} -- Link counts of shape (n_l, n_t+tau_max-1).
+    """
+    (tau_max, n_l, _) = P.shape
+    n_t = X.shape[1]
+    Y = np.zeros((n_l, n_t+tau_max-1))
+    Y[:,:n_t] = conv_link_counts(P, X.T).T
+    Y[:,:tau_max-1] = 0
+    return Y
+
+def toeplitz_P(P, n_t):
+    """Builds block-Toeplitz matrix P_tilde such that link counts are
+    Y(:) = P_tilde @ X(:), with boundary samples set to zero, as Toep_P.
+
+    Arguments:
+        P {np.ndarray} -- Multi-step O-flow assignment matrix of shape
+            (tau_max, n_l, n_o).
+        n_t {int} -- Observation time horizon.
+
+    Returns:
+        {scipy.sparse.csr_matrix} -- P_tilde of shape
+            (n_l*(n_t+tau_max-1), n_o*n_t).
+    """
+    (tau_max, n_l, n_o) = P.shape
+    (taus, l_idxs, o_idxs) = np.nonzero(P)
+    vals = P[taus,l_idxs,o_idxs]
+    # Entry P[tau,l,o] multiplies X[o,t] in sample s = t+tau
+    ts = np.arange(n_t)
+    s = taus[:,None] + ts[None,:]
+    valid = (s >= tau_max-1) & (s <= n_t-1)
+    (k, t) = np.nonzero(valid)
+    return sp.csr_matrix(
+        (vals[k], (l_idxs[k] + n_l*s[k,t], o_idxs[k] + n_o*t)),
+        shape=(n_l*(n_t+tau_max-1), n_o*n_t)
+    )
+
+def toeplitz_X(X, tau_max):
+    """Builds block-Toeplitz matrix X_tilde such that link counts are
+    Y.T = X_tilde @ P2.T, where P2 is the P tensor stacked along its columns
+    as an (n_l, n_o*tau_max) matrix, with boundary samples set to zero, as
+    Toep_X.
+
+    Arguments:
+        X {np.ndarray} -- O-flows of shape (n_o, n_t).
+        tau_max {int} -- Maximum path length.
+
+    Returns:
+        {scipy.sparse.csr_matrix} -- X_tilde of shape
+            (n_t+tau_max-1, n_o*tau_max).
+    """
+    (n_o, n_t) = X.shape
+    (o_idxs, ts) = np.nonzero(X)
+    vals = X[o_idxs,ts]
+    taus = np.arange(tau_max)
+    s = ts[:,None] + taus[None,:]
+    valid = (s >= tau_max-1) & (s <= n_t-1)
+    (k, tau) = np.nonzero(valid)
+    return sp.csr_matrix(
+        (vals[k], (s[k,tau], o_idxs[k] + n_o*tau)),
+        shape=(n_t+tau_max-1, n_o*tau_max)
+    )
+
+def normal_banded(P, n_t):
+    """Builds the normal matrix P_tilde.T @ P_tilde of the X step in the upper
+    banded storage of solveh_banded, with O-flows ordered time-major, i.e. as
+    X(:). Block (t, t+d) of the normal matrix is the sum over steps k of
+    P[k].T @ P[k-d] for which sample t+k is not set to zero, so that only the
+    products of P steps are computed, and blocks follow from their cumulative
+    sums over k. The bandwidth is n_o*tau_max-1.
+
+    Arguments:
+        P {np.ndarray} -- Multi-step O-flow assignment matrix of shape
+            (tau_max, n_l, n_o).
+        n_t {int} -- Observation time horizon.
+
+    Returns:
+        {np.ndarray} -- Banded normal matrix of shape
+            (n_o*tau_max, n_o*n_t).
+    """
+    (tau_max, _, n_o) = P.shape
+    Q = np.zeros((tau_max+1, tau_max, n_o, n_o))
+    for d in range(tau_max):
+        Q[d+1:,d] = np.matmul(P[d:].transpose(0, 2, 1), P[:tau_max-d])
+    # C[k+1,d] is the sum of P[k'].T @ P[k'-d] up to step k
+    C = np.cumsum(Q, axis=0)
+    t = np.arange(n_t)[:,None]
+    d = np.arange(tau_max)[None,:]
+    # Steps k of block (t, t+d) have d <= k and tau_max-1 <= t+k <= n_t-1
+    hi = np.minimum(tau_max-1, n_t-1-t)
+    lo = np.maximum(d, tau_max-1-t)
+    blocks = np.where(
+        (lo <= hi)[...,None,None], C[hi+1,d] - C[lo,d], 0
+    )
+    u = n_o*tau_max - 1
+    n = n_o*n_t
+    o = np.arange(n_o)
+    i = o[None,None,:,None] + n_o*t[...,None,None]
+    j = o[None,None,None,:] + n_o*(t + d)[...,None,None]
+    (i, j) = np.broadcast_arrays(i, j)
+    upper = (i <= j) & (j < n)
+    ab = np.zeros((u+1, n))
+    ab[u + i[upper] - j[upper], j[upper]] = blocks[upper]
+    return ab
+
+def banded_row_sums(ab):
+    """Returns the sums of absolute values of the rows of a symmetric matrix
+    in upper banded storage, bounding its largest eigenvalue.
+    """
+    (u1, n) = ab.shape
+    (r, j) = np.indices(ab.shape)
+    i = j - (u1 - 1 - r)
+    valid = i >= 0
+    off = valid & (i != j)
+    return (
+        np.bincount(j[valid], weights=np.abs(ab[valid]), minlength=n)
+        + np.bincount(i[off], weights=np.abs(ab[off]), minlength=n)
+    )
+
+def solve_x_banded(P, Y, nonneg=True, reg=1e-10, max_iter=10000, tol=1e-8):
+    """Solves the X step
+        min ||Y - P_tilde X||_2  (s.t.  X >= 0)
+    through its banded normal equations, as built by normal_banded. Without
+    the nonnegativity constraint, they are solved by banded Cholesky
+    factorisation. Otherwise, the clipped unconstrained solution is refined by
+    accelerated projected gradient with adaptive restart, where products with
+    the normal matrix are banded.
+
+    O-flows which are not observed at all, such as early samples of origins
+    without paths of tau_max steps, make the normal matrix singular. A ridge
+    proportional to its mean diagonal sets them to zero.
+
+    Arguments:
+        P {np.ndarray or list} -- Multi-step O-flow assignment matrix of
+            shape (tau_max, n_l, n_o), or list of tau_max matrices.
+        Y {np.ndarray} -- Link counts of shape (n_l, n_t+tau_max-1).
+
+    Keyword Arguments:
+        nonneg {bool} -- Whether O-flows are constrained to be nonnegative
+            (default: {True})
+        reg {float} -- Ridge relative to the mean diagonal of the normal
+            matrix (default: {1e-10})
+        max_iter {int} -- Maximum number of projected gradient iterations
+            (default: {10000})
+        tol {float} -- Norm of the projected gradient, relative to that of
+            P_tilde.T @ Y(:), below which iterations stop (default: {1e-8})
+
+    Returns:
+        {np.ndarray} -- O-flows of shape (n_o, n_t).
+    """
+    if isinstance(P, list):
+        P = stack_ms(P)
+    (tau_max, _, n_o) = P.shape
+    n_t = Y.shape[1] - tau_max + 1
+    ab = normal_banded(P, n_t)
+    b = ToeplitzP(P, n_t).rmatvec(Y.reshape(-1, order='F'))
+    u = ab.shape[0] - 1
+    ab_reg = ab.copy()
+    ab_reg[u] += reg*max(np.mean(ab[u]), np.finfo(float).tiny)
+    x = solveh_banded(ab_reg, b)
+    if nonneg:
+        (x, converged) = banded_active_set(ab_reg, b, x)
+        if not converged:
+            x = banded_projected_gradient(ab_reg, b, x, max_iter, tol)
+    return x.reshape((n_o, n_t), order='F')
+
+def banded_active_set(ab, b, x, max_iter=50):
+    """Minimises x.T @ H @ x/2 - b.T @ x subject to x >= 0 by the primal-dual
+    active set method, where H is given in upper banded storage and x is the
+    unconstrained minimiser. Each iteration solves the normal equations by
+    banded Cholesky factorisation, with the rows and columns of the active
+    elements replaced by those of the identity.
+
+    Returns:
+        {(np.ndarray*bool)} -- Nonnegative solution, and whether the active
+            set has converged within max_iter iterations.
+    """
+    u = ab.shape[0] - 1
+    n = len(b)
+    k = np.arange(1, u+1)[:,None]
+    lam = np.zeros(n)
+    active = None
+    for _ in range(max_iter):
+        active_new = lam - x > 0
+        if active is not None and np.array_equal(active, active_new):
+            return (x, True)
+        active = active_new
+        idxs = np.nonzero(active)[0]
+        ab_act = ab.copy()
+        ab_act[:,idxs] = 0
+        # Entries of the active rows lie on the superdiagonals
+        cols = idxs[None,:] + k
+        rows = np.broadcast_to(u - k, cols.shape)
+        inside = cols < n
+        ab_act[rows[inside], cols[inside]] = 0
+        ab_act[u,idxs] = 1
+        rhs = np.where(active, 0, b)
+        try:
+            x = solveh_banded(ab_act, rhs)
+        except LinAlgError:
+            break
+        lam = np.where(active, dsbmv(u, 1., ab, x) - b, 0)
+    return (np.maximum(x, 0), False)
+
+def banded_projected_gradient(ab, b, x, max_iter, tol):
+    """Minimises x.T @ H @ x/2 - b.T @ x subject to x >= 0 by accelerated
+    projected gradient, where H is given in upper banded storage.
+    """
+    u = ab.shape[0] - 1
+    step = 1/max(np.max(banded_row_sums(ab)), np.finfo(float).tiny)
+    b_norm = max(np.linalg.norm(b), np.finfo(float).tiny)
+    z = x.copy()
+    theta = 1.
+    for _ in range(max_iter):
+        grad = dsbmv(u, 1., ab, z) - b
+        x_new = np.maximum(z - step*grad, 0)
+        # Restart momentum when it points uphill
+        if np.dot(grad, x_new - x) > 0:
+            theta = 1.
+            z = x
+            continue
+        theta_new = (1 + np.sqrt(1 + 4*theta**2))/2
+        z = x_new + (theta - 1)/theta_new*(x_new - x)
+        (x, theta) = (x_new, theta_new)
+        grad = dsbmv(u, 1., ab, x) - b
+        projected = np.where(x > 0, grad, np.minimum(grad, 0))
+        if np.linalg.norm(projected) <= tol*b_norm:
+            break
+    return x
+
+def operator_norm(A, n_iter=100, rtol=1e-6):
+    """Estimates the spectral norm of a matrix or linear operator by power
+    iteration on A.T @ A, started from a vector of ones.
+
+    Arguments:
+        A {scipy.sparse.spmatrix or LinearOperator} -- Operator.
+
+    Keyword Arguments:
+        n_iter {int} -- Maximum number of iterations (default: {100})
+        rtol {float} -- Relative change of the estimate below which
+            iterations stop (default: {1e-6})
+
+    Returns:
+        {float} -- Estimated spectral norm.
+    """
+    v = np.ones(A.shape[1])/np.sqrt(A.shape[1])
+    norm = 0
+    for _ in range(n_iter):
+        w = A.T @ (A @ v)
+        norm_new = np.sqrt(np.linalg.norm(w))
+        if norm_new == 0:
+            return 0.
+        v = w/np.linalg.norm(w)
+        if abs(norm_new - norm) <= rtol*norm_new:
+            break
+        norm = norm_new
+    return norm_new
+
+class Estimator():
+    """
+    Alternating least squares estimation of O-flows and O-flow assignment
+    matrices from link counts. Each iteration:
+        - estimates X for fixed P, by bounded least squares (X >= 0)
+        - estimates P for fixed X, by least squares subject to the Solver
+            constraints in standard form
+    until the normalised mean square error (NMSE) of link counts is below a
+    threshold.
+
+    Single-step models are handled as multi-step models with tau_max equal to
+    1, where no boundary samples are discarded.
+    """
+
+    def __init__(
+            self, net, solver, nmse_stop=5e-5, max_iter=3000, matrix_free=False,
+            x_step='lsq', verbose=False
+        ):
+        """Constructor of Estimator class
+
+        Arguments:
+            net {Network} -- Network instance, where the path assignment
+                matrix has already been computed.
+            solver {Solver} -- Solver instance, where single-step or
+                multi-step constraints have already been computed.
+
+        Keyword Arguments:
+            nmse_stop {float} -- NMSE of link counts below which iterations
+                stop (default: {5e-5})
+            max_iter {int} -- Maximum number of iterations (default: {3000})
+            matrix_free {bool} -- Whether to apply P_tilde and X_tilde as
+                ToeplitzP and ToeplitzX operators instead of building them,
+                for long time horizons (default: {False})
+            x_step {str} -- Solver of the X step, either 'lsq' for bounded
+                least squares on P_tilde, or 'banded' for solve_x_banded on
+                the banded normal equations (default: {'lsq'})
+            verbose {bool} -- Whether to print NMSE at each iteration
+                (default: {False})
+        """
+        self.net = net
+        self.step = solver.step
+        self.tau_max = net.tau_max if self.step == 'multi' else 1
+        self.n_l = len(net.links)
+        self.n_o = len(net.origins)
+        (self.A_eq, self.b_eq, self.A_ineq, self.b_ineq, self.lb, self.ub) = (
+            solver.get_standard_form()
+        )
+        # Elements of P forced to zero by C4 are left out of the P step, as
+        # well as the constraints which only involve such elements, which
+        # would otherwise make the constraint Jacobian singular
+        self.free = self.ub > 0
+        (self.A_eq_free, self.b_eq_free) = self.restrict(self.A_eq, self.b_eq)
+        (self.A_ineq_free, self.b_ineq_free) = self.restrict(
+            self.A_ineq, self.b_ineq
+        )
+        self.nmse_stop = nmse_stop
+        self.max_iter = max_iter
+        self.matrix_free = matrix_free
+        if x_step not in ('lsq', 'banded'):
+            raise ValueError('X step \'{x}\' is not recognised'.format(x=x_step))
+        self.x_step = x_step
+        self.verbose = verbose
+
+    def restrict(self, A, b):
+        """Returns constraint matrix A restricted to the free elements of P,
+        and its right-hand side b, without the rows left empty.
+        """
+        A = sp.csr_matrix(A)[:,self.free]
+        rows = np.diff(A.indptr) > 0
+        return (A[rows], b[rows])
+
+    def to_tensor(self, P):
+        """Returns P as a dense (tau_max, n_l, n_o) tensor, from a list of
+        matrices, a tensor, or a single-step matrix.
+        """
+        if isinstance(P, list):
+            return stack_ms(P)
+        P = to_dense(P)
+        if P.ndim == 2:
+            return P[None]
+        return P
+
+    def from_tensor(self, P):
+        """Returns P in the format of the model: (n_l, n_o) for single-step
+        models, (tau_max, n_l, n_o) for multi-step models.
+        """
+        if self.step == 'single':
+            return P[0]
+        return P
+
+    def estimate_X(self, Y, P):
+        """Estimates O-flows for fixed P, by solving
+            min ||Y - P_tilde X||_2  s.t.  X >= 0
+
+        Arguments:
+            Y {np.ndarray} -- Link counts of shape (n_l, n_t+tau_max-1).
+            P {np.ndarray} -- O-flow assignment matrix tensor.
+
+        Returns:
+            {np.ndarray} -- O-flows of shape (n_o, n_t).
+        """
+        if self.x_step == 'banded':
+            return solve_x_banded(P, Y)
+        n_t = Y.shape[1] - self.tau_max + 1
+        P_tilde = self.p_tilde(P, n_t)
+        res = opt.lsq_linear(
+            P_tilde, Y.reshape(-1, order='F'), bounds=(0, np.inf)
+        )
+        return res.x.reshape((self.n_o, n_t), order='F')
+
+    def estimate_X_sparse(
+            self, Y, P, error_bound, X0=None, max_iter=5000, tol=1e-6
+        ):
+        """Estimates O-flows for fixed P as the nonnegative flows with the
+        sparsest DCT, as estimate_X_multi_sparsity, by solving
+            min ||D X||_1  s.t.  ||Y - P_tilde X||_2 <= error_bound, X >= 0
+        where D is the orthonormal DCT-II of each origin row.
+
+        The problem is solved by the primal-dual method of Chambolle and Pock
+        (linearised ADMM), where each iteration applies D, its inverse,
+        P_tilde and its adjoint once, and no matrix is solved. Link counts are
+        rescaled by the norm of P_tilde, so that the dual steps of both
+        constraints are balanced, and the ratio of primal and dual steps is
+        adapted at each iteration to balance the primal and dual residuals,
+        as in Goldstein et al. (2015).
+
+        Iterations start from the nonnegative least squares O-flows, whose
+        residual is the smallest achievable. If it exceeds the bound, no
+        O-flows are feasible, and they are returned at once. The bound is
+        otherwise only met in the limit, so that if iterations stop beyond
+        it, the O-flows are moved towards the least squares O-flows until it
+        is met.
+
+        Arguments:
+            Y {np.ndarray} -- Link counts of shape (n_l, n_t+tau_max-1).
+            P {np.ndarray} -- O-flow assignment matrix tensor.
+            error_bound {float} -- Bound on the norm of link count residuals.
+
+        Keyword Arguments:
+            X0 {np.ndarray} -- Nonnegative least squares O-flows of shape
+                (n_o, n_t), as given by estimate_X, computed if None
+                (default: {None})
+            max_iter {int} -- Maximum number of iterations (default: {5000})
+            tol {float} -- Primal and dual residuals, relative to the dual and
+                primal terms, below which iterations stop, once the residual
+                is within the bound (default: {1e-6})
+
+        Returns:
+            {(np.ndarray*bool)} -- Nonnegative O-flows of shape (n_o, n_t),
+                and whether they meet the bound, and iterations have converged
+                within max_iter iterations. The O-flows meet the bound
+                whenever any do.
+        """
+        n_t = Y.shape[1] - self.tau_max + 1
+        P_tilde = self.p_tilde(P, n_t)
+        norm = operator_norm(P_tilde)
+        if norm == 0:
+            return (np.zeros((self.n_o, n_t)), True)
+        y = Y.reshape(-1, order='F')/norm
+        bound = error_bound/norm
+        # Steps satisfy tau*sigma*||[D; P_tilde/norm]||^2 < 1, and only their
+        # ratio is adapted
+        tau = sigma = 0.99/np.sqrt(2)
+        (alpha, eta, delta) = (0.5, 0.95, 1.5)
+
+        def forward(X):
+            return P_tilde @ X.reshape(-1, order='F')/norm
+
+        def adjoint(U, u):
+            return idct(U, norm='ortho', axis=1) + (
+                P_tilde.T @ u
+            ).reshape((self.n_o, n_t), order='F')/norm
+
+        X_ls = self.estimate_X(Y, P) if X0 is None else np.maximum(X0, 0)
+        residual_ls = np.linalg.norm(forward(X_ls) - y)
+        if residual_ls > bound:
+            return (X_ls, False)
+        X = X_ls
+        (DX, AX) = (dct(X, norm='ortho', axis=1), forward(X))
+        U = np.zeros((self.n_o, n_t))
+        u = np.zeros(len(y))
+        KtU = np.zeros((self.n_o, n_t))
+        converged = False
+        for _ in range(max_iter):
+            # Primal step: projection onto X >= 0
+            X_new = np.maximum(X - tau*KtU, 0)
+            (DX_new, AX_new) = (dct(X_new, norm='ortho', axis=1), forward(X_new))
+            # Dual step of the L1 norm, at the extrapolated X, where D X_bar
+            # and P_tilde X_bar follow by linearity: projection onto the unit
+            # box
+            U_new = np.clip(U + sigma*(2*DX_new - DX), -1, 1)
+            # Dual step of the residual bound, by Moreau decomposition of the
+            # projection onto the ball of radius bound around y
+            AX_bar = 2*AX_new - AX
+            v = u/sigma + AX_bar - y
+            v_norm = np.linalg.norm(v)
+            if v_norm > bound:
+                v *= bound/v_norm
+            u_new = u + sigma*(AX_bar - y - v)
+            KtU_new = adjoint(U_new, u_new)
+            # Primal and dual residuals, whose balance sets the step ratio
+            p = np.linalg.norm((X - X_new)/tau - (KtU - KtU_new))
+            d = np.sqrt(
+                np.linalg.norm((U - U_new)/sigma - (DX - DX_new))**2
+                + np.linalg.norm((u - u_new)/sigma - (AX - AX_new))**2
+            )
+            if p > delta*d:
+                (tau, sigma, alpha) = (tau/(1-alpha), sigma*(1-alpha), alpha*eta)
+            elif p < d/delta:
+                (tau, sigma, alpha) = (tau*(1-alpha), sigma/(1-alpha), alpha*eta)
+            (X, DX, AX, U, u, KtU) = (X_new, DX_new, AX_new, U_new, u_new, KtU_new)
+            if (np.linalg.norm(AX - y) <= bound*(1+tol)
+                    and p <= tol*max(1, np.linalg.norm(KtU))
+                    and d <= tol*max(1, np.linalg.norm(DX), np.linalg.norm(AX))):
+                converged = True
+                break
+        residual = np.linalg.norm(AX - y)
+        if residual > bound:
+            # The residual is convex, so that it is within the bound along
+            # the segment from the step where it meets it
+            step = (residual - bound)/(residual - residual_ls)
+            X = (1 - step)*X + step*X_ls
+        return (X, converged)
+
+    def estimate_P(self, Y, X, P0):
+        """Estimates O-flow assignment matrix for fixed X, by solving
+            min ||Y - P X_tilde||_F  s.t.  Solver constraints
+
+        Arguments:
+            Y {np.ndarray} -- Link counts of shape (n_l, n_t+tau_max-1).
+            X {np.ndarray} -- O-flows of shape (n_o, n_t).
+            P0 {np.ndarray} -- O-flow assignment matrix tensor used as
+                starting point.
+
+        Returns:
+            {np.ndarray} -- O-flow assignment matrix tensor.
+        """
+        if self.matrix_free:
+            (fun, jac, hess) = self.p_step_operator(Y, X)
+        else:
+            (fun, jac, hess) = self.p_step_matrix(Y, X)
+
+        constraints = []
+        if self.A_eq_free.shape[0] > 0:
+            constraints.append(opt.LinearConstraint(
+                self.A_eq_free, self.b_eq_free, self.b_eq_free
+            ))
+        if self.A_ineq_free.shape[0] > 0:
+            constraints.append(opt.LinearConstraint(
+                self.A_ineq_free, -np.inf, self.b_ineq_free
+            ))
+        p0 = np.clip(
+            self.to_tensor(P0).transpose(1, 2, 0).reshape(-1, order='F')[self.free],
+            self.lb[self.free], self.ub[self.free]
+        )
+        res = opt.minimize(
+            fun, p0, jac=jac, hess=hess,
+            method='trust-constr',
+            bounds=opt.Bounds(self.lb[self.free], self.ub[self.free]),
+            constraints=constraints
+        )
+        p = np.zeros(len(self.free))
+        p[self.free] = np.clip(res.x, self.lb[self.free], self.ub[self.free])
+        return p.reshape(
+            (self.n_l, self.n_o, self.tau_max), order='F'
+        ).transpose(2, 0, 1)
+
+    def p_tilde(self, P, n_t):
+        """Returns P_tilde as a ToeplitzP operator or as a sparse matrix.
+        """
+        if self.matrix_free:
+            return ToeplitzP(P, n_t)
+        return toeplitz_P(P, n_t)
+
+    def p_step_matrix(self, Y, X):
+        """Returns objective, gradient and Hessian of the P step over the free
+        elements of P, with X_tilde built as a sparse matrix.
+        """
+        X_tilde = toeplitz_X(X, self.tau_max)
+        # Y(:) = kron(X_tilde, I) p, with p the vectorised P
+        A = sp.kron(X_tilde, sp.identity(self.n_l), format='csc')[:,self.free]
+        y = Y.reshape(-1, order='F')
+        H = (A.T @ A).tocsr()
+        g = A.T @ y
+
+        def fun(p):
+            r = A @ p - y
+            return 0.5*(r @ r)
+
+        def jac(p):
+            return H @ p - g
+
+        def hess(p):
+            return H
+
+        return (fun, jac, hess)
+
+    def p_step_operator(self, Y, X):
+        """Returns objective, gradient and Hessian of the P step over the free
+        elements of P, with X_tilde applied as a ToeplitzX operator.
+        """
+        X_tilde = ToeplitzX(X, self.tau_max)
+        n_free = np.count_nonzero(self.free)
+        p_full = np.zeros(len(self.free))
+
+        def apply(p):
+            # Free elements to P2.T, of shape (n_o*tau_max, n_l)
+            p_full[self.free] = p
+            return X_tilde @ p_full.reshape((self.n_l, -1), order='F').T
+
+        def apply_adjoint(R):
+            return (X_tilde.H @ R).T.reshape(-1, order='F')[self.free]
+
+        def fun(p):
+            r = apply(p) - Y.T
+            return 0.5*np.sum(r*r)
+
+        def jac(p):
+            return apply_adjoint(apply(p) - Y.T)
+
+        H = LinearOperator(
+            (n_free, n_free), matvec=lambda v: apply_adjoint(apply(v)),
+            dtype=float
+        )
+
+        def hess(p):
+            return H
+
+        return (fun, jac, hess)
+
+    def estimate(self, Y, P_init):
+        """Runs alternating estimation of X and P.
+
+        Arguments:
+            Y {np.ndarray} -- Link counts of shape (n_l, n_t+tau_max-1), as
+                returned by link_counts.
+            P_init {np.ndarray or list} -- Initial O-flow assignment matrix.
+
+        Returns:
+            {(np.ndarray*np.ndarray*list)} -- Estimated P, estimated X, and
+                NMSE of link counts at each iteration.
+        """
+        P = self.to_tensor(P_init)
+        Y_norm = np.linalg.norm(Y)
+        nmse_history = []
+        for k in range(self.max_iter):
+            X = self.estimate_X(Y, P)
+            P = self.estimate_P(Y, X, P)
+            nmse = np.linalg.norm(link_counts(P, X) - Y)/Y_norm
+            nmse_history.append(nmse)
+            if self.verbose:
+                print('NMSE_Y: {nmse:6.4e}, k: {k}'.format(nmse=nmse, k=k+1))
+            if nmse < self.nmse_stop:
+                break
+        return (self.from_tensor(P), X, nmse_history)
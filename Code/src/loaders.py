@@ -0,0 +1,256 @@
+"""
+Readers of network topologies stored in files are declared in this file:
+sparse adjacency matrices (.mat, .npz, or Matlab scripts such as
+AdjacentMatrixGEANT.m), weighted edge lists and GraphML. Files are parsed one
+line or one element at a time, and links are returned as arrays, so that
+memory scales with the number of links. Networks are built from them with
+the Network.from_* constructors.
+"""
+
+import re
+import array
+import numpy as np
+import scipy.io as io
+import scipy.sparse as sp
+import xml.etree.ElementTree as ET
+
+# Assignments of a Matlab adjacency script, A(i,j)=value;
+MATLAB_ENTRY = re.compile(r'\b(\w+)\s*\(\s*(\d+)\s*,\s*(\d+)\s*\)\s*=\s*([^;,\s]+)')
+MATLAB_SIZE = re.compile(r'^\s*n\s*=\s*(\d+)\s*;')
+
+def read_adjacency(source, key=None):
+    """Reads a weighted adjacency matrix, where element [i,j] is the cost of
+    link ij, and zeros stand for missing links.
+
+    Arguments:
+        source {str or np.ndarray or scipy.sparse matrix} -- Matrix, or path to
+            a .npz file saved by scipy.sparse.save_npz, or to a .mat file.
+
+    Keyword Arguments:
+        key {str} -- Name of the matrix in a .mat file, which may be left out
+            if the file holds a single variable (default: {None})
+
+    Returns:
+        {(list*np.ndarray*np.ndarray)} -- Node labels, which are the row
+            indexes, links of shape (n_links, 2) and cost of each link.
+    """
+    if isinstance(source, str):
+        if source.endswith('.npz'):
+            adj = sp.load_npz(source)
+        elif source.endswith('.mat'):
+            variables = {
+                k: v for (k, v) in io.loadmat(source).items()
+                if not k.startswith('__')
+            }
+            if key is None:
+                if len(variables) != 1:
+                    raise ValueError('File {f} holds variables {v}, pass the key of the adjacency matrix'.format(
+                        f=source, v=sorted(variables)
+                    ))
+                key = next(iter(variables))
+            adj = variables[key]
+        elif source.endswith('.m'):
+            return read_matlab_adjacency(source)
+        else:
+            raise ValueError('Format of {f} is not recognised'.format(f=source))
+    else:
+        adj = source
+    adj = sp.coo_matrix(adj)
+    if adj.shape[0] != adj.shape[1]:
+        raise ValueError('Adjacency matrix of shape {s} is not square'.format(s=adj.shape))
+    adj.sum_duplicates()
+    nonzero = adj.data != 0
+    links = np.stack((adj.row[nonzero], adj.col[nonzero]), axis=1)
+    return (list(range(adj.shape[0])), links, adj.data[nonzero].astype(float))
+
+def read_matlab_adjacency(path):
+    """Reads an adjacency matrix written as a Matlab script of element
+    assignments A(i,j)=value, such as AdjacentMatrixGEANT.m. The number of
+    nodes is read from a line n=...; if any, and is the largest index
+    otherwise. Matlab indexes, from 1, are shifted to start from 0.
+
+    Returns:
+        {(list*np.ndarray*np.ndarray)} -- Node labels, which are the row
+            indexes, links of shape (n_links, 2) and cost of each link.
+    """
+    rows = array.array('q')
+    cols = array.array('q')
+    costs = array.array('d')
+    n_nodes = None
+    with open(path) as f:
+        for (n_line, line) in enumerate(f, 1):
+            line = line.split('%', 1)[0]
+            size = MATLAB_SIZE.match(line)
+            if size:
+                n_nodes = int(size.group(1))
+            for (_, i, j, value) in MATLAB_ENTRY.findall(line):
+                if int(i) < 1 or int(j) < 1:
+                    raise ValueError('Line {n} of {f} assigns element ({i},{j}), Matlab indexes start from 1'.format(
+                        n=n_line, f=path, i=i, j=j
+                    ))
+                rows.append(int(i) - 1)
+                cols.append(int(j) - 1)
+                costs.append(parse_cost(value, 'Line {n}'.format(n=n_line), path))
+    largest = max(max(rows, default=-1), max(cols, default=-1)) + 1
+    if n_nodes is None:
+        n_nodes = largest
+    elif largest > n_nodes:
+        raise ValueError('File {f} assigns elements of node {i}, but declares n={n}'.format(
+            f=path, i=largest, n=n_nodes
+        ))
+    return read_adjacency(sp.coo_matrix(
+        (np.frombuffer(costs), (np.frombuffer(rows, np.int64), np.frombuffer(cols, np.int64))),
+        shape=(n_nodes, n_nodes)
+    ))
+
+def read_edge_list(path, delimiter=None, comments='#', directed=True):
+    """Reads a text file with one link per line, as the labels of its start
+    and end nodes, optionally followed by its cost.
+
+    Arguments:
+        path {str} -- Path to the edge list.
+
+    Keyword Arguments:
+        delimiter {str} -- Separator of the fields of a line, any whitespace
+            if None (default: {None})
+        comments {str} -- Prefix of comment lines (default: {'#'})
+        directed {bool} -- Whether links are directed. Otherwise, each line
+            gives links in both directions, with the same cost
+            (default: {True})
+
+    Returns:
+        {(list*np.ndarray*np.ndarray)} -- Node labels, in numeric order if all
+            labels are integers and in order of appearance otherwise, links of
+            shape (n_links, 2) indexing the labels, and cost of each link, or
+            None if no line has a cost.
+    """
+    idxs = {}
+    ends = array.array('q')
+    costs = array.array('d')
+    weighted = None
+    with open(path) as f:
+        for (n_line, line) in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith(comments):
+                continue
+            fields = line.split(delimiter)
+            if len(fields) not in (2, 3):
+                raise ValueError('Line {n} of {f} does not hold a link'.format(n=n_line, f=path))
+            if weighted is None:
+                weighted = len(fields) == 3
+            elif weighted != (len(fields) == 3):
+                raise ValueError('Line {n} of {f} does not give a cost like the other lines'.format(
+                    n=n_line, f=path
+                ))
+            for label in fields[:2]:
+                ends.append(idxs.setdefault(label.strip(), len(idxs)))
+            if weighted:
+                costs.append(parse_cost(fields[2], 'Line {n}'.format(n=n_line), path))
+    (labels, links) = sort_labels(list(idxs), np.frombuffer(ends, np.int64).reshape(-1, 2))
+    costs = np.frombuffer(costs) if weighted else None
+    if not directed:
+        (links, costs) = add_reverse_links(links, costs)
+    return (labels, links, costs)
+
+def read_graphml(path, cost='cost'):
+    """Reads a GraphML file element by element. Links are directed according
+    to the default of the graph, overridden by the directed attribute of each
+    edge, and undirected edges give links in both directions.
+
+    Arguments:
+        path {str} -- Path to the GraphML file.
+
+    Keyword Arguments:
+        cost {str} -- Name of the edge attribute holding link costs
+            (default: {'cost'})
+
+    Returns:
+        {(list*np.ndarray*np.ndarray)} -- Node labels in order of declaration,
+            links of shape (n_links, 2) indexing the labels, and cost of each
+            link, or None if the file has no such attribute.
+    """
+    idxs = {}
+    ends = array.array('q')
+    costs = array.array('d')
+    undirected = array.array('b')
+    (cost_key, default_cost) = (None, None)
+    edge_default = 'directed'
+    try:
+        for (event, elem) in ET.iterparse(path, events=('start', 'end')):
+            tag = elem.tag.rsplit('}', 1)[-1]
+            if event == 'start':
+                if tag == 'graph':
+                    edge_default = elem.get('edgedefault', 'directed')
+                continue
+            if tag == 'key':
+                if elem.get('attr.name') == cost and elem.get('for') in ('edge', 'all'):
+                    cost_key = elem.get('id')
+                    default = [d.text for d in elem if d.tag.rsplit('}', 1)[-1] == 'default']
+                    if default:
+                        default_cost = parse_cost(
+                            default[0], 'Key {k}'.format(k=cost_key), path
+                        )
+            elif tag == 'node':
+                idxs.setdefault(elem.get('id'), len(idxs))
+                elem.clear()
+            elif tag == 'edge':
+                for end in (elem.get('source'), elem.get('target')):
+                    if end not in idxs:
+                        raise ValueError('Node {n} of {f} was not declared in the list of nodes'.format(
+                            n=end, f=path
+                        ))
+                    ends.append(idxs[end])
+                value = default_cost
+                for data in elem:
+                    if data.get('key') == cost_key and cost_key is not None:
+                        value = parse_cost(data.text, 'Edge {s} -> {t}'.format(
+                            s=elem.get('source'), t=elem.get('target')
+                        ), path)
+                costs.append(np.nan if value is None else value)
+                directed = elem.get('directed', 'true' if edge_default == 'directed' else 'false')
+                undirected.append(directed.lower() == 'false')
+                elem.clear()
+    except ET.ParseError as e:
+        raise ValueError('File {f} is not well-formed XML: {e}'.format(f=path, e=e)) from e
+    links = np.frombuffer(ends, np.int64).reshape(-1, 2)
+    costs = np.frombuffer(costs) if cost_key is not None else None
+    if costs is not None and np.any(np.isnan(costs)):
+        raise ValueError('Some edges of {f} have no {c} and there is no default'.format(f=path, c=cost))
+    undirected = np.frombuffer(undirected, np.int8).astype(bool)
+    if np.any(undirected):
+        links = np.concatenate((links, links[undirected][:,::-1]))
+        if costs is not None:
+            costs = np.concatenate((costs, costs[undirected]))
+    return (list(idxs), links, costs)
+
+def parse_cost(text, where, path):
+    """Returns a link cost read from a file, or raises a ValueError naming
+    where it was read, such as 'Line 3', if it is not a number.
+    """
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        raise ValueError('{w} of {f} gives cost {c!r}, which is not a number'.format(
+            w=where, f=path, c=text
+        )) from None
+
+def sort_labels(labels, links):
+    """Orders node labels numerically when they are all integers, and
+    reindexes links accordingly. Labels are kept in order otherwise.
+    """
+    try:
+        values = [int(label) for label in labels]
+    except ValueError:
+        return (labels, links)
+    order = np.argsort(values, kind='stable')
+    new_idxs = np.empty(len(labels), np.int64)
+    new_idxs[order] = np.arange(len(labels))
+    return ([values[i] for i in order], new_idxs[links])
+
+def add_reverse_links(links, costs):
+    """Adds the reverse of all links, with the same costs.
+    """
+    links = np.concatenate((links, links[:,::-1]))
+    if costs is not None:
+        costs = np.concatenate((costs, costs))
+    return (links, costs)
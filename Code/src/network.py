@@ -5,13 +5,53 @@ are effectively derived from an instance of a network.
 
 VISUALISE = False   # Set to True if working with Jupyter notebooks 
                     # in order to visualise networks and assignment matrices
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+import inspect
+import heapq
 import numpy as np
 import networkx as nx
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+from scipy.fft import next_fast_len, rfft, irfft
+from numpy.lib.stride_tricks import as_strided
 from copy import deepcopy
+from profiler import Profiler, profiled
+from loaders import read_adjacency, read_edge_list, read_graphml
+from topology import GENERATORS
 if VISUALISE:
     from visualiser import Vis
 np.set_printoptions(linewidth=150)
 
+# Shortest multi-step assignment matrix for which link counts are convolved
+# with FFT, and memory budget of the windows gathered by direct convolution
+FFT_MIN_TAU = 128
+CONV_BLOCK_BYTES = 2**26
+# Version of the layout of cached topologies, part of their content hash
+CACHE_VERSION = 1
+
+def predecessor_paths(pred, source, target):
+    """Returns all shortest paths from source to target, given the shortest
+    path predecessors of each node from source, as computed by
+    Network.shortest_path_predecessors.
+    """
+    if target not in pred:
+        return []
+    paths = []
+    # Partial paths, from target backwards
+    stack = [[target]]
+    while stack:
+        path = stack.pop()
+        if path[-1] == source:
+            paths.append(path[::-1])
+            continue
+        for node in pred[path[-1]]:
+            stack.append(path + [node])
+    return paths
+
 def mat_conv(M, v):
     """Performs convolution of assignment matrix with flow vector and returns
     result. len(M) zeros are prepended to the flow vector to obtain a result
@@ -29,14 +69,197 @@ def mat_conv(M, v):
         {list} -- List of flow vectors, from 0 to n_t-1. Each element in the
             list corresponds to one time sample.
     """
-    n_t = len(v)        # the observation time horizon
-    tau_max = len(M)    # the maximum path length
-    full_flows = [np.zeros(len(v[0])) for _ in range(tau_max-1)] + v
-    res = [np.zeros(M[0].shape[0])] * n_t
-    for t in range(n_t):                    # 0 to n_T-1
-        for tau in range(tau_max):          # 0 to tau_max-1
-            res[t] = res[t] + M[tau] @ full_flows[t-tau+tau_max-1]
-    return res
+    return list(conv_link_counts(stack_ms(M), np.array(v)))
+
+def conv_link_counts(M, X, method='auto'):
+    """Performs causal convolution of a multi-step assignment matrix with
+    flows, so that Y[t] is the sum over tau of M[tau] @ X[t-tau], where flows
+    before time 0 are zero.
+
+    The direct method gathers, for every time sample, the tau_max most recent
+    flow vectors through a strided view and contracts them with M in a single
+    tensor product. Time is processed in blocks so that the gathered windows
+    never exceed CONV_BLOCK_BYTES. The FFT method multiplies the spectra of M
+    and X along time, and only pays off for long assignment matrices since its
+    cost per sample does not grow with tau_max.
+
+    Arguments:
+        M {np.ndarray or list} -- Multi-step assignment matrix of shape
+            (tau_max, n_l, n_o), or list of tau_max matrices.
+        X {np.ndarray} -- Flows of shape (n_t, n_o), or (trials, n_t, n_o).
+
+    Keyword Arguments:
+        method {str} -- Either 'direct', 'fft', or 'auto' to use FFT when
+            tau_max is at least FFT_MIN_TAU (default: {'auto'})
+
+    Returns:
+        {np.ndarray} -- Link counts of shape (n_t, n_l), or
+            (trials, n_t, n_l).
+    """
+    if isinstance(M, list):
+        M = stack_ms(M)
+    X = np.asarray(X, dtype=float)
+    (tau_max, n_l, n_o) = M.shape
+    n_t = X.shape[-2]
+    if method == 'auto':
+        method = 'fft' if tau_max >= FFT_MIN_TAU else 'direct'
+
+    if method == 'fft':
+        n_fft = next_fast_len(n_t + tau_max - 1, real=True)
+        X_f = rfft(X, n_fft, axis=-2)
+        M_f = rfft(M, n_fft, axis=0)
+        Y_f = np.matmul(M_f, X_f[...,None])[...,0]
+        return irfft(Y_f, n_fft, axis=-2)[...,:n_t,:]
+    elif method == 'direct':
+        batch = X.shape[:-2]
+        X_pad = np.concatenate((np.zeros(batch + (tau_max-1, n_o)), X), axis=-2)
+        # Window j of sample t is flow X[t-tau] with tau = tau_max-1-j
+        M_rev = M[::-1]
+        Y = np.empty(batch + (n_t, n_l))
+        block = max(1, CONV_BLOCK_BYTES // (8*tau_max*n_o*int(np.prod(batch))))
+        strides = X_pad.strides
+        for start in range(0, n_t, block):
+            stop = min(start+block, n_t)
+            windows = as_strided(
+                X_pad[...,start:,:],
+                shape=batch + (stop-start, tau_max, n_o),
+                strides=strides[:-2] + (strides[-2], strides[-2], strides[-1]),
+                writeable=False
+            )
+            Y[...,start:stop,:] = np.tensordot(windows, M_rev, axes=([-2,-1],[0,2]))
+        return Y
+    else:
+        raise ValueError('Method \'{m}\' is not recognised'.format(m=method))
+
+def segment_sum(values, segments, n_segments):
+    """Sums values belonging to the same segment, independently for each row.
+
+    Arguments:
+        values {np.ndarray} -- 2-dimensional array of shape (K, n).
+        segments {np.ndarray} -- Segment index of each of the n columns.
+        n_segments {int} -- Total number of segments.
+
+    Returns:
+        {np.ndarray} -- Sums of shape (K, n_segments).
+    """
+    rows = values.shape[0]
+    ids = segments[None,:] + n_segments*np.arange(rows)[:,None]
+    return np.bincount(
+        ids.ravel(), weights=values.ravel(), minlength=rows*n_segments
+    ).reshape(rows, n_segments)
+
+def random_segment_fractions(shape, segments, n_segments, min_prop, max_prop, rng=np.random):
+    """Draws random integer proportions and normalises them within each
+    segment. Proportions of a segment are drawn again until they are not all
+    zero.
+
+    Arguments:
+        shape {(int*int)} -- Shape (K, n) of the proportions to draw.
+        segments {np.ndarray} -- Segment index of each of the n columns.
+        n_segments {int} -- Total number of segments.
+        min_prop {int} -- Minimum proportion.
+        max_prop {int} -- Maximum proportion, excluded.
+
+    Keyword Arguments:
+        rng {np.random.RandomState} -- Random number generator (default:
+            {np.random})
+
+    Returns:
+        {np.ndarray} -- Fractions of shape (K, n), summing to 1 over each
+            segment of each row.
+    """
+    props = rng.randint(min_prop, max_prop, shape)
+    sums = segment_sum(props, segments, n_segments)
+    redraw = (sums == 0)[:,segments]
+    while np.any(redraw):
+        props[redraw] = rng.randint(min_prop, max_prop, np.sum(redraw))
+        sums = segment_sum(props, segments, n_segments)
+        redraw = (sums == 0)[:,segments]
+    return props/sums[:,segments]
+
+def sum_ms(M):
+    """Sums a multi-step matrix over its time steps, preserving its storage.
+
+    Arguments:
+        M {list} -- Multi-step matrix, from 0 to tau_max-1. List of
+            2-dimensional arrays or SciPy sparse matrices.
+
+    Returns:
+        {np.ndarray or scipy.sparse matrix} -- Single-step matrix.
+    """
+    if sp.issparse(M[0]):
+        res = M[0].copy()
+        for m in M[1:]:
+            res = res + m
+        return res
+    return sum(m for m in M)
+
+def to_dense(M):
+    """Returns a dense copy of a matrix which may be stored as a SciPy sparse
+    matrix. Dense arrays are returned unchanged.
+
+    Arguments:
+        M {np.ndarray or scipy.sparse matrix} -- Matrix to densify.
+
+    Returns:
+        {np.ndarray} -- Dense version of M.
+    """
+    if sp.issparse(M):
+        return M.toarray()
+    return M
+
+def set_columns(M, cols, values):
+    """Returns a matrix with some columns replaced, preserving its storage.
+    Dense arrays are updated in place, and sparse matrices rebuilt.
+
+    Arguments:
+        M {np.ndarray or scipy.sparse matrix} -- Matrix to update.
+        cols {np.ndarray} -- Indexes of the columns to replace.
+        values {np.ndarray or scipy.sparse matrix} -- New columns, of shape
+            (n_rows, len(cols)).
+
+    Returns:
+        {np.ndarray or scipy.sparse matrix} -- Updated matrix.
+    """
+    if not sp.issparse(M):
+        M[:,cols] = to_dense(values)
+        return M
+    replaced = np.zeros(M.shape[1], bool)
+    replaced[cols] = True
+    M = sp.csr_matrix(M, copy=True)
+    M.data[replaced[M.indices]] = 0
+    M.eliminate_zeros()
+    scatter = sp.csr_matrix(
+        (np.ones(len(cols)), (np.arange(len(cols)), cols)),
+        shape=(len(cols), M.shape[1])
+    )
+    return sp.csr_matrix(M + sp.csr_matrix(values) @ scatter)
+
+def nnz_ms(M):
+    """Returns the number of nonzeros of a multi-step matrix, whose steps
+    may be dense arrays or SciPy sparse matrices.
+    """
+    return sum(
+        m.count_nonzero() if sp.issparse(m) else np.count_nonzero(m) for m in M
+    )
+
+def stack_ms(M, axis=0):
+    """Stacks a multi-step matrix into a dense 3-dimensional array. This is
+    the only point where sparse multi-step matrices get densified, so it should
+    only be called when a dense result is explicitly needed.
+
+    Arguments:
+        M {list} -- Multi-step matrix, from 0 to tau_max-1. List of
+            2-dimensional arrays or SciPy sparse matrices.
+
+    Keyword Arguments:
+        axis {int} -- Axis of the result along which time steps are
+            stacked (default: {0})
+
+    Returns:
+        {np.ndarray} -- 3-dimensional dense array.
+    """
+    return np.stack([to_dense(m) for m in M], axis=axis)
 
 class Network():
     """
@@ -45,7 +268,7 @@ class Network():
     and algorithms. https://networkx.github.io/
     """
 
-    def __init__(self, uni_bi='bi', h=3, w=3, nodes=None, links=None, seed=None, verbose=False):
+    def __init__(self, uni_bi='bi', h=3, w=3, nodes=None, links=None, seed=None, verbose=False, sparse=False, profile=False):
         """Builds network and checks validity of links with respect to nodes
         
         Arguments:
@@ -61,6 +284,16 @@ class Network():
                 (default: {None})
             seed {int} -- Random seed used throughout random generations 
                 (default: {None})
+            sparse {bool} -- Whether to store path assignment matrices Delta,
+                assignment matrices A, P and flow proportions as SciPy sparse
+                CSR matrices, one per time step for multi-step matrices.
+                Memory then scales with the number of nonzeros instead of
+                links x paths x tau_max (default: {False})
+            profile {bool or Profiler} -- Whether to record the time, memory
+                and size counters of the pipeline stages run on the network,
+                and by the Solver and ToMatlab instances built from it, in
+                the profiler attribute. A Profiler may be passed to share it
+                between networks (default: {False})
         """
         self.G = nx.DiGraph()
         if uni_bi:
@@ -78,19 +311,183 @@ class Network():
 
         self.nodes = list(self.G.nodes)
         self.links = list(self.G.edges)
-        if seed:
-            np.random.seed(seed)
-        else:
-            np.random.seed()
+        # Own random number generator, so that networks built in the same
+        # process, or in parallel, do not share the global random state
+        self.rng = np.random.RandomState(seed)
 
         # Verify links contain valid nodes  only
+        node_set = set(self.nodes)
         for link in self.links:
-            if link[0] not in self.nodes:
+            if link[0] not in node_set:
                 raise ValueError('Node {n} was not declared in the list of nodes'.format(n=link[0]))
-            elif link[1] not in self.nodes:
+            elif link[1] not in node_set:
                 raise ValueError('Node {n} was not declared in the list of nodes'.format(n=link[1]))
 
         self.verbose = verbose
+        self.sparse = sparse
+        if isinstance(profile, Profiler):
+            self.profiler = profile
+        else:
+            self.profiler = Profiler() if profile else None
+
+    @classmethod
+    def from_arrays(cls, links, costs=None, labels=None, n_nodes=None, **kwargs):
+        """Builds network from an array of links between nodes 0 to n-1. Links
+        are sorted, so that their order does not depend on that of the input,
+        and repeated links are merged.
+
+        Arguments:
+            links {np.ndarray} -- Start and end node of each link, of shape
+                (n_links, 2).
+
+        Keyword Arguments:
+            costs {np.ndarray} -- Cost of each link, or None for rigid costs
+                (default: {None})
+            labels {list} -- Original label of each node, kept in the
+                node_labels attribute (default: {None})
+            n_nodes {int} -- Number of nodes, one more than the largest node
+                of links if None (default: {None})
+
+        Other keyword arguments are passed to the constructor.
+
+        Returns:
+            {Network} -- Network whose link costs are assigned.
+        """
+        links = np.asarray(links, dtype=np.int64).reshape(-1, 2)
+        if n_nodes is None:
+            n_nodes = len(labels) if labels is not None else int(np.max(links, initial=-1)) + 1
+        loops = links[:,0] == links[:,1]
+        if np.any(loops):
+            i = links[loops][0,0]
+            raise ValueError('Node {n} has a self-loop'.format(
+                n=labels[i] if labels is not None else i
+            ))
+        order = np.lexsort((links[:,1], links[:,0]))
+        links = links[order]
+        repeated = np.all(links[1:] == links[:-1], axis=1)
+        if costs is not None:
+            costs = np.asarray(costs, dtype=float)[order]
+            if np.any(costs[1:][repeated] != costs[:-1][repeated]):
+                (i, j) = links[1:][repeated & (costs[1:] != costs[:-1])][0]
+                if labels is not None:
+                    (i, j) = (labels[i], labels[j])
+                raise ValueError('Link {l} is given different costs'.format(l=(i, j)))
+            costs = costs[np.concatenate(([True], ~repeated))]
+        links = links[np.concatenate(([True], ~repeated))]
+        # Nodes are added in order, then links in sorted order, so that the
+        # links of the graph are in the same order as costs
+        net = cls(
+            uni_bi=None, nodes=range(n_nodes), links=links.tolist(), **kwargs
+        )
+        net.node_labels = list(labels) if labels is not None else list(range(n_nodes))
+        if costs is None:
+            net.assign_link_costs('rigid')
+        else:
+            if np.any(costs <= 0):
+                raise ValueError('Link costs must be positive')
+            net.assign_link_costs(costs.tolist())
+        return net
+
+    @classmethod
+    def from_topology(
+            cls, generator, *args, seed=None, verbose=False, sparse=False,
+            profile=False, **kwargs
+        ):
+        """Builds network from a synthetic topology of topology.py, with rigid
+        link costs until assign_link_costs is called.
+
+        Arguments:
+            generator {str or function} -- Name of the generator in
+                topology.GENERATORS, such as 'waxman' or 'fat_tree', or
+                function returning the number of nodes and the links.
+
+        Keyword Arguments:
+            seed {int} -- Random seed of the network. Random generators are
+                seeded with a seed derived from it, so that link costs are
+                not drawn from the same stream as the topology
+                (default: {None})
+
+        Other arguments are passed to the generator, and verbose, sparse and
+        profile to the constructor.
+        """
+        if isinstance(generator, str):
+            if generator not in GENERATORS:
+                raise ValueError('Generator \'{g}\' is not recognised'.format(g=generator))
+            generator = GENERATORS[generator]
+        if 'seed' in inspect.signature(generator).parameters:
+            kwargs['seed'] = None if seed is None else int(
+                np.random.SeedSequence(seed).generate_state(1)[0]
+            )
+        (n_nodes, links) = generator(*args, **kwargs)
+        return cls.from_arrays(
+            links, n_nodes=n_nodes, seed=seed, verbose=verbose, sparse=sparse,
+            profile=profile
+        )
+
+    @classmethod
+    def from_adjacency(cls, source, key=None, **kwargs):
+        """Builds network from a weighted adjacency matrix, where element
+        [i,j] is the cost of link ij and zeros stand for missing links.
+        Matrices whose nonzeros are all 1 give rigid costs.
+
+        Arguments:
+            source {str or np.ndarray or scipy.sparse matrix} -- Matrix, or
+                path to a .npz file saved by scipy.sparse.save_npz, a .mat
+                file, or a Matlab script of assignments A(i,j)=1; such as
+                AdjacentMatrixGEANT.m.
+
+        Keyword Arguments:
+            key {str} -- Name of the matrix in a .mat file holding several
+                variables (default: {None})
+
+        Other keyword arguments are passed to the constructor.
+        """
+        (labels, links, costs) = read_adjacency(source, key=key)
+        if np.all(costs == 1):
+            costs = None
+        return cls.from_arrays(links, costs, labels=labels, **kwargs)
+
+    @classmethod
+    def from_edge_list(cls, path, delimiter=None, comments='#', directed=True, **kwargs):
+        """Builds network from a text file with one link per line, given as
+        the labels of its start and end nodes, optionally followed by its
+        cost. Links are rigid if no cost is given. Nodes are numbered in
+        numeric order of their labels if these are all integers, and in order
+        of appearance otherwise.
+
+        Arguments:
+            path {str} -- Path to the edge list.
+
+        Keyword Arguments:
+            delimiter {str} -- Separator of the fields of a line, any
+                whitespace if None (default: {None})
+            comments {str} -- Prefix of comment lines (default: {'#'})
+            directed {bool} -- Whether links are directed, otherwise each
+                line gives links in both directions (default: {True})
+
+        Other keyword arguments are passed to the constructor.
+        """
+        (labels, links, costs) = read_edge_list(
+            path, delimiter=delimiter, comments=comments, directed=directed
+        )
+        return cls.from_arrays(links, costs, labels=labels, **kwargs)
+
+    @classmethod
+    def from_graphml(cls, path, cost='cost', **kwargs):
+        """Builds network from a GraphML file. Nodes are numbered in order of
+        declaration, and undirected edges give links in both directions.
+
+        Arguments:
+            path {str} -- Path to the GraphML file.
+
+        Keyword Arguments:
+            cost {str} -- Name of the edge attribute holding link costs, which
+                are rigid if the file has no such attribute (default: {'cost'})
+
+        Other keyword arguments are passed to the constructor.
+        """
+        (labels, links, costs) = read_graphml(path, cost=cost)
+        return cls.from_arrays(links, costs, labels=labels, **kwargs)
 
     def assign_link_costs(self, costs='rigid'):
         """Assigns costs to all links, generating them if necessary
@@ -107,16 +504,16 @@ class Network():
         if costs == 'rigid':
             nx.set_edge_attributes(self.G, 1, 'cost')
         elif costs == 'mult_int':
-            rand_costs = np.random.randint(1,5,len(self.G.edges))
+            rand_costs = self.rng.randint(1,5,len(self.G.edges))
             c_dict = {e:rand_costs[i]
                 for (i,e) in enumerate(self.G.edges)
             }
             nx.set_edge_attributes(self.G, c_dict, 'cost')
         elif costs == 'real':
-            rand_costs = np.random.rand(len(self.G.edges))*4
+            rand_costs = self.rng.rand(len(self.G.edges))*4
             # Do not want any link cost to be zero
             while np.any(np.isclose(rand_costs, 0)):
-                rand_costs = np.random.rand(len(self.G.edges))*4
+                rand_costs = self.rng.rand(len(self.G.edges))*4
             c_dict = {e:rand_costs[i]
                 for (i,e) in enumerate(self.G.edges)
             }
@@ -130,18 +527,60 @@ class Network():
             raise ValueError('argument to `costs` not recognised')
         self.c = [cost for (_,_,cost) in self.G.edges.data('cost')]
 
-    def compute_spl_matrix(self):
+    def compute_spl_matrix(self, engine='csgraph'):
         """Computes shortest path length matrix F, which gives minimal cost to
         reach any node i from any origin o.
+
+        Keyword Arguments:
+            engine {str} -- Either 'csgraph' to run compiled all-pairs
+                Dijkstra (or breadth-first search for rigid costs) from
+                scipy.sparse.csgraph on a CSR adjacency matrix of link costs,
+                or 'networkx' for the reference NetworkX implementation
+                (default: {'csgraph'})
+
+        Predecessors on shortest paths are not returned by csgraph, which
+        only keeps one of them when several paths have the same length. All
+        of them are found from F instead, see shortest_path_predecessors.
+
+        Returns:
+            {np.ndarray} -- Shortest path length matrix F.
         """
-        # Initialise to infinity for all nodes, if a node is not reachable
-        # f will remain infinity
-        self.F = np.ones((len(self.nodes), len(self.nodes))) * np.inf
-        for spl in nx.shortest_path_length(self.G, weight='cost'):
-            for node in spl[1].keys():
-                self.F[node, spl[0]] = spl[1][node]
+        if engine == 'csgraph':
+            dist = csgraph.shortest_path(
+                self.cost_adjacency(),
+                method='D',
+                unweighted=all(cst == 1 for cst in self.c)
+            )
+            # Distances are computed from each origin, F is indexed by node
+            # first and origin second
+            self.F = np.ascontiguousarray(dist.T)
+        elif engine == 'networkx':
+            # Initialise to infinity for all nodes, if a node is not reachable
+            # f will remain infinity
+            self.F = np.ones((len(self.nodes), len(self.nodes))) * np.inf
+            for spl in nx.shortest_path_length(self.G, weight='cost'):
+                for node in spl[1].keys():
+                    self.F[node, spl[0]] = spl[1][node]
+        else:
+            raise ValueError('Engine \'{e}\' is not recognised'.format(e=engine))
+        return self.F
+
+    def cost_adjacency(self):
+        """Returns the CSR adjacency matrix of link costs, where element
+        [i,j] is the cost of link ij.
+        """
+        links = np.array(self.links).reshape(-1, 2)
+        return sp.csr_matrix(
+            (np.array(self.c, dtype=float), (links[:,0], links[:,1])),
+            shape=(len(self.nodes), len(self.nodes))
+        )
 
-    def find_all_paths(self, tau_max=4, assignment='random'):
+    @profiled('find_all_paths', lambda net: {
+        'paths': len(net.paths), 'tau_max': net.tau_max
+    })
+    def find_all_paths(
+            self, tau_max=4, assignment='random', spl_engine='csgraph', k_paths=None
+        ):
         """Finds all feasible loop-free paths in given network, which are
         shorter than tau_max. For this, shortest path matrix F is also computed.
         
@@ -151,8 +590,16 @@ class Network():
                 longest shortest path (default: {4})
             assignment {str} -- Assignment, either 'random' or 'shortest_path'.
                 Both assignments are loop-free. (default: {'random'})
+            spl_engine {str} -- Engine used to compute the shortest path
+                length matrix, see compute_spl_matrix (default: {'csgraph'})
+            k_paths {int} -- With random assignment, number of paths kept for
+                each OD pair, the k shortest ones, instead of all simple paths
+                within tau_max, whose number grows exponentially with tau_max
+                on dense networks (default: {None})
         """
-        self.compute_spl_matrix()
+        if k_paths is not None and k_paths < 1:
+            raise ValueError('k_paths must be at least 1, got {k}'.format(k=k_paths))
+        self.compute_spl_matrix(engine=spl_engine)
         self.tau_max = tau_max
         if self.tau_max == 'mpl':
             self.tau_max = int(np.ceil((np.max(self.F[self.F < np.inf]))))
@@ -160,40 +607,41 @@ class Network():
             print('No paths given current link costs, reassigning costs')
             self.assign_link_costs(costs=self.costs)
         self.assignment = assignment
+        self.k_paths = k_paths if assignment == 'random' else None
         self.paths = []
         if self.assignment == 'shortest_path':
-            for n1 in self.G.nodes:
-                for n2 in self.G.nodes:
-                    if n1 != n2:
-                        try:
-                            s_paths = nx.algorithms.shortest_paths.generic.all_shortest_paths(
-                                self.G, n1, n2, weight='cost'
-                            )
-                            for p in s_paths:
-                                self.paths.append(p)
-                        except nx.exception.NetworkXNoPath:
-                            continue
+            # Shortest paths between nodes further apart than the maximum
+            # path length are removed below, so they are not enumerated. The
+            # margin keeps paths whose summed costs round differently
+            mpl = min(np.amax(self.F), self.tau_max)
+            self.paths = self.shortest_paths(mpl)
         elif self.assignment == 'random':
-            for n1 in self.G.nodes:
-                for n2 in self.G.nodes:
-                    if n1 != n2:
-                        try:
-                            s_paths = nx.algorithms.simple_paths.all_simple_paths(
-                                self.G, n1, n2, cutoff=self.tau_max
-                            )
-                            for p in s_paths:
-                                self.paths.append(p)
-                        except nx.exception.NetworkXNoPath:
-                            continue
+            # With rigid costs, F counts hops, and nodes more than tau_max
+            # hops apart have no path within the cutoff
+            rigid = all(cst == 1 for cst in self.c)
+            pairs = self.node_pairs(self.tau_max if rigid else np.inf)
+            if self.k_paths is not None:
+                link_idxs = {link:l for (l,link) in enumerate(self.links)}
+                for (n1, n2) in pairs:
+                    self.paths.extend(self.k_shortest_paths(n1, n2, link_idxs))
+            else:
+                for (n1, n2) in pairs:
+                    try:
+                        s_paths = nx.algorithms.simple_paths.all_simple_paths(
+                            self.G, n1, n2, cutoff=self.tau_max
+                        )
+                        for p in s_paths:
+                            self.paths.append(p)
+                    except nx.exception.NetworkXNoPath:
+                        continue
         else:
             raise ValueError('Assignment \'{a}\' is not recognised'.format(a=assignment))
         # Store paths as sequence of link indexes as well
-        self.paths_links = []
-        for path in self.paths:
-            tmp_plink = []
-            for n_i in range(len(path)-1):
-                tmp_plink.append(self.links.index((path[n_i],path[n_i+1])))
-            self.paths_links.append(tmp_plink)
+        link_idxs = {link:l for (l,link) in enumerate(self.links)}
+        self.paths_links = [
+            [link_idxs[(path[n_i],path[n_i+1])] for n_i in range(len(path)-1)]
+            for path in self.paths
+        ]
 
         # Remove paths that exceed the maximum path length
         if self.assignment == 'shortest_path':
@@ -220,6 +668,144 @@ class Network():
                     tm=self.tau_max)
                 )
 
+    def node_pairs(self, max_dist=np.inf, sources=None):
+        """Returns the pairs of distinct nodes (n1, n2) such that n2 is
+        reachable from n1 with a shortest path length of at most max_dist,
+        by increasing n1 then n2. Unreachable nodes are left out even for an
+        infinite max_dist.
+
+        Keyword Arguments:
+            max_dist {float} -- Maximum shortest path length (default: {inf})
+            sources {list} -- Nodes n1 to consider, all nodes if None
+                (default: {None})
+        """
+        nodes = np.array(self.nodes)
+        sources = nodes if sources is None else np.asarray(sources, dtype=int)
+        dist = self.F[np.ix_(nodes, sources)].T
+        close = (
+            (dist <= max_dist) & (dist < np.inf) &
+            (sources[:,None] != nodes[None,:])
+        )
+        (i1, i2) = np.nonzero(close)
+        return zip(sources[i1].tolist(), nodes[i2].tolist())
+
+    def shortest_paths(self, mpl=np.inf, sources=None):
+        """Returns all shortest paths between pairs of distinct nodes at a
+        shortest path length of at most mpl, up to rounding.
+
+        Keyword Arguments:
+            mpl {float} -- Maximum path length, all reachable pairs if inf
+                (default: {inf})
+            sources {list} -- Start nodes of the paths, all nodes if None
+                (default: {None})
+
+        Returns:
+            {int list list} -- Paths as sequences of nodes.
+        """
+        paths = []
+        pred = {}
+        links = np.array(self.links).reshape(-1, 2)
+        costs = np.array(self.c, dtype=float)
+        for (n1, n2) in self.node_pairs(mpl*(1 + 1e-9), sources):
+            if n1 not in pred:
+                # Shortest path predecessors from each origin are found
+                # once, for all its destinations
+                pred = {n1: self.shortest_path_predecessors(
+                    n1, mpl*(1 + 1e-6), links, costs
+                )}
+            paths.extend(predecessor_paths(pred[n1], n1, n2))
+        return paths
+
+    def shortest_path_predecessors(self, source, cutoff=np.inf, links=None, costs=None):
+        """Returns all predecessors of each node on its shortest paths from a
+        source, from the shortest path lengths of F: i precedes j if link ij
+        is tight, that is if F[i,source] plus the cost of ij is F[j,source].
+        Sums are compared exactly, as by Dijkstra's algorithm, which sets F.
+
+        Arguments:
+            source {int} -- Start node of the paths.
+
+        Keyword Arguments:
+            cutoff {float} -- Maximum shortest path length of the nodes whose
+                predecessors are returned (default: {inf})
+            links {np.ndarray} -- Start and end node of each link, of shape
+                (n_links, 2), computed if None (default: {None})
+            costs {np.ndarray} -- Cost of each link, computed if None
+                (default: {None})
+
+        Returns:
+            {dict} -- Predecessors of each node reachable within cutoff, an
+                empty list for the source.
+        """
+        if links is None:
+            links = np.array(self.links).reshape(-1, 2)
+        if costs is None:
+            costs = np.array(self.c, dtype=float)
+        dist = self.F[:,source]
+        (d_i, d_j) = (dist[links[:,0]], dist[links[:,1]])
+        tight = (d_i + costs == d_j) & (d_j <= cutoff) & (links[:,1] != source)
+        pred = {source: []}
+        for (i, j) in links[tight].tolist():
+            pred.setdefault(j, []).append(i)
+        return pred
+
+    def k_shortest_paths(self, n1, n2, link_idxs=None):
+        """Returns the k_paths shortest simple paths from n1 to n2 of cost and
+        number of links at most tau_max, by increasing cost, ties being
+        broken by their sequence of link indexes.
+
+        Paths are extended best first, in order of their cost plus the
+        shortest path length of F from their end node to n2, then of their
+        sequence of link indexes, so that complete paths come out in the
+        order above, and the search stops at the k_paths-th one. Among paths
+        of the same cost, the first link indexes are followed depth first, so
+        that ties do not have to be enumerated.
+
+        Arguments:
+            n1 {int} -- Start node.
+            n2 {int} -- End node.
+
+        Keyword Arguments:
+            link_idxs {dict} -- Index of each link, computed if None
+                (default: {None})
+
+        Returns:
+            {int list list} -- Paths as sequences of nodes.
+        """
+        if link_idxs is None:
+            link_idxs = {link:l for (l,link) in enumerate(self.links)}
+        # Shortest path length from each node to n2
+        dist = self.F[n2]
+        # The margin keeps paths whose summed costs round differently
+        max_cost = self.tau_max*(1 + 1e-9)
+        found = []
+        if not dist[n1] <= max_cost:
+            return found
+        heap = [(dist[n1], [], 0, [n1])]
+        while heap and len(found) < self.k_paths:
+            (_, pl, cost, path) = heapq.heappop(heap)
+            node = path[-1]
+            if node == n2:
+                if cost <= self.tau_max:
+                    found.append(path)
+                continue
+            if len(pl) == self.tau_max:
+                continue
+            for n_next in self.G.succ[node]:
+                if n_next in path:
+                    continue
+                l = link_idxs[(node, n_next)]
+                cost_next = cost + self.c[l]
+                if cost_next + dist[n_next] <= max_cost:
+                    heapq.heappush(heap, (
+                        cost_next + dist[n_next], pl + [l], cost_next, path + [n_next]
+                    ))
+        return found
+
+    @profiled('generate_od_pairs', lambda net: {
+        'od_pairs': len(net.od_pairs), 'origins': len(net.origins),
+        'max_paths_per_od': np.max(net.paths_per_od)
+    })
     def generate_od_pairs(self):
         """
         Generate set of Origin-Destination pairs for the given network.
@@ -235,7 +821,20 @@ class Network():
         self.destinations = sorted(list(
             set(map(lambda odp: odp[-1], self.od_pairs))
         ))
+        # Index of the OD pair of each path, and of the origin of each OD pair
+        od_idxs = {od:od_i for (od_i,od) in enumerate(self.od_pairs)}
+        o_idxs = {o:o_i for (o_i,o) in enumerate(self.origins)}
+        self.path_od = np.array(
+            [od_idxs[(p[0],p[-1])] for p in self.paths], dtype=int
+        )
+        self.od_origin = np.array(
+            [o_idxs[od[0]] for od in self.od_pairs], dtype=int
+        )
+        self.paths_per_od = np.bincount(self.path_od, minlength=len(self.od_pairs))
 
+    @profiled('compute_path_assignment_matrix', lambda net: {
+        'paths': len(net.paths), 'Delta_ms_nnz': net.Delta_tall.nnz
+    })
     def compute_path_assignment_matrix(self):
         """
         Computes deterministic path assignment matrix, which depends on
@@ -243,61 +842,347 @@ class Network():
         NB: Random assignment is currently only supported for rigid costs.
         """
         assert(self.paths), 'Paths were not determined, or no paths exist.'
-        # Initialise path assignment matrix and arrival/departure matrices
-        self.Delta = np.zeros((len(self.links), len(self.paths)))
-        self.Delta_ms = [
-            np.zeros((len(self.links), len(self.paths)), np.int8)
-            for _ in range(self.tau_max)
-        ]
-        self.T_minus = np.zeros((len(self.nodes), len(self.nodes)))
-        self.T_plus = np.zeros((len(self.nodes), len(self.nodes)))
-        # Compute
+        # Initialise arrival/departure matrices. The path assignment matrix
+        # is only built once all its nonzeros (tau, link, path) are known
         if self.assignment == 'random':
             assert(all(cst == 1 for cst in self.c)), 'Random assignment only supported for rigid models'
-            self.lc = np.ones((len(self.links), len(self.origins)))
-            for l_idx in range(len(self.links)):
-                for p_idx in range(len(self.paths_links)):
-                    for tau in range(self.tau_max):
-                        if tau < len(self.paths_links[p_idx]):
-                            self.Delta_ms[tau][l_idx,p_idx] = (
-                                l_idx == self.paths_links[p_idx][tau]
-                            )
+            self.T_minus = np.zeros((len(self.nodes), len(self.nodes)))
+            self.T_plus = np.zeros((len(self.nodes), len(self.nodes)))
         elif self.assignment == 'shortest_path':
             self.T_minus = np.ceil(self.F)
             #self.T_minus = self.T_minus.astype(int)
             self.T_plus = np.floor(self.F + 1)
             #self.T_plus = self.T_plus.astype(int)
-            self.lc = np.zeros((len(self.links), len(self.origins)))
-            for (l_i,l) in enumerate(self.links):
-                for (o_i,o) in enumerate(self.origins):
-                    # Difference may be negative, or zero whenever the link is
-                    # not used by the origin
-                    if (
-                        self.T_plus[l[0],o] != np.inf and
-                        self.T_plus[l[1],o] != np.inf
-                    ):
-                        self.lc[l_i,o_i] = max(
-                            self.T_minus[l[1],o] - self.T_plus[l[0],o] + 1,
-                            1
-                        )
-                    else:
-                        self.lc[l_i,o_i] = 1
-
-
-            for (p_idx,pl) in enumerate(self.paths_links):
-                o = self.links[pl[0]][0]
-                for l_idx in pl:
-                    i = self.links[l_idx][0]
-                    j = self.links[l_idx][1]
-                    for tau in range(self.tau_max):
-                        if (
-                            tau+1 >= self.T_plus[i,o] and
-                            tau+1 <= self.T_minus[j,o] and
-                            self.T_minus[j,o] != np.inf
-                            ):
-                            self.Delta_ms[tau][l_idx,p_idx] = 1
+        self.compute_lc()
+        self.set_path_assignment_matrix(*self.path_assignment_nonzeros())
+        # Origins changed by each repair of the topology, see repair_topology
+        self.repair_log = []
+
+    def compute_lc(self):
+        """Computes the number of time steps lc[l,o] during which the flow of
+        each origin o traverses each link l, from arrival/departure matrices.
+        """
+        self.lc = self.link_time_steps(
+            np.array(self.links).reshape(-1, 2), np.array(self.origins)
+        )
+
+    def link_time_steps(self, links, origins):
+        """Returns the block of lc for some links and origins.
+
+        Arguments:
+            links {np.ndarray} -- Start and end node of each link, of shape
+                (n, 2).
+            origins {np.ndarray} -- Origin nodes.
+        """
+        if self.assignment == 'random':
+            return np.ones((len(links), len(origins)))
+        # Departure time from start of link ij and arrival time at
+        # its end, for each link/origin pair
+        T_plus = self.T_plus[:,origins]
+        T_plus_i = T_plus[links[:,0]]
+        T_plus_j = T_plus[links[:,1]]
+        T_minus_j = self.T_minus[:,origins][links[:,1]]
+        # Difference may be negative, or zero whenever the link is
+        # not used by the origin
+        with np.errstate(invalid='ignore'):
+            return np.where(
+                (T_plus_i != np.inf) & (T_plus_j != np.inf),
+                np.maximum(T_minus_j - T_plus_i + 1, 1),
+                1
+            )
+
+    def path_assignment_nonzeros(self, paths_links=None):
+        """Returns the nonzeros of the path assignment matrix in the columns of
+        some paths, from arrival/departure matrices for shortest path
+        assignment.
+
+        Keyword Arguments:
+            paths_links {list} -- Paths as sequences of link indexes, all paths
+                of the network if None (default: {None})
+
+        Returns:
+            {(np.ndarray*np.ndarray*np.ndarray)} -- Time step, link index and
+                path index within paths_links of each nonzero.
+        """
+        # Every (path, hop) pair of the paths, flattened
+        (p_idxs, hops, l_idxs, os) = self.path_hop_arrays(paths_links)
+        if self.assignment == 'random':
+            # With rigid costs, the hop-th link of a path is traversed at
+            # time step tau=hop
+            in_tau = hops < self.tau_max
+            return (hops[in_tau], l_idxs[in_tau], p_idxs[in_tau])
+        links = np.array(self.links).reshape(-1, 2)
+        # Interval of time steps during which each hop of each path is
+        # traversed, tested for all time steps at once
+        T_plus_hop = self.T_plus[links[l_idxs,0], os]
+        T_minus_hop = self.T_minus[links[l_idxs,1], os]
+        steps = np.arange(1, self.tau_max+1)
+        in_interval = (
+            (steps >= T_plus_hop[:,None]) &
+            (steps <= T_minus_hop[:,None]) &
+            (T_minus_hop != np.inf)[:,None]
+        )
+        (hop_idxs, taus) = np.nonzero(in_interval)
+        return (taus, l_idxs[hop_idxs], p_idxs[hop_idxs])
+
+    def set_path_assignment_matrix(self, taus, l_idxs, p_idxs):
+        """Builds the multi-step, stacked and single-step path assignment
+        matrices from the coordinates of their nonzeros.
+        """
+        self.Delta_ms = self.build_ms_matrix(
+            taus,
+            l_idxs,
+            p_idxs,
+            (len(self.links), len(self.paths)),
+            np.int8
+        )
+        # All steps stacked vertically, so that products with proportions
+        # are computed for every time step at once
+        self.Delta_tall = sp.csr_matrix(
+            (np.ones(len(taus), np.int8), (taus*len(self.links) + l_idxs, p_idxs)),
+            shape=(self.tau_max*len(self.links), len(self.paths))
+        )
         # Obtain single-step path assignment matrix as sum of the steps
-        self.Delta = sum(d for d in self.Delta_ms)
+        self.Delta = sum_ms(self.Delta_ms)
+
+    def path_hop_arrays(self, paths_links=None):
+        """Flattens paths into index arrays with one entry per hop of each
+        path, so that per-hop quantities can be computed with broadcasting.
+
+        Keyword Arguments:
+            paths_links {list} -- Paths as sequences of link indexes, all paths
+                of the network if None (default: {None})
+
+        Returns:
+            {(np.ndarray*np.ndarray*np.ndarray*np.ndarray)} -- Path index, hop
+                number within the path, link index and origin node of each hop.
+        """
+        if paths_links is None:
+            paths_links = self.paths_links
+        lengths = np.array([len(pl) for pl in paths_links], dtype=int)
+        p_idxs = np.repeat(np.arange(len(paths_links)), lengths)
+        starts = np.cumsum(lengths) - lengths
+        hops = np.arange(np.sum(lengths)) - np.repeat(starts, lengths)
+        l_idxs = np.fromiter(
+            (l for pl in paths_links for l in pl), dtype=int, count=np.sum(lengths)
+        )
+        links = np.array(self.links).reshape(-1, 2)
+        os = np.repeat(links[l_idxs[starts],0], lengths)
+        return (p_idxs, hops, l_idxs, os)
+
+    def path_origin_incidence(self):
+        """Returns the boolean incidence matrix between paths and origins,
+        obtained by composing the path to OD and OD to origin mappings.
+
+        Returns:
+            {scipy.sparse.csr_matrix} -- Matrix of shape (n_paths, n_o), True
+                where the path starts at the origin.
+        """
+        n_p = len(self.paths)
+        return sp.csr_matrix(
+            (np.ones(n_p, bool), (np.arange(n_p), self.od_origin[self.path_od])),
+            shape=(n_p, len(self.origins))
+        )
+
+    def build_topology(
+            self, costs='rigid', tau_max=4, assignment='random', cache_dir=None,
+            spl_engine='csgraph', k_paths=None
+        ):
+        """Assigns link costs, finds all paths, generates OD pairs and computes
+        the path assignment matrix. If a cache directory is given, the
+        resulting topology is saved there under a content hash of its inputs,
+        and loaded from there instead of being computed when already cached.
+
+        Link costs are always assigned, so that the random state of the
+        network is the same whether the topology is cached or not.
+
+        Keyword Arguments:
+            costs {str or list} -- Link costs, see assign_link_costs, or None
+                to keep the costs already assigned, as by the from_*
+                constructors (default: {'rigid'})
+            tau_max {int or str} -- Maximum path length, see find_all_paths
+                (default: {4})
+            assignment {str} -- Assignment, see find_all_paths
+                (default: {'random'})
+            cache_dir {str} -- Directory of cached topologies, or None to
+                always compute the topology (default: {None})
+            spl_engine {str} -- Engine used to compute the shortest path
+                length matrix, see compute_spl_matrix (default: {'csgraph'})
+            k_paths {int} -- Number of paths of each OD pair with random
+                assignment, see find_all_paths (default: {None})
+
+        Returns:
+            {bool} -- Whether the topology was loaded from the cache.
+        """
+        if costs is not None:
+            self.assign_link_costs(costs)
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, self.topology_key(tau_max, assignment, k_paths))
+            if os.path.isdir(path):
+                self.load_topology(path)
+                return True
+        self.find_all_paths(
+            tau_max=tau_max, assignment=assignment, spl_engine=spl_engine, k_paths=k_paths
+        )
+        self.generate_od_pairs()
+        self.compute_path_assignment_matrix()
+        if cache_dir is not None:
+            self.save_topology(path)
+        return False
+
+    def topology_key(self, tau_max, assignment, k_paths=None):
+        """Returns the content hash of the inputs of a topology: nodes, links,
+        link costs, random state, maximum path length, assignment and number
+        of paths per OD pair. The random state stands for the seed, and also
+        tells apart unseeded networks.
+        """
+        state = self.rng.get_state()
+        inputs = {
+            'version': CACHE_VERSION,
+            'nodes': [int(n) for n in self.nodes],
+            'links': [[int(i), int(j)] for (i,j) in self.links],
+            'costs': [float(cst) for cst in self.c],
+            'rng': hashlib.sha256(state[1].tobytes()).hexdigest(),
+            'rng_pos': int(state[2]),
+            'tau_max': tau_max,
+            'assignment': assignment
+        }
+        # Left out when all paths are kept, so that topologies cached before
+        # k_paths existed keep their keys
+        if k_paths is not None and assignment == 'random':
+            inputs['k_paths'] = int(k_paths)
+        inputs = json.dumps(inputs, sort_keys=True)
+        return hashlib.sha256(inputs.encode('ascii')).hexdigest()
+
+    @profiled('save_topology')
+    def save_topology(self, path):
+        """Saves paths, shortest path matrices, link counts and the path
+        assignment matrix to a directory of .npy files. Files are first written
+        to a temporary directory, which is then renamed, so that concurrent
+        runs never read a partial topology.
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent)
+        state = self.rng.get_state()
+        arrays = {
+            'paths': np.concatenate(self.paths).astype(np.int64),
+            'paths_lengths': np.array([len(p) for p in self.paths], np.int64),
+            'paths_links': np.concatenate(self.paths_links).astype(np.int64),
+            'F': self.F,
+            'T_plus': self.T_plus,
+            'T_minus': self.T_minus,
+            'lc': np.asarray(self.lc, dtype=float),
+            'Delta_indptr': self.Delta_tall.indptr,
+            'Delta_indices': self.Delta_tall.indices,
+            'rng_keys': state[1]
+        }
+        for (name, arr) in arrays.items():
+            np.save(os.path.join(tmp, name + '.npy'), arr)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({
+                'tau_max': int(self.tau_max),
+                'assignment': self.assignment,
+                'k_paths': self.k_paths,
+                'costs': [float(cst) for cst in self.c],
+                'rng_pos': int(state[2]),
+                'rng_has_gauss': int(state[3]),
+                'rng_cached_gaussian': float(state[4])
+            }, f)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Topology saved meanwhile by another run
+            shutil.rmtree(tmp)
+
+    @profiled('load_topology', lambda net: {
+        'paths': len(net.paths), 'Delta_ms_nnz': net.Delta_tall.nnz
+    })
+    def load_topology(self, path):
+        """Loads a topology saved by save_topology, memory-mapping its arrays,
+        and rebuilds OD pairs and the path assignment matrix from them.
+        """
+        def load(name):
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.tau_max = meta['tau_max']
+        self.assignment = meta['assignment']
+        self.k_paths = meta.get('k_paths')
+        # Costs may have been reassigned while finding paths
+        self.c = meta['costs']
+        nx.set_edge_attributes(
+            self.G, {e:self.c[i] for (i,e) in enumerate(self.G.edges)}, 'cost'
+        )
+        self.rng.set_state((
+            'MT19937', np.array(load('rng_keys')), meta['rng_pos'],
+            meta['rng_has_gauss'], meta['rng_cached_gaussian']
+        ))
+
+        splits = np.cumsum(load('paths_lengths'))[:-1]
+        self.paths = [p.tolist() for p in np.split(load('paths'), splits)]
+        self.paths_links = [
+            pl.tolist() for pl in np.split(load('paths_links'), splits - np.arange(1, len(splits)+1))
+        ]
+        self.F = load('F')
+        self.T_plus = load('T_plus')
+        self.T_minus = load('T_minus')
+        self.lc = load('lc')
+        self.generate_od_pairs()
+
+        indptr = load('Delta_indptr')
+        indices = load('Delta_indices')
+        self.Delta_tall = sp.csr_matrix(
+            (np.ones(len(indices), np.int8), indices, indptr),
+            shape=(self.tau_max*len(self.links), len(self.paths))
+        )
+        rows = np.repeat(np.arange(len(indptr)-1), np.diff(indptr))
+        (taus, l_idxs) = np.divmod(rows, len(self.links))
+        self.Delta_ms = self.build_ms_matrix(
+            taus,
+            l_idxs,
+            np.asarray(indices),
+            (len(self.links), len(self.paths)),
+            np.int8
+        )
+        self.Delta = sum_ms(self.Delta_ms)
+        self.repair_log = []
+
+    def build_ms_matrix(self, taus, rows, cols, shape, dtype, vals=None):
+        """Builds a multi-step matrix from the coordinates of its nonzeros,
+        either as a list of dense arrays or as a list of CSR matrices depending
+        on the storage mode of the network.
+
+        Arguments:
+            taus {np.ndarray} -- Time step of each nonzero.
+            rows {np.ndarray} -- Row index of each nonzero.
+            cols {np.ndarray} -- Column index of each nonzero.
+            shape {(int*int)} -- Shape of the matrix of each time step.
+            dtype {np.dtype} -- Data type of the matrices.
+
+        Keyword Arguments:
+            vals {np.ndarray} -- Value of each nonzero, ones if None
+                (default: {None})
+
+        Returns:
+            {list} -- Multi-step matrix, from 0 to tau_max-1.
+        """
+        if vals is None:
+            vals = np.ones(len(taus), dtype)
+        M = []
+        for tau in range(self.tau_max):
+            in_tau = taus == tau
+            if self.sparse:
+                M.append(sp.csr_matrix(
+                    (vals[in_tau], (rows[in_tau], cols[in_tau])),
+                    shape=shape, dtype=dtype
+                ))
+            else:
+                m = np.zeros(shape, dtype)
+                m[rows[in_tau], cols[in_tau]] = vals[in_tau]
+                M.append(m)
+        return M
 
     def generate_random_proportions(
         self,
@@ -313,78 +1198,118 @@ class Network():
             min_prop {int} -- Minimum flow proportion (default: {0})
             max_prop {int} -- Maximum flow proportion (default: {100})
         """
+        (o_od_fractions, od_path_fractions) = self.generate_random_proportions_batch(
+            1, like_paper, min_prop, max_prop, dense=False
+        )
+        (self.o_od_proportions, self.od_path_proportions) = self.expand_proportions(
+            o_od_fractions[0], od_path_fractions[0]
+        )
+
+    def generate_random_proportions_batch(
+        self,
+        trials,
+        like_paper=True,
+        min_prop=0,
+        max_prop=100,
+        dense=True
+        ):
+        """Generates random fixed proportions O to OD flows and OD to path flows
+        for several trials at once. Each path belongs to a single OD pair, and
+        each OD pair to a single origin, so proportions are normalised with
+        segment sums over path_od and od_origin.
+
+        Arguments:
+            trials {int} -- Number of trials K to generate.
+
+        Keyword Arguments:
+            like_paper {bool} -- Whether to generate proportions with same mean
+                and variance as paper (default: {True})
+            min_prop {int} -- Minimum flow proportion (default: {0})
+            max_prop {int} -- Maximum flow proportion (default: {100})
+            dense {bool} -- Whether to return full proportion matrices, or
+                only their nonzeros (default: {True})
+
+        Returns:
+            {(np.ndarray*np.ndarray)} -- If dense, O to OD proportions of
+                shape (K, n_o, n_od) and OD to path proportions of shape
+                (K, n_od, n_paths). Otherwise, the fraction of its origin flow
+                taken by each OD pair, of shape (K, n_od), and the fraction of
+                its OD flow taken by each path, of shape (K, n_paths).
+        """
 
         assert(min_prop >=  0), 'Minimum proportion must be positive'
         assert(max_prop > 0), 'Maximum proportion must be strictly positive'
         assert(min_prop < max_prop+1), 'Maximum proportion must be greater than minimum proportion plus 1'
 
-        self.o_od_proportions = np.zeros((len(self.origins), len(self.od_pairs)))
-        self.od_path_proportions = np.zeros((len(self.od_pairs), len(self.paths)))
+        n_o = len(self.origins)
+        n_od = len(self.od_pairs)
         if like_paper:
             # Generate path proportions
-            path_proportions = 2 + np.random.rand(len(self.paths))
-            path_proportions = path_proportions/np.sum(path_proportions)
-            od_probs = np.zeros(len(self.od_pairs))
-            for od_idx in range(len(self.od_pairs)):
-                # Distribution of OD flow over path flows
-                p_idxs = list(filter(
-                    lambda p_i: 
-                        self.paths[p_i][0] == self.od_pairs[od_idx][0] and
-                        self.paths[p_i][-1] == self.od_pairs[od_idx][1],
-                    range(len(self.paths))
-                ))
-                od_fractions = [path_proportions[i] for i in p_idxs]
-                od_probs[od_idx] = np.sum(od_fractions)
-                od_fractions = od_fractions/od_probs[od_idx] # Normalise
-                for (i,p_idx) in enumerate(p_idxs):
-                    self.od_path_proportions[od_idx,p_idx] = od_fractions[i]
-            for o_idx in range(len(self.origins)):
-                # Distribution of O flow over OD flows
-                od_idxs = list(filter(
-                    lambda odp_i: self.od_pairs[odp_i][0] == self.origins[o_idx], 
-                    range(len(self.od_pairs))
-                ))
-                o_fractions = [od_probs[i] for i in od_idxs]
-                o_fractions = o_fractions/np.sum(o_fractions) # Normalise
-                for (i,od_idx) in enumerate(od_idxs):
-                    self.o_od_proportions[o_idx,od_idx] = o_fractions[i]
-
+            path_proportions = 2 + self.rng.rand(trials, len(self.paths))
+            path_proportions = path_proportions/np.sum(path_proportions, 1, keepdims=True)
+            # Distribution of OD flow over path flows
+            od_probs = segment_sum(path_proportions, self.path_od, n_od)
+            od_path_fractions = path_proportions/od_probs[:,self.path_od]
+            # Distribution of O flow over OD flows
+            o_probs = segment_sum(od_probs, self.od_origin, n_o)
+            o_od_fractions = od_probs/o_probs[:,self.od_origin]
         else:
-            for o_idx in range(len(self.origins)):
-                # Distribution of O flow over OD flows
-                od_idxs = list(filter(
-                    lambda odp_i: self.od_pairs[odp_i][0] == self.origins[o_idx], 
-                    range(len(self.od_pairs))
-                ))
-                o_fractions = np.zeros((1,len(od_idxs)))
-                while np.sum(o_fractions) == 0:
-                    o_fractions = np.random.randint(
-                        min_prop, max_prop,
-                        len(od_idxs)
-                    )
-                # Normalise distribution
-                o_fractions = o_fractions/np.sum(o_fractions)
-                for (i,od_idx) in enumerate(od_idxs):
-                    self.o_od_proportions[o_idx,od_idx] = o_fractions[i]
-            for od_idx in range(len(self.od_pairs)):
-                # Distribution of OD flow over path flows
-                p_idxs = list(filter(
-                    lambda p_i: 
-                        self.paths[p_i][0] == self.od_pairs[od_idx][0] and
-                        self.paths[p_i][-1] == self.od_pairs[od_idx][1],
-                    range(len(self.paths))
-                ))
-                od_fractions = np.zeros((1,len(p_idxs)))
-                while np.sum(od_fractions) == 0:
-                    od_fractions = np.random.randint(
-                        min_prop, max_prop,
-                        len(p_idxs)
-                    )
-                # Normalise distribution
-                od_fractions = od_fractions/np.sum(od_fractions)
-                for (i,p_idx) in enumerate(p_idxs):
-                    self.od_path_proportions[od_idx,p_idx] = od_fractions[i]
+            # Distribution of O flow over OD flows
+            o_od_fractions = random_segment_fractions(
+                (trials, n_od), self.od_origin, n_o, min_prop, max_prop,
+                rng=self.rng
+            )
+            # Distribution of OD flow over path flows
+            od_path_fractions = random_segment_fractions(
+                (trials, len(self.paths)), self.path_od, n_od, min_prop, max_prop,
+                rng=self.rng
+            )
+
+        if not dense:
+            return (o_od_fractions, od_path_fractions)
+        o_od_proportions = np.zeros((trials, n_o, n_od))
+        o_od_proportions[:,self.od_origin,np.arange(n_od)] = o_od_fractions
+        od_path_proportions = np.zeros((trials, n_od, len(self.paths)))
+        od_path_proportions[:,self.path_od,np.arange(len(self.paths))] = od_path_fractions
+        return (o_od_proportions, od_path_proportions)
+
+    def expand_proportions(self, o_od_fractions, od_path_fractions):
+        """Builds O to OD and OD to path proportion matrices of a single trial
+        from the fractions returned by generate_random_proportions_batch with
+        dense set to False. Matrices are sparse if the network is.
+
+        Arguments:
+            o_od_fractions {np.ndarray} -- Fraction of its origin flow taken by
+                each OD pair.
+            od_path_fractions {np.ndarray} -- Fraction of its OD flow taken by
+                each path.
+
+        Returns:
+            {(np.ndarray*np.ndarray)} -- O to OD proportions, and OD to path
+                proportions.
+        """
+        n_od = len(self.od_pairs)
+        shapes = ((len(self.origins), n_od), (n_od, len(self.paths)))
+        if self.sparse:
+            return (
+                sp.csr_matrix(
+                    (o_od_fractions, (self.od_origin, np.arange(n_od))),
+                    shape=shapes[0]
+                ),
+                sp.csr_matrix(
+                    (od_path_fractions, (self.path_od, np.arange(len(self.paths)))),
+                    shape=shapes[1]
+                )
+            )
+        o_od_proportions = np.zeros(shapes[0])
+        o_od_proportions[self.od_origin,np.arange(n_od)] = o_od_fractions
+        od_path_proportions = np.zeros(shapes[1])
+        od_path_proportions[self.path_od,np.arange(len(self.paths))] = od_path_fractions
+        return (o_od_proportions, od_path_proportions)
     
+    @profiled('compute_assignment_matrix', lambda net: {
+        'A_ms_nnz': nnz_ms(net.A_ms), 'P_ms_nnz': nnz_ms(net.P_ms)
+    })
     def compute_assignment_matrix(self):
         """
         Computes assignment matrix A, and O-flow assignment matrix P based on
@@ -397,31 +1322,514 @@ class Network():
         assert(self.od_path_proportions.size is not None), 'OD to path proportions have not been generated.'
         assert(self.assignment is not None), 'Assignment strategy has not been determined.'
 
-        # Initialise traffic assignment matrices
-        self.A = np.zeros((len(self.links), len(self.od_pairs)))
-        self.P = np.zeros((len(self.links), len(self.origins)))
-        self.A_ms = [np.zeros((len(self.links), len(self.od_pairs))) for i in range(self.tau_max)]
-        self.P_ms = [np.zeros((len(self.links), len(self.origins))) for i in range(self.tau_max)]
+        # A_ms[tau] = Delta_ms[tau] @ od_path_proportions.T and
+        # P_ms[tau] = A_ms[tau] @ o_od_proportions.T, for all tau at once
+        if self.sparse:
+            A_tall = self.Delta_tall @ sp.csr_matrix(self.od_path_proportions.T)
+            P_tall = A_tall @ sp.csr_matrix(self.o_od_proportions.T)
+        else:
+            A_tall = self.Delta_tall @ self.od_path_proportions.T
+            P_tall = A_tall @ self.o_od_proportions.T
+        n_l = len(self.links)
+        self.A_ms = [A_tall[tau*n_l:(tau+1)*n_l] for tau in range(self.tau_max)]
+        self.P_ms = [P_tall[tau*n_l:(tau+1)*n_l] for tau in range(self.tau_max)]
+        self.A = sum_ms(self.A_ms)
+        self.P = sum_ms(self.P_ms)
 
-        for (od_i, od) in enumerate(self.od_pairs):
-            p_idxs = list(filter(
-                lambda p_i: self.paths[p_i][0] == od[0] and self.paths[p_i][-1] == od[1],
-                range(len(self.paths))
-            ))
-            for p_i in p_idxs:
-                for tau in range(self.tau_max):
-                    self.A_ms[tau][:,od_i] += self.Delta_ms[tau][:,p_i]*self.od_path_proportions[od_i,p_i]
-        self.A = sum(a for a in self.A_ms)
-
-        for (o_i, o) in enumerate(self.origins):
-            od_idxs = list(filter(
-                lambda od_i: self.od_pairs[od_i][0] == o,
-                range(len(self.od_pairs))
+    @profiled('update_assignment_matrix')
+    def update_assignment_matrix(self, od_idxs, o_idxs):
+        """Computes the columns of some OD pairs of A_ms and of some origins
+        of P_ms again, as compute_assignment_matrix, after their paths or
+        proportions changed. Only the columns of the path assignment matrix
+        of their paths are involved, and the other columns are kept.
+
+        Arguments:
+            od_idxs {np.ndarray} -- Indexes of the OD pairs, increasing.
+            o_idxs {np.ndarray} -- Indexes of the origins, increasing.
+        """
+        (path_fractions, od_fractions) = self.fractions()
+        n_l = len(self.links)
+        # Columns of A are sums of the paths of their OD pair, and columns of
+        # P sums of the paths of their origin
+        path_origin = self.od_origin[self.path_od]
+        for (name, idxs, segments, weights) in (
+                ('A', od_idxs, self.path_od, path_fractions),
+                ('P', o_idxs, path_origin, path_fractions*od_fractions[self.path_od])
+            ):
+            p_idxs = np.nonzero(np.isin(segments, idxs))[0]
+            W = sp.csr_matrix(
+                (
+                    weights[p_idxs],
+                    (np.arange(len(p_idxs)), np.searchsorted(idxs, segments[p_idxs]))
+                ),
+                shape=(len(p_idxs), len(idxs))
+            )
+            cols = sp.csr_matrix(self.Delta_tall[:,p_idxs] @ W)
+            M_ms = getattr(self, name + '_ms')
+            for tau in range(self.tau_max):
+                M_ms[tau] = set_columns(M_ms[tau], idxs, cols[tau*n_l:(tau+1)*n_l])
+            setattr(self, name, set_columns(
+                getattr(self, name), idxs, sum_ms([
+                    cols[tau*n_l:(tau+1)*n_l] for tau in range(self.tau_max)
+                ])
             ))
-            for od_i in od_idxs:
-                for tau in range(self.tau_max):
-                    self.P_ms[tau][:,o_i] += self.A_ms[tau][:,od_i]*self.o_od_proportions[o_i,od_i]
-        self.P = sum(p for p in self.P_ms)
+
+    @profiled('compute_assignment_matrix_batch')
+    def compute_assignment_matrix_batch(self, o_od_fractions, od_path_fractions):
+        """Computes multi-step O-flow assignment matrices P_ms for several
+        trials at once, from the fractions returned by
+        generate_random_proportions_batch with dense set to False. The
+        proportions of a trial are combined into the fraction of its origin
+        flow taken by each path, so a single sparse product with the path
+        assignment matrix covers all time steps and trials.
+
+        Arguments:
+            o_od_fractions {np.ndarray} -- Fraction of its origin flow taken by
+                each OD pair, of shape (K, n_od).
+            od_path_fractions {np.ndarray} -- Fraction of its OD flow taken by
+                each path, of shape (K, n_paths).
+
+        Returns:
+            {np.ndarray} -- Multi-step O-flow assignment matrices, of shape
+                (K, tau_max, n_l, n_o).
+        """
+        trials = od_path_fractions.shape[0]
+        n_o = len(self.origins)
+        n_p = len(self.paths)
+        path_origin = self.od_origin[self.path_od]
+        # Fraction of origin flow taken by each path, in trial-major columns
+        o_path_fractions = od_path_fractions*o_od_fractions[:,self.path_od]
+        cols = path_origin[:,None] + n_o*np.arange(trials)[None,:]
+        O_path = sp.csr_matrix(
+            (o_path_fractions.T.ravel(), (np.repeat(np.arange(n_p), trials), cols.ravel())),
+            shape=(n_p, trials*n_o)
+        )
+        P_tall = to_dense(self.Delta_tall @ O_path)
+        return P_tall.reshape(
+            self.tau_max, len(self.links), trials, n_o
+        ).transpose(2, 0, 1, 3)
+
+    def link_index(self, link):
+        """Returns the index of a link, raising ValueError if it is not in the
+        network.
+        """
+        if not self.G.has_edge(*link):
+            raise ValueError('Link {l} is not in the network'.format(l=tuple(link)))
+        return self.links.index(tuple(link))
+
+    def affected_sources(self, link, old_cost=None, new_cost=None):
+        """Returns the nodes whose shortest paths may change when the cost of a
+        link changes, the link being added if old_cost is None and removed if
+        new_cost is None. Shortest paths from a node are unchanged unless the
+        link is on one of them before or after the change, which is tested
+        with a margin for rounding.
+
+        Returns:
+            {np.ndarray} -- Source nodes, as column indexes of F.
+        """
+        (u, v) = link
+        (F_u, F_v) = (self.F[u], self.F[v])
+        margin = 1e-9*np.maximum(np.abs(F_v), 1)
+        affected = np.zeros(len(F_u), bool)
+        with np.errstate(invalid='ignore'):
+            for cost in (old_cost, new_cost):
+                if cost is not None:
+                    affected |= np.isfinite(F_u) & (F_u + cost <= F_v + margin)
+        return np.nonzero(affected)[0]
+
+    def update_link_cost(self, link, cost):
+        """Changes the cost of a link, and repairs the topology of the network
+        in place, see repair_topology.
+
+        Arguments:
+            link {(int*int)} -- Link whose cost changes.
+            cost {float} -- New cost of the link.
+        """
+        l = self.link_index(link)
+        if self.assignment == 'random' and cost != 1:
+            raise ValueError('Random assignment only supported for rigid models')
+        if cost == self.c[l]:
+            return
+        sources = self.affected_sources(link, self.c[l], cost)
+        self.c = list(self.c)
+        self.c[l] = cost
+        self.G.edges[link]['cost'] = cost
+        self.repair_topology(sources, np.arange(len(self.links)))
+
+    def remove_link(self, link):
+        """Removes a link, as when it fails, and repairs the topology of the
+        network in place, see repair_topology.
+
+        Arguments:
+            link {(int*int)} -- Link to remove.
+        """
+        l = self.link_index(link)
+        sources = self.affected_sources(link, old_cost=self.c[l])
+        self.G.remove_edge(*link)
+        self.links = list(self.G.edges)
+        self.c = [cst for (i,cst) in enumerate(self.c) if i != l]
+        link_map = np.arange(len(self.links)+1)
+        link_map[l] = -1
+        link_map[l+1:] -= 1
+        self.repair_topology(sources, link_map, removed=l)
+
+    def add_link(self, link, cost=1):
+        """Adds a link between existing nodes, and repairs the topology of the
+        network in place, see repair_topology. The link takes the position it
+        would have in a network built with it, after the other links leaving
+        the same node.
+
+        Arguments:
+            link {(int*int)} -- Link to add.
+
+        Keyword Arguments:
+            cost {float} -- Cost of the link (default: {1})
+        """
+        (u, v) = link
+        for node in link:
+            if node not in self.G:
+                raise ValueError('Node {n} was not declared in the list of nodes'.format(n=node))
+        if u == v:
+            raise ValueError('Node {n} has a self-loop'.format(n=u))
+        if self.G.has_edge(u, v):
+            raise ValueError('Link {l} is already in the network'.format(l=tuple(link)))
+        if self.assignment == 'random' and cost != 1:
+            raise ValueError('Random assignment only supported for rigid models')
+        sources = self.affected_sources(link, new_cost=cost)
+        self.G.add_edge(u, v, cost=cost)
+        self.links = list(self.G.edges)
+        l = self.links.index((u, v))
+        self.c = list(self.c)
+        self.c.insert(l, cost)
+        link_map = np.arange(len(self.links)-1)
+        link_map[l:] += 1
+        self.repair_topology(sources, link_map, added=l)
+
+    @profiled('repair_topology', lambda net: {
+        'paths': len(net.paths), 'Delta_ms_nnz': net.Delta_tall.nnz
+    })
+    def repair_topology(self, sources, link_map, removed=None, added=None):
+        """Repairs the topology after a link changed, was removed or added,
+        for the source nodes whose shortest paths may have changed only:
+        their columns of F are computed again with single-source Dijkstra,
+        and, for shortest path assignment, their paths are enumerated again.
+        For random assignment, paths through a removed link are dropped, and
+        paths through an added link are enumerated. With k_paths, the paths
+        of OD pairs which lost a path, or whose k shortest paths may go
+        through an added link by the shortest path lengths of F, are
+        enumerated again. Other paths are kept, along with their columns of
+        the path assignment matrices.
+
+        tau_max is kept, as it sets the shape of all multi-step matrices, so
+        the topology is the same as that of a network built with the new
+        links and costs and the current tau_max. If proportions were
+        generated, those of OD pairs whose paths are unchanged and of origins
+        whose OD pairs are unchanged are kept, others are drawn again.
+
+        When links, OD pairs and origins are unchanged, as after most cost
+        changes, only the columns of lc, A_ms and P_ms of the OD pairs and
+        origins whose paths changed are computed again, and the origins are
+        appended to repair_log, for Solver.update_constraints. Otherwise
+        link, OD pair and origin indexes shift, and lc and the assignment
+        matrices are rebuilt, in time linear in their size, and None is
+        appended. In both cases, the lists of paths and OD pairs are rebuilt
+        in time linear in the number of paths, and the path assignment
+        matrices in time linear in their number of nonzeros.
+
+        Arguments:
+            sources {np.ndarray} -- Nodes whose shortest paths may change.
+            link_map {np.ndarray} -- New index of each link before the
+                change, -1 for a removed link.
+
+        Keyword Arguments:
+            removed {int} -- Index of the removed link before the change
+                (default: {None})
+            added {int} -- Index of the added link (default: {None})
+        """
+        n_l_old = len(link_map)
+        self.costs = list(self.c)
+        renumbered = removed is not None or added is not None
+        if not len(sources) and not renumbered:
+            # The link is on no shortest path, before or after the change
+            self.repair_log.append(np.array([], dtype=int))
+            return
+        rigid = all(cst == 1 for cst in self.c)
+        old_mpl = min(np.amax(self.F), self.tau_max)
+        # Arrays loaded from the cache are read-only memory maps
+        self.F = np.array(self.F)
+        self.T_plus = np.array(self.T_plus)
+        self.T_minus = np.array(self.T_minus)
+        if len(sources):
+            dist = csgraph.shortest_path(
+                self.cost_adjacency(),
+                method='D',
+                unweighted=rigid,
+                indices=sources
+            )
+            self.F[:,sources] = dist.T
+
+        # Paths to drop, and new paths to enumerate
+        if self.assignment == 'shortest_path':
+            mpl = min(np.amax(self.F), self.tau_max)
+            if mpl != old_mpl:
+                # Paths of all nodes are filtered against the new length
+                sources = np.array(self.nodes)
+            self.T_minus[:,sources] = np.ceil(self.F[:,sources])
+            self.T_plus[:,sources] = np.floor(self.F[:,sources] + 1)
+            drop = np.isin([p[0] for p in self.paths], sources)
+            new_paths = self.shortest_paths(mpl, sources)
+        elif self.assignment == 'random':
+            mpl = self.tau_max
+            drop = np.zeros(len(self.paths), bool)
+            if removed is not None:
+                lengths = np.array([len(pl) for pl in self.paths_links], dtype=int)
+                l_idxs = np.fromiter(
+                    (l for pl in self.paths_links for l in pl), dtype=int, count=np.sum(lengths)
+                )
+                drop[np.repeat(np.arange(len(self.paths)), lengths)[l_idxs == removed]] = True
+            new_paths = []
+            if self.k_paths is not None:
+                # The k shortest paths of an OD pair only change if one of
+                # them is dropped or a path through the added link may be
+                # shorter, and are then enumerated again
+                ods = {(self.paths[i][0], self.paths[i][-1]) for i in np.nonzero(drop)[0]}
+                if added is not None:
+                    ods.update(self.k_paths_through(added, link_map))
+                drop = np.array([(p[0], p[-1]) in ods for p in self.paths], dtype=bool)
+                link_idxs = {link:l for (l,link) in enumerate(self.links)}
+                new_paths = [
+                    path for (n1, n2) in sorted(ods)
+                    for path in self.k_shortest_paths(n1, n2, link_idxs)
+                ]
+            elif added is not None:
+                new_paths = self.simple_paths_through(self.links[added], self.tau_max)
+        link_idxs = {link:l for (l,link) in enumerate(self.links)}
+        # Paths found again keep their proportions, but their columns of the
+        # path assignment matrix are computed again, as their arrival and
+        # departure times may have changed
+        dropped = {tuple(self.paths[i]): i for i in np.nonzero(drop)[0]}
+        entries = [
+            ([int(link_map[l]) for l in pl] if renumbered else pl, p, i, False)
+            for (i, (pl, p)) in enumerate(zip(self.paths_links, self.paths))
+            if not drop[i]
+        ]
+        for path in new_paths:
+            pl = [link_idxs[(path[n_i],path[n_i+1])] for n_i in range(len(path)-1)]
+            if sum(self.c[l] for l in pl) <= mpl:
+                entries.append((pl, path, dropped.get(tuple(path), -1), True))
+        entries.sort()
+        assert(entries), 'No paths exist after the change.'
+        n_p_old = len(self.paths)
+        self.paths_links = [pl for (pl, _, _, _) in entries]
+        self.paths = [p for (_, p, _, _) in entries]
+        old_cols = np.array([i for (_, _, i, _) in entries], dtype=int)
+        recompute = np.array([r for (_, _, _, r) in entries], dtype=bool)
+
+        # Columns of kept paths are moved, and their links renumbered
+        Delta = self.Delta_tall.tocoo()
+        (taus, l_idxs) = np.divmod(Delta.row, n_l_old)
+        col_map = np.full(n_p_old, -1)
+        col_map[old_cols[~recompute]] = np.nonzero(~recompute)[0]
+        in_kept = col_map[Delta.col] >= 0
+        new_idxs = np.nonzero(recompute)[0]
+        (new_taus, new_l_idxs, new_p_idxs) = self.path_assignment_nonzeros(
+            [self.paths_links[i] for i in new_idxs]
+        )
+        self.set_path_assignment_matrix(
+            np.concatenate((taus[in_kept], new_taus)),
+            np.concatenate((link_map[l_idxs[in_kept]], new_l_idxs)),
+            np.concatenate((col_map[Delta.col[in_kept]], new_idxs[new_p_idxs]))
+        )
+
+        old_proportions = None
+        if hasattr(self, 'od_path_proportions'):
+            old_proportions = self.proportion_fractions()
+        (old_origins, old_od_pairs, old_path_od, old_lc) = (
+            self.origins, self.od_pairs, self.path_od, self.lc
+        )
+        self.generate_od_pairs()
+        kept_layout = not renumbered and self.od_pairs == old_od_pairs
+
+        # Columns of lc are kept for origins whose distances are unchanged,
+        # and computed for the others and for an added link
+        links = np.array(self.links).reshape(-1, 2)
+        origins = np.array(self.origins)
+        old_o_idxs = {o:o_i for (o_i,o) in enumerate(old_origins)}
+        o_old = np.array([old_o_idxs.get(o, -1) for o in self.origins], dtype=int)
+        o_kept = (o_old >= 0) & ~np.isin(origins, sources)
+        if renumbered:
+            self.lc = np.empty((len(self.links), len(old_origins)))
+            self.lc[link_map[link_map >= 0]] = old_lc[link_map >= 0]
+        else:
+            self.lc = np.array(old_lc)
+        if self.origins != old_origins:
+            self.lc = self.lc[:,np.maximum(o_old, 0)]
+        self.lc[:,~o_kept] = self.link_time_steps(links, origins[~o_kept])
+        if added is not None:
+            self.lc[added] = self.link_time_steps(links[added:added+1], origins)[0]
+
+        # OD pairs whose paths, columns of the path assignment matrix or
+        # proportions changed, and their origins
+        od_changed = np.zeros(len(self.od_pairs), bool)
+        od_changed[self.path_od[recompute]] = True
+        o_changed = np.zeros(len(self.origins), bool)
+        if kept_layout:
+            lost = np.ones(n_p_old, bool)
+            lost[old_cols[old_cols >= 0]] = False
+            od_changed[old_path_od[lost]] = True
+        if old_proportions is not None:
+            (od_redrawn, o_redrawn) = self.repair_proportions(old_proportions, old_cols)
+            od_changed |= od_redrawn
+            o_changed |= o_redrawn
+        o_changed[self.od_origin[od_changed]] = True
+        if old_proportions is not None and hasattr(self, 'A_ms'):
+            if kept_layout:
+                self.update_assignment_matrix(
+                    np.nonzero(od_changed)[0], np.nonzero(o_changed)[0]
+                )
+            else:
+                self.compute_assignment_matrix()
+        self.repair_log.append(origins[o_changed] if kept_layout else None)
+
+    def k_paths_through(self, link, link_map):
+        """Returns the OD pairs whose k shortest paths may change when a link
+        is added, as those with a path through the link of cost at most
+        tau_max and at most that of their k-th path, if they have k paths.
+        The cost of such a path is bounded below by the shortest path lengths
+        of F to the start of the link and from its end.
+
+        Arguments:
+            link {int} -- Index of the added link.
+            link_map {np.ndarray} -- New index of each link before the
+                addition.
+
+        Returns:
+            {(int*int) list} -- OD pairs.
+        """
+        (u, v) = self.links[link]
+        # Cost of the paths, from the links before the addition
+        c = np.array(self.c)[link_map]
+        lengths = np.array([len(pl) for pl in self.paths_links], dtype=int)
+        l_idxs = np.fromiter(
+            (l for pl in self.paths_links for l in pl), dtype=int, count=np.sum(lengths)
+        )
+        path_costs = np.bincount(
+            np.repeat(np.arange(len(self.paths)), lengths), weights=c[l_idxs],
+            minlength=len(self.paths)
+        )
+        # Cost of the k-th path of each OD pair with k paths
+        kth_cost = np.full(self.F.shape, float(self.tau_max))
+        od_costs = np.zeros(len(self.od_pairs))
+        np.maximum.at(od_costs, self.path_od, path_costs)
+        full = self.paths_per_od == self.k_paths
+        od_nodes = np.array(self.od_pairs).reshape(-1, 2)
+        kth_cost[od_nodes[full,0], od_nodes[full,1]] = np.minimum(
+            od_costs[full], self.tau_max
+        )
+        # bound[n1,n2] is the shortest path length from n1 to u, plus the
+        # cost of the link, plus the shortest path length from v to n2
+        bound = self.F[u][:,None] + self.c[link] + self.F[:,v][None,:]
+        close = bound <= kth_cost*(1 + 1e-9)
+        np.fill_diagonal(close, False)
+        (n1s, n2s) = np.nonzero(close)
+        return list(zip(n1s.tolist(), n2s.tolist()))
+
+    def simple_paths_through(self, link, max_hops):
+        """Returns all simple paths of at most max_hops links which go through
+        a link, as a simple path to its start node followed by a disjoint
+        simple path from its end node.
+        """
+        (u, v) = link
+        def walks(start, neighbours, hops):
+            # Simple paths from start, of at most hops links
+            paths = [[start]]
+            stack = [[start]]
+            while stack:
+                path = stack.pop()
+                if len(path) > hops:
+                    continue
+                for node in neighbours[path[-1]]:
+                    if node not in path:
+                        stack.append(path + [node])
+                        paths.append(stack[-1])
+            return paths
+        heads = walks(u, self.G.pred, max_hops - 1)
+        tails = walks(v, self.G.succ, max_hops - 1)
+        return [
+            head[::-1] + tail for head in heads for tail in tails
+            if len(head) + len(tail) - 1 <= max_hops and not set(head) & set(tail)
+        ]
+
+    def fractions(self):
+        """Returns the fractions of the current proportions, as
+        generate_random_proportions_batch with dense set to False: fraction
+        of its OD flow taken by each path, and fraction of its origin flow
+        taken by each OD pair. They are read from the single nonzero of each
+        column of the proportion matrices.
+        """
+        return tuple(
+            np.asarray(M[rows, np.arange(len(rows))]).ravel()
+            for (M, rows) in (
+                (self.od_path_proportions, self.path_od),
+                (self.o_od_proportions, self.od_origin)
+            )
+        )
+
+    def proportion_fractions(self):
+        """Returns the fractions of the current proportions, keyed by path and
+        by OD pair: fraction of its OD flow taken by each path, fraction of
+        its origin flow taken by each OD pair, and number of paths of each OD
+        pair and of OD pairs of each origin.
+        """
+        (path_fractions, od_fractions) = self.fractions()
+        return (
+            path_fractions,
+            dict(zip(self.od_pairs, od_fractions)),
+            dict(zip(self.od_pairs, np.bincount(self.path_od, minlength=len(self.od_pairs)))),
+            dict(zip(self.origins, np.bincount(self.od_origin, minlength=len(self.origins))))
+        )
+
+    def repair_proportions(self, old_proportions, old_cols):
+        """Sets proportions after a change of the paths, keeping the fractions
+        of OD pairs whose paths are unchanged and of origins whose OD pairs
+        are unchanged. Fractions of other OD pairs and origins are drawn again
+        as in generate_random_proportions, like the paper.
+
+        Arguments:
+            old_proportions {tuple} -- Fractions before the change, returned
+                by proportion_fractions.
+            old_cols {np.ndarray} -- Index of each path before the change, -1
+                for new paths.
+
+        Returns:
+            {(np.ndarray*np.ndarray)} -- Whether the fractions of each OD pair
+                and of each origin were drawn again.
+        """
+        (old_path_fractions, old_od_fractions, old_od_paths, old_o_ods) = old_proportions
+        n_od = len(self.od_pairs)
+        kept = old_cols >= 0
+        path_fractions = np.empty(len(self.paths))
+        path_fractions[kept] = old_path_fractions[old_cols[kept]]
+        n_paths = np.bincount(self.path_od, minlength=n_od)
+        n_kept = np.bincount(self.path_od[kept], minlength=n_od)
+        n_old = np.array([old_od_paths.get(od, 0) for od in self.od_pairs])
+        od_redrawn = (n_kept != n_paths) | (n_kept != n_old)
+        redraw = od_redrawn[self.path_od]
+        path_fractions[redraw] = 2 + self.rng.rand(np.sum(redraw))
+        path_fractions /= np.bincount(self.path_od, path_fractions, n_od)[self.path_od]
+
+        od_fractions = np.array([old_od_fractions.get(od, np.nan) for od in self.od_pairs])
+        new_od = np.isnan(od_fractions)
+        n_ods = np.bincount(self.od_origin, minlength=len(self.origins))
+        n_old = np.array([old_o_ods.get(o, 0) for o in self.origins])
+        o_redrawn = (np.bincount(self.od_origin[new_od], minlength=len(self.origins)) > 0) | (n_ods != n_old)
+        redraw = o_redrawn[self.od_origin]
+        od_fractions[redraw] = 2 + self.rng.rand(np.sum(redraw))
+        od_fractions /= np.bincount(self.od_origin, od_fractions, len(self.origins))[self.od_origin]
+        (self.o_od_proportions, self.od_path_proportions) = self.expand_proportions(
+            od_fractions, path_fractions
+        )
+        return (od_redrawn, o_redrawn)
 
     def duplicate_network(self):
         """
@@ -0,0 +1,120 @@
+"""
+ToeplitzP and ToeplitzX classes are declared in this file. They apply the
+block-Toeplitz matrices P_tilde and X_tilde of Toep_P and Toep_X as linear
+operators, by convolution, without ever forming them.
+"""
+
+import numpy as np
+from scipy.sparse.linalg import LinearOperator
+from network import conv_link_counts, stack_ms
+
+class ToeplitzP(LinearOperator):
+    """
+    Block-Toeplitz operator P_tilde such that link counts are
+    Y(:) = P_tilde @ X(:), for O-flows X of shape (n_o, n_t) and link counts Y
+    of shape (n_l, n_t+tau_max-1), both vectorised column by column. Boundary
+    samples, where the convolution does not cover all time steps of P, are set
+    to zero, as in Toep_P.
+
+    Only the P tensor is stored, so that memory does not depend on n_t. The
+    adjoint is the convolution of the time-reversed link counts with the
+    transposed steps of P.
+    """
+
+    def __init__(self, P, n_t):
+        """Builds operator from a multi-step O-flow assignment matrix
+
+        Arguments:
+            P {np.ndarray or list} -- Multi-step O-flow assignment matrix of
+                shape (tau_max, n_l, n_o), or list of tau_max matrices.
+            n_t {int} -- Observation time horizon.
+        """
+        if isinstance(P, list):
+            P = stack_ms(P)
+        self.P = np.asarray(P, dtype=float)
+        (self.tau_max, self.n_l, self.n_o) = self.P.shape
+        self.n_t = n_t
+        self.n_s = n_t + self.tau_max - 1
+        super().__init__(float, (self.n_l*self.n_s, self.n_o*n_t))
+
+    def valid(self):
+        """Returns slice of the samples which are not set to zero.
+        """
+        return slice(self.tau_max-1, self.n_t)
+
+    def _matmat(self, X):
+        k = X.shape[1]
+        # Columns of X(:) as a batch of (n_t, n_o) flows
+        flows = X.reshape((self.n_o, self.n_t, k), order='F').transpose(2, 1, 0)
+        Y = np.zeros((k, self.n_s, self.n_l))
+        Y[:,self.valid()] = conv_link_counts(self.P, flows)[:,self.valid()]
+        return Y.transpose(2, 1, 0).reshape((-1, k), order='F')
+
+    def _matvec(self, x):
+        return self._matmat(x.reshape(-1, 1))
+
+    def _rmatmat(self, Y):
+        k = Y.shape[1]
+        counts = Y.reshape((self.n_l, self.n_s, k), order='F').transpose(2, 1, 0)
+        Y_valid = np.zeros_like(counts)
+        Y_valid[:,self.valid()] = counts[:,self.valid()]
+        # X[:,t] = sum over tau of P[tau].T @ Y[:,t+tau]
+        corr = conv_link_counts(
+            self.P.transpose(0, 2, 1), Y_valid[:,::-1]
+        )[:,::-1][:,:self.n_t]
+        return corr.transpose(2, 1, 0).reshape((-1, k), order='F')
+
+    def _rmatvec(self, y):
+        return self._rmatmat(y.reshape(-1, 1))
+
+class ToeplitzX(LinearOperator):
+    """
+    Block-Toeplitz operator X_tilde such that link counts are
+    Y.T = X_tilde @ P2.T, where P2 is the P tensor stacked along its columns as
+    an (n_l, n_o*tau_max) matrix, with column o + n_o*tau holding P[tau,:,o].
+    Boundary samples are set to zero, as in Toep_X.
+
+    Only X is stored. The adjoint correlates link counts with X, one product
+    per time step of P.
+    """
+
+    def __init__(self, X, tau_max):
+        """Builds operator from O-flows
+
+        Arguments:
+            X {np.ndarray} -- O-flows of shape (n_o, n_t).
+            tau_max {int} -- Maximum path length.
+        """
+        self.X = np.asarray(X, dtype=float)
+        (self.n_o, self.n_t) = self.X.shape
+        self.tau_max = tau_max
+        self.n_s = self.n_t + tau_max - 1
+        super().__init__(float, (self.n_s, self.n_o*tau_max))
+
+    def valid(self):
+        """Returns slice of the samples which are not set to zero.
+        """
+        return slice(self.tau_max-1, self.n_t)
+
+    def _matmat(self, P2T):
+        k = P2T.shape[1]
+        # Columns of P2.T as the links of a (tau_max, k, n_o) tensor
+        P = P2T.reshape((self.tau_max, self.n_o, k)).transpose(0, 2, 1)
+        Y = np.zeros((self.n_s, k))
+        Y[self.valid()] = conv_link_counts(P, self.X.T)[self.valid()]
+        return Y
+
+    def _matvec(self, p):
+        return self._matmat(p.reshape(-1, 1))
+
+    def _rmatmat(self, Y):
+        k = Y.shape[1]
+        G = np.empty((self.tau_max, self.n_o, k))
+        (start, stop) = (self.tau_max-1, self.n_t)
+        # G[tau] = sum over valid s of X[:,s-tau] Y[s]
+        for tau in range(self.tau_max):
+            G[tau] = self.X[:,start-tau:stop-tau] @ Y[start:stop]
+        return G.reshape((-1, k))
+
+    def _rmatvec(self, y):
+        return self._rmatmat(y.reshape(-1, 1))
@@ -0,0 +1,140 @@
+"""
+Profiler class is declared in this file. It records the wall time, peak
+allocated memory and size counters of the stages of the pipeline, from the
+enumeration of paths to the export of Matlab files, when profiling is enabled
+on a network.
+"""
+
+import json
+import time
+import tracemalloc
+from functools import wraps
+
+class Profiler():
+    """
+    Opt-in instrumentation of pipeline stages. Methods decorated with
+    profiled are recorded whenever the profiler attribute of their instance
+    is set, and run unchanged otherwise.
+
+    Stages may be nested, as when Solver builders run within the Matlab
+    export: each stage then includes the time and memory of the stages it
+    calls. Repeated calls of a stage are accumulated: times are summed, the
+    largest peak is kept, and counters are those of the last call.
+    """
+
+    def __init__(self, memory=True):
+        """Builds an empty profiler
+
+        Keyword Arguments:
+            memory {bool} -- Whether to trace peak allocated memory with
+                tracemalloc, which slows down allocations while a stage is
+                running (default: {True})
+        """
+        self.memory = memory
+        self.stages = {}
+        self.order = []
+        # Frames of the stages being run, as [name, start time, memory
+        # before the stage, highest memory seen by the stage]
+        self.stack = []
+        self.tracing = False
+
+    def start(self, name):
+        memory = (0, 0)
+        if self.memory:
+            if not self.stack and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self.tracing = True
+            memory = tracemalloc.get_traced_memory()
+            if self.stack:
+                # The peak of the enclosing stage is kept before it is reset
+                self.stack[-1][3] = max(self.stack[-1][3], memory[1])
+            tracemalloc.reset_peak()
+        self.stack.append([name, time.perf_counter(), memory[0], memory[0]])
+
+    def stop(self, counters=None):
+        (name, start, base, peak) = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        if self.memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            if self.stack:
+                self.stack[-1][3] = max(self.stack[-1][3], peak)
+                tracemalloc.reset_peak()
+            elif self.tracing:
+                tracemalloc.stop()
+                self.tracing = False
+        if name not in self.stages:
+            self.stages[name] = {'calls': 0, 'time': 0.0, 'peak': 0, 'counters': {}}
+            self.order.append(name)
+        stage = self.stages[name]
+        stage['calls'] += 1
+        stage['time'] += elapsed
+        stage['peak'] = max(stage['peak'], int(peak - base))
+        if counters:
+            stage['counters'].update(
+                (k, v.item() if hasattr(v, 'item') else v) for (k, v) in counters.items()
+            )
+
+    def report(self):
+        """Returns the recorded stages, in the order they were first run.
+
+        Returns:
+            {dict} -- For each stage name, number of calls, total time in
+                seconds, peak memory in bytes above the memory allocated when
+                the stage started (0 if memory is not traced), and size
+                counters.
+        """
+        return {name: dict(self.stages[name]) for name in self.order}
+
+    def to_json(self, path=None):
+        """Returns the report as a JSON string, also written to path if given.
+        """
+        text = json.dumps(self.report(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def clear(self):
+        self.stages = {}
+        self.order = []
+
+    def __str__(self):
+        lines = []
+        for (name, stage) in self.report().items():
+            counters = ', '.join(
+                '{k}={v}'.format(k=k, v=v) for (k, v) in stage['counters'].items()
+            )
+            lines.append('{name:<32} {calls:>4} x {t:9.4f} s {m:10.2f} MB  {c}'.format(
+                name=name, calls=stage['calls'], t=stage['time'],
+                m=stage['peak']/2**20, c=counters
+            ))
+        return '\n'.join(lines)
+
+def profiled(name, counters=None):
+    """Decorator recording a method as a stage in the profiler of its
+    instance, if any. Without a profiler, the method is called directly.
+
+    Arguments:
+        name {str} -- Name of the stage.
+
+    Keyword Arguments:
+        counters {function} -- Function of the instance returning a dictionary
+            of size counters, called after the stage when it is recorded
+            (default: {None})
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = getattr(self, 'profiler', None)
+            if profiler is None:
+                return method(self, *args, **kwargs)
+            profiler.start(name)
+            try:
+                ret = method(self, *args, **kwargs)
+            except BaseException:
+                profiler.stop()
+                raise
+            profiler.stop(counters(self) if counters is not None else None)
+            return ret
+        return wrapper
+    return decorator
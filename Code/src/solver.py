@@ -5,6 +5,9 @@ assignment strategies.
 """
 
 import numpy as np
+import scipy.sparse as sp
+from network import to_dense
+from profiler import profiled
 
 class Solver():
     """
@@ -39,6 +42,9 @@ class Solver():
                 that time step
             - c7_end_link: indicates O-flows that are still in link at
                 a time step later than that in which they entered it
+
+    The same constraints can also be obtained in standard form, over the
+    vectorised P, for use with LP/QP solvers (see get_standard_form).
     """
 
     net = None
@@ -48,180 +54,360 @@ class Solver():
         
         Arguments:
             net {Network} -- Network instance, where assignment matrices and
-                link costs have already been set.
+                link costs have already been set. Stages are recorded in
+                the profiler of the network, if it has one.
         """
         self.net = net
+        self.profiler = getattr(net, 'profiler', None)
+
+    def get_c3(self):
+        """Returns observability constraint mask, True for links leaving each
+        origin.
+        """
+        return self.links[:,0][:,None] == self.origins[None,:]
 
+    def get_c4(self, o_idxs):
+        """Returns the C4 masks of some origins: a link can carry flow of an
+        origin (at a time step) if any path from that origin goes through it
+        (at that time step).
+
+        Arguments:
+            o_idxs {np.ndarray} -- Indexes of the origins.
+
+        Returns:
+            {np.ndarray} -- Masks of shape (n_l, len(o_idxs)) for the
+                single-step model, (tau_max, n_l, len(o_idxs)) for the
+                multi-step model.
+        """
+        incidence = self.net.path_origin_incidence()[:,o_idxs]
+        if self.step == 'single':
+            return to_dense(sp.csr_matrix(self.net.Delta, dtype=bool) @ incidence)
+        return to_dense(
+            self.net.Delta_tall.astype(bool) @ incidence
+        ).reshape((self.net.tau_max, len(self.net.links), len(o_idxs)))
+
+    def get_c5_edges(self):
+        """Sets link/node incidence masks of flow constraint. A link flows in
+        node n if it ends at n, and otherwise flows out of n if it starts at n.
+        """
+        self.c5_in_edges = self.links[:,1][:,None] == self.nodes[None,:]
+        self.c5_out_edges = np.logical_and(
+            self.links[:,0][:,None] == self.nodes[None,:],
+            np.logical_not(self.c5_in_edges)
+        )
+
+    def get_c5_checks(self, o_idxs):
+        """Returns the origin/node pairs (and time steps) at which inflows and
+        outflows of the flow constraint are compared, for some origins.
+
+        Arguments:
+            o_idxs {np.ndarray} -- Indexes of the origins.
+
+        Returns:
+            {(np.ndarray*np.ndarray)} -- Inflow and outflow checks, of shape
+                (len(o_idxs), n_n) for the single-step model and (tau_max,
+                len(o_idxs), n_n) for the multi-step model.
+        """
+        origins = self.origins[o_idxs]
+        # Origin/node pairs where the node is distinct from the origin
+        distinct = origins[:,None] != self.nodes[None,:]
+        if self.step == 'single':
+            return (distinct, distinct.copy())
+        tau_max = self.net.tau_max
+        in_check = np.full((tau_max, len(origins), len(self.nodes)), False)
+        out_check = np.full((tau_max, len(origins), len(self.nodes)), False)
+        if self.net.assignment == 'random':
+            in_check[:tau_max-1] = distinct
+            out_check[1:] = distinct
+        elif self.net.assignment == 'shortest_path':
+            # For shortest path assignment, only need to take into account
+            # two time steps for flow contraint. The rest is set to 0 by C4.
+            # Arrival and departure time steps of each origin at each node
+            node_idxs = np.arange(len(self.net.nodes))
+            arr_tau = self.net.T_minus[node_idxs][:,origins].T - 1
+            dep_tau = self.net.T_plus[node_idxs][:,origins].T - 1
+            valid = (
+                distinct &
+                (arr_tau < tau_max) &
+                (dep_tau < tau_max) &
+                (dep_tau >= 0) &
+                (arr_tau >= 0) &
+                (arr_tau <= dep_tau)
+            )
+            (o_is, n_idxs) = np.nonzero(valid)
+            in_check[arr_tau[valid].astype(int), o_is, n_idxs] = True
+            out_check[dep_tau[valid].astype(int), o_is, n_idxs] = True
+        return (in_check, out_check)
+
+    def get_c7(self, o_idxs):
+        """Returns the time steps at which the flows of some origins enter
+        and leave each link, for the duplicate counts constraint of the
+        multi-step model with shortest path assignment. Both are 0 for links
+        traversed within a time step.
+
+        Arguments:
+            o_idxs {np.ndarray} -- Indexes of the origins.
+
+        Returns:
+            {(np.ndarray*np.ndarray)} -- Enter and leave time steps, of shape
+                (n_l, len(o_idxs)).
+        """
+        origins = self.origins[o_idxs]
+        # Assume l is link ij
+        # enter_tau is time step when O flow leaves i (enters link ij)
+        enter_tau = self.net.T_plus[self.links[:,0]][:,origins] - 1
+        # leave_tau is time step when O flow reaches j (reaches end of link ij)
+        leave_tau = self.net.T_minus[self.links[:,1]][:,origins] - 1
+        traversed = (leave_tau < self.net.tau_max - 1) & (leave_tau > enter_tau)
+        # time-step when O-flow enters link
+        c7_enter_link = np.zeros((len(self.links), len(origins)), dtype=int)
+        c7_enter_link[traversed] = enter_tau[traversed]
+        # time-step when O-flow reaches end of link
+        c7_end_link = np.zeros((len(self.links), len(origins)), dtype=int)
+        c7_end_link[traversed] = leave_tau[traversed]
+        return (c7_enter_link, c7_end_link)
+
+    @profiled('get_single_step_constraints', lambda solver: solver.constraint_counts())
     def get_single_step_constraints(self):
         """
         Generate constraint matrices for single-step model of network.
         """
-        dims = self.net.P.shape
+        self.step = 'single'
+        self.links = np.array(self.net.links).reshape(-1, 2)
+        self.origins = np.array(self.net.origins)
+        self.nodes = np.array(self.net.nodes)
+        o_idxs = np.arange(len(self.origins))
 
         #C4
-        net2 = self.net.duplicate_network()
-        # Generate positive flows through each link where flows are allowed
-        net2.generate_random_proportions(1,2)
-        net2.compute_assignment_matrix()
-        if np.array_equal(net2.P, self.net.P):
-            print('Assignment matrix P is the same')
-        self.c4 = (net2.P > 0)
+        self.c4 = self.get_c4(o_idxs)
         #C3
-        self.c3 = np.full(dims, False)
-        for (l_i,l) in enumerate(self.net.links):
-            for (o_i,o) in enumerate(self.net.origins):
-                if l[0] == o:# and self.c4[l_i,o_i]:
-                    self.c3[l_i,o_i] = True
+        self.c3 = self.get_c3()
         #C5
         if len(self.net.origins) <  len(self.net.nodes) and self.net.verbose:
             print('\n\nWARNING: Less origins than nodes in the network, check this is expected\n\n')
 
-        self.c5_in_edges = np.full(
-            (len(self.net.links), len(self.net.nodes)),
-            False
-        )
-        self.c5_out_edges = np.full(
-            (len(self.net.links), len(self.net.nodes)),
-            False
-        )
-        self.c5_in_check = np.full(
-            (len(self.net.origins), len(self.net.nodes)),
-            False
-        )
-        self.c5_out_check = np.full(
-            (len(self.net.origins), len(self.net.nodes)),
-            False
-        )
-        for (l_i, l) in enumerate(self.net.links):
-            for (n_i,n) in enumerate(self.net.nodes):
-                if l[1] == n:
-                    self.c5_in_edges[l_i, n_i] = True
-                elif l[0] == n:
-                    self.c5_out_edges[l_i, n_i] = True
-        for (o_i,o) in enumerate(self.net.origins):
-            for (n_i,n) in enumerate(self.net.nodes):
-                if o != n:
-                    self.c5_in_check[o_i, n_i] = True
-                    self.c5_out_check[o_i, n_i] = True
+        self.get_c5_edges()
+        (self.c5_in_check, self.c5_out_check) = self.get_c5_checks(o_idxs)
 
         #C6 is expressed by c4 in the single-step model
         #C7 cannot be enforced in the single-step model
+        self.mark_repairs()
 
+    @profiled('get_multi_step_constraints', lambda solver: solver.constraint_counts())
     def get_multi_step_constraints(self):
         """
         Generates constraints for multi-step model of the network.
         """
-        P = np.stack(self.net.P_ms)
+        self.step = 'multi'
+        self.links = np.array(self.net.links).reshape(-1, 2)
+        self.origins = np.array(self.net.origins)
+        self.nodes = np.array(self.net.nodes)
+        o_idxs = np.arange(len(self.origins))
+        tau_max = self.net.tau_max
+        dims = (tau_max, len(self.net.links), len(self.net.origins))
 
         #C3
-        self.c3 = np.full(P.shape, False)
-        for (l_i,l) in enumerate(self.net.links):
-            for (o_i,o) in enumerate(self.net.origins):
-                if l[0] == o:
-                    # We only need to set this for P[0], constraints 4 and 6
-                    # will take care of later time steps
-                    self.c3[0,l_i,o_i] = True
+        self.c3 = np.full(dims, False)
+        # We only need to set this for P[0], constraints 4 and 6
+        # will take care of later time steps
+        self.c3[0] = self.get_c3()
 
         #C4
-        net2 = self.net.duplicate_network()
-        # Generate positive flows through each link where flows are allowed
-        net2.generate_random_proportions(1,2)
-        net2.compute_assignment_matrix()
-        if np.array_equal(net2.P_ms, self.net.P_ms):
-            print('Assignment matrix P_ms is the same')
-        P2 = np.stack(net2.P_ms)
-        self.c4 = (P2 > 0)
-
-        # Initialising constraint 5 matrices
+        self.c4 = self.get_c4(o_idxs)
+
+        #C5
         if len(self.net.origins) <  len(self.net.nodes) and self.net.verbose:
             print('\n\nWARNING: Less origins than nodes in the network, check this is expected\n\n')
-        self.c5_in_edges = np.full(
-            (len(self.net.links), len(self.net.nodes)),
-            False
-        )
-        self.c5_out_edges = np.full(
-            (len(self.net.links), len(self.net.nodes)),
-            False
-        )
-        self.c5_in_check = np.full(
-            (self.net.tau_max, len(self.net.origins), len(self.net.nodes)),
-            False
-        )
-        self.c5_out_check = np.full(
-            (self.net.tau_max, len(self.net.origins), len(self.net.nodes)),
-            False
-        )
-        
-        if self.net.assignment == 'random':# or self.net.assignment == 'shortest_path':
-            #C5
-            for (l_i, l) in enumerate(self.net.links):
-                for (n_i,n) in enumerate(self.net.nodes):
-                    if l[1] == n:
-                        self.c5_in_edges[l_i, n_i] = True
-                    elif l[0] == n:
-                        self.c5_out_edges[l_i, n_i] = True
-            for (o_i, o) in enumerate(self.net.origins):
-                for (n_i,n) in enumerate(self.net.nodes):
-                    if o != n:
-                        for tau in range(self.net.tau_max-1):
-                            self.c5_in_check[tau, o_i, n_i] = True
-                        for tau in range(1, self.net.tau_max):
-                            self.c5_out_check[tau, o_i, n_i] = True
-        elif self.net.assignment == 'shortest_path':
-            #C5
-            # For shortest path assignment, only need to take into account 
-            # two time steps for flow contraint. The rest is set to 0 by C4.
-            for (l_i, l) in enumerate(self.net.links):
-                for (n_i,n) in enumerate(self.net.nodes):
-                    if l[1] == n:
-                        self.c5_in_edges[l_i, n_i] = True
-                    elif l[0] == n:
-                        self.c5_out_edges[l_i, n_i] = True
-            for (o_i, o) in enumerate(self.net.origins):
-                for (n_i,n) in enumerate(self.net.nodes):
-                    if o != n:
-                        arr_tau = self.net.T_minus[n_i,o] - 1
-                        dep_tau = self.net.T_plus[n_i,o] - 1
-                        if (
-                                arr_tau < self.net.tau_max and
-                                dep_tau < self.net.tau_max and
-                                dep_tau >= 0 and
-                                arr_tau >= 0 and
-                                arr_tau <= dep_tau
-                            ):
-                            self.c5_in_check[int(arr_tau), o_i, n_i] = True
-                            self.c5_out_check[int(dep_tau), o_i, n_i] = True
-
+        self.get_c5_edges()
+        (self.c5_in_check, self.c5_out_check) = self.get_c5_checks(o_idxs)
+        if self.net.assignment == 'shortest_path':
             #C7
-            # time-step when O-flow enters link
-            self.c7_enter_link = np.zeros(
-                (len(self.net.links), len(self.net.origins)),
-                dtype=int
-            )
-            # time-step when O-flow reaches end of link
-            self.c7_end_link = np.zeros(
-                (len(self.net.links), len(self.net.origins)),
-                dtype=int
-            )
-            # Elements of P2 that are greater than 0 should remain constant
+            # Elements of P allowed by C4 should remain constant
             # throughout their traversal of the link, by shortest path
             # assumption
-            for (l_i,l) in enumerate(self.net.links):
-                for (o_i,o) in enumerate(self.net.origins):
-                    # Assume l is link ij
-                    # enter_tau is time step when O flow leaves i (enters link ij)
-                    enter_tau = self.net.T_plus[l[0],o] - 1
-                    # leave_tau is time step when O flow reaches j (reaches end of link ij)
-                    leave_tau = self.net.T_minus[l[1],o] - 1
-                    if leave_tau < self.net.tau_max - 1 and leave_tau > enter_tau:
-                        self.c7_enter_link[l_i,o_i] = enter_tau
-                        self.c7_end_link[l_i,o_i] = leave_tau
-        
+            (self.c7_enter_link, self.c7_end_link) = self.get_c7(o_idxs)
+
         # Correctly reshaping constraint matrices for usage in Matlab routine
         # P is stacked along dimension 1 in order to obtain a
         # n_l by (n_o*tau_max) 2-dimensional matrix
-        P = np.concatenate(P, axis=1)
         self.c3 = np.concatenate(self.c3, axis=1)
         self.c4 = np.concatenate(self.c4, axis=1)
         self.c5_in_check = np.concatenate(self.c5_in_check, axis=0)
-        self.c5_out_check = np.concatenate(self.c5_out_check, axis=0)
\ No newline at end of file
+        self.c5_out_check = np.concatenate(self.c5_out_check, axis=0)
+        self.mark_repairs()
+
+    def mark_repairs(self):
+        """Records the repairs of the network which the constraints cover."""
+        self.repair_log = getattr(self.net, 'repair_log', None)
+        self.repairs = len(self.repair_log or [])
+
+    def update_constraints(self):
+        """Updates the constraints of the last model built, after its network
+        was changed by update_link_cost, remove_link or add_link. While its
+        links and origins are unchanged, as after most cost changes, only
+        the masks of the origins changed by the repairs since, recorded in
+        the repair log of the network, are computed again. Otherwise all
+        masks are built again, in time linear in their size.
+        """
+        changes = [None]
+        log = getattr(self.net, 'repair_log', None)
+        if log is not None and log is self.repair_log:
+            changes = log[self.repairs:]
+        if any(c is None for c in changes):
+            if self.step == 'single':
+                self.get_single_step_constraints()
+            else:
+                self.get_multi_step_constraints()
+            return
+        o_idxs = np.searchsorted(self.origins, np.unique(np.concatenate(
+            [np.array([], dtype=int)] + changes
+        )))
+        self.update_origins(o_idxs)
+        self.mark_repairs()
+
+    def update_origins(self, o_idxs):
+        """Computes the masks of some origins again, in place.
+
+        Arguments:
+            o_idxs {np.ndarray} -- Indexes of the origins.
+        """
+        if self.step == 'single':
+            self.c4[:,o_idxs] = self.get_c4(o_idxs)
+            return
+        (tau_max, n_o) = (self.net.tau_max, len(self.origins))
+        # Columns of the origins at each time step, in the stacked masks
+        cols = (np.arange(tau_max)[:,None]*n_o + o_idxs[None,:]).ravel()
+        self.c4[:,cols] = np.concatenate(self.get_c4(o_idxs), axis=1)
+        (in_check, out_check) = self.get_c5_checks(o_idxs)
+        self.c5_in_check[cols] = np.concatenate(in_check, axis=0)
+        self.c5_out_check[cols] = np.concatenate(out_check, axis=0)
+        if self.net.assignment == 'shortest_path':
+            (self.c7_enter_link[:,o_idxs], self.c7_end_link[:,o_idxs]) = self.get_c7(o_idxs)
+
+    def constraint_counts(self):
+        """Returns the size of the constraints of the last model built: number
+        of elements of P allowed by C4, of origin/node pairs and time steps
+        checked by C5, and of time steps tied by C7.
+        """
+        counts = {
+            'c4_allowed': np.count_nonzero(self.c4),
+            'c5_checks': np.count_nonzero(self.c5_in_check)
+        }
+        if self.step == 'multi' and self.net.assignment == 'shortest_path':
+            counts['c7_steps'] = np.sum(self.c7_end_link - self.c7_enter_link)
+        return counts
+
+    @profiled('get_standard_form', lambda solver: {
+        'variables': solver.A_eq.shape[1],
+        'equalities': solver.A_eq.shape[0],
+        'inequalities': solver.A_ineq.shape[0],
+        'nnz': solver.A_eq.nnz + solver.A_ineq.nnz
+    })
+    def get_standard_form(self):
+        """Expresses the constraints of the last model built, single-step or
+        multi-step, as sparse linear constraints over the vectorised P:
+            A_eq @ p == b_eq, A_ineq @ p <= b_ineq, lb <= p <= ub
+        P is vectorised in column-major order, as Matlab's P(:), so element
+        [l,o] (single-step) or [l,o,tau] (multi-step) is at index
+        l + n_l*o + n_l*n_o*tau.
+
+        Constraints are those of the CVX routines estimate_P_single and
+        estimate_P_multi, with two differences: C3 sums over the links of
+        c3 for both models, and C5 compares inflows and outflows of the same
+        origin at each node, for all nodes.
+
+        Returns:
+            {(scipy.sparse.csr_matrix*np.ndarray*scipy.sparse.csr_matrix*
+                np.ndarray*np.ndarray*np.ndarray)} -- A_eq, b_eq, A_ineq,
+                b_ineq, lb and ub.
+        """
+        n_l = len(self.net.links)
+        n_o = len(self.net.origins)
+        if self.step == 'single':
+            tau_max = 1
+            c4 = self.c4
+            in_check = self.c5_in_check[None]
+            out_check = self.c5_out_check[None]
+            # Flows are counted once per time step spent on a link
+            scale = 1/self.net.lc
+            ub = np.where(self.c4, self.net.lc, 0)
+            c3 = self.c3
+        else:
+            tau_max = self.net.tau_max
+            c4 = self.c4.reshape(n_l, tau_max, n_o).transpose(0, 2, 1)
+            in_check = self.c5_in_check.reshape(tau_max, n_o, -1)
+            out_check = self.c5_out_check.reshape(tau_max, n_o, -1)
+            scale = np.ones((n_l, n_o))
+            ub = c4.astype(float)
+            c3 = self.c3[:,:n_o]
+
+        def idx(l, o, tau):
+            return l + n_l*o + n_l*n_o*tau
+
+        #C4 as bounds
+        lb = np.zeros(n_l*n_o*tau_max)
+        ub = ub.reshape(-1, order='F')
+
+        #C3: one equality per origin
+        (l_idxs, o_idxs) = np.nonzero(c3)
+        eq_rows = [o_idxs]
+        eq_cols = [idx(l_idxs, o_idxs, 0)]
+        eq_vals = [scale[l_idxs,o_idxs]]
+        b_eq = [np.ones(n_o)]
+        n_eq = n_o
+
+        #C7: O-flow is constant while it traverses a link
+        if self.step == 'multi' and self.net.assignment == 'shortest_path':
+            steps = (self.c7_end_link - self.c7_enter_link).ravel()
+            (l_idxs, o_idxs) = np.unravel_index(
+                np.repeat(np.arange(n_l*n_o), steps), (n_l, n_o)
+            )
+            enter = self.c7_enter_link[l_idxs,o_idxs]
+            # Each constraint compares one later step with the entry step
+            starts = np.cumsum(steps) - steps
+            taus = enter + 1 + np.arange(np.sum(steps)) - np.repeat(starts, steps)
+            rows = n_eq + np.arange(len(taus))
+            eq_rows += [rows, rows]
+            eq_cols += [idx(l_idxs, o_idxs, taus), idx(l_idxs, o_idxs, enter)]
+            eq_vals += [np.ones(len(taus)), -np.ones(len(taus))]
+            b_eq.append(np.zeros(len(taus)))
+            n_eq += len(taus)
+
+        #C5: outflow - inflow <= 0, for each origin at each node, pairing
+        # the k-th inflow time step with the k-th outflow time step
+        (o_in, n_in, tau_in) = np.nonzero(in_check.transpose(1, 2, 0))
+        (o_out, n_out, tau_out) = np.nonzero(out_check.transpose(1, 2, 0))
+        assert(np.array_equal(o_in, o_out) and np.array_equal(n_in, n_out)), 'Inflow and outflow checks do not match'
+        ineq_rows = []
+        ineq_cols = []
+        ineq_vals = []
+        for (edges, taus, sign) in (
+                (self.c5_in_edges, tau_in, -1),
+                (self.c5_out_edges, tau_out, 1)
+            ):
+            # Links of each node, as a CSR matrix of shape (n_nodes, n_l)
+            node_links = sp.csr_matrix(edges.T)
+            counts = np.diff(node_links.indptr)[n_in]
+            rows = np.repeat(np.arange(len(n_in)), counts)
+            starts = node_links.indptr[n_in]
+            offsets = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+            l_idxs = node_links.indices[np.repeat(starts, counts) + offsets]
+            o_idxs = o_in[rows]
+            ineq_rows.append(rows)
+            ineq_cols.append(idx(l_idxs, o_idxs, taus[rows]))
+            ineq_vals.append(sign*scale[l_idxs,o_idxs])
+
+        n_vars = n_l*n_o*tau_max
+        self.A_eq = sp.csr_matrix(
+            (np.concatenate(eq_vals), (np.concatenate(eq_rows), np.concatenate(eq_cols))),
+            shape=(n_eq, n_vars)
+        )
+        self.b_eq = np.concatenate(b_eq)
+        self.A_ineq = sp.csr_matrix(
+            (np.concatenate(ineq_vals), (np.concatenate(ineq_rows), np.concatenate(ineq_cols))),
+            shape=(len(n_in), n_vars)
+        )
+        self.b_ineq = np.zeros(len(n_in))
+        self.lb = lb
+        self.ub = ub
+        return (self.A_eq, self.b_eq, self.A_ineq, self.b_ineq, self.lb, self.ub)
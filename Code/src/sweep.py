@@ -0,0 +1,308 @@
+"""
+Script to generate Matlab test data for a grid of experiment configurations,
+in parallel and without any prompt. Each configuration is written to its own
+directory, with a manifest recording how it was generated, so that
+configurations which are already up to date are skipped when a sweep is run
+again.
+"""
+
+import os
+import ast
+import json
+import hashlib
+import itertools
+import time
+from multiprocessing import Pool
+
+from network import Network
+from to_matlab import ToMatlab
+
+# Sources whose changes make previously generated data out of date, along
+# with the local modules they import
+SOURCES = ['sweep.py']
+MANIFEST = 'manifest.json'
+# Files written by each export mode of ToMatlab
+OUTPUTS = {
+    'hdf5': ['data.mat'],
+    'mat': [
+        'shortest_path.mat', 'trials.mat', 'tau_max.mat', 'P_target.mat',
+        'P_initialise.mat', 'o_list.mat', 'e_list.mat', 'od_list.mat',
+        'lc.mat', 'constraints.mat'
+    ]
+}
+# Written in 'mat' export mode when the standard form is exported
+STANDARD_FORM_OUTPUT = 'standard_form.mat'
+DEFAULTS = {
+    'data': 'histogram',
+    'param': 'n_T',
+    'step': 'multi',
+    'costs': 'real',
+    'assment': 'shortest_path',
+    'direction': 'bi',
+    'size': (3, 3),
+    'tau_max': 4,
+    'trials': 3,
+    'seed': None,
+    'export': 'mat',
+    'standard_form': False
+}
+
+def expand_grid(grid):
+    """Expands a grid of parameters into the list of all their combinations.
+
+    Arguments:
+        grid {dict or list} -- Dictionary from parameter name to list of
+            values, or list of such dictionaries, whose expansions are
+            concatenated. Parameters of DEFAULTS which are left out take
+            their default value, and single values are accepted in place of
+            lists. Grid sizes are given as 'size' (h, w) tuples.
+
+    Returns:
+        {dict list} -- Configurations, with all parameters of DEFAULTS.
+    """
+    if isinstance(grid, list):
+        return [c for g in grid for c in expand_grid(g)]
+    unknown = set(grid) - set(DEFAULTS)
+    if unknown:
+        raise ValueError('Parameters {p} are not recognised'.format(p=sorted(unknown)))
+    params = dict(DEFAULTS)
+    params.update(grid)
+    names = list(params)
+    values = [
+        v if isinstance(v, list) else [v] for v in params.values()
+    ]
+    return [dict(zip(names, combo)) for combo in itertools.product(*values)]
+
+def config_dir(config, root='../../OflowEstimationFull/tests/'):
+    """Returns the directory of a configuration, named as in the Matlab test
+    data: '{step}_{costs}_{assment}_{h}by{w}_{tau_max}taumax_{trials}trials'
+    for histograms, prefixed by the swept parameter for plots. The direction,
+    seed, export mode and standard form export are appended when they differ
+    from their default, so that the Matlab names are kept for the defaults.
+    """
+    (h, w) = config['size']
+    name = '{step}_{costs}_{assment}_{h}by{w}_{tau_max}taumax_{trials}trials'.format(
+        step=config['step'],
+        costs=config['costs'],
+        assment=config['assment'],
+        h=h,
+        w=w,
+        tau_max=config['tau_max'],
+        trials=config['trials']
+    )
+    if config['data'] == 'plot':
+        name = '{param}_{name}'.format(param=config['param'], name=name)
+    if config['direction'] != DEFAULTS['direction']:
+        name += '_' + config['direction']
+    if config['seed'] is not None:
+        name += '_seed{seed}'.format(seed=config['seed'])
+    if config['export'] != DEFAULTS['export']:
+        name += '_' + config['export']
+    if config['standard_form']:
+        name += '_standard_form'
+    return os.path.join(root, name) + '/'
+
+def local_imports(sources, src_dir):
+    """Returns the sources and the modules of src_dir which they import,
+    directly or not.
+
+    Arguments:
+        sources {str list} -- File names of the modules in src_dir.
+        src_dir {str} -- Directory of the modules.
+
+    Returns:
+        {str list} -- Sorted file names of the modules.
+    """
+    found = set()
+    pending = list(sources)
+    while pending:
+        name = pending.pop()
+        if name in found:
+            continue
+        found.add(name)
+        with open(os.path.join(src_dir, name)) as f:
+            tree = ast.parse(f.read(), name)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.level == 0:
+                modules = [node.module]
+            else:
+                continue
+            for module in modules:
+                path = module.split('.')[0] + '.py'
+                if os.path.exists(os.path.join(src_dir, path)):
+                    pending.append(path)
+    return sorted(found)
+
+def sources_hash():
+    """Returns the SHA-256 digest of the sources generating the data.
+    """
+    digest = hashlib.sha256()
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in local_imports(SOURCES, src_dir):
+        digest.update(name.encode())
+        with open(os.path.join(src_dir, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def manifest_entry(config, digest):
+    """Returns the manifest content of a configuration, in JSON form.
+    """
+    entry = dict(config)
+    entry['size'] = list(config['size'])
+    entry['sources'] = digest
+    return entry
+
+def is_up_to_date(m_dir, config, digest):
+    """Checks whether a directory holds all outputs of a configuration,
+    generated from the current sources.
+    """
+    path = os.path.join(m_dir, MANIFEST)
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except ValueError:
+        return False
+    outputs = list(OUTPUTS[config['export']])
+    if config['standard_form'] and config['export'] == 'mat':
+        outputs.append(STANDARD_FORM_OUTPUT)
+    return (
+        manifest == manifest_entry(config, digest)
+        and all(os.path.exists(os.path.join(m_dir, o)) for o in outputs)
+    )
+
+def run_config(job):
+    """Builds the network of a configuration, and converts its topology,
+    constraints and trials to Matlab files. The manifest is written last, so
+    that an interrupted run is never taken as up to date.
+
+    Arguments:
+        job {(dict*str*str*str)} -- Configuration, output directory, digest
+            of the sources, and directory of cached topologies or None.
+
+    Returns:
+        {(str*str*float)} -- Output directory, 'done' or error message, and
+            time taken in seconds.
+    """
+    (config, m_dir, digest, cache_dir) = job
+    start = time.time()
+    try:
+        os.makedirs(m_dir, exist_ok=True)
+        manifest = os.path.join(m_dir, MANIFEST)
+        if os.path.exists(manifest):
+            os.remove(manifest)
+        (h, w) = config['size']
+        net = Network(config['direction'], h=h, w=w, seed=config['seed'])
+        net.build_topology(
+            config['costs'], config['tau_max'], config['assment'],
+            cache_dir=cache_dir
+        )
+        conv = ToMatlab(
+            net, step=config['step'], trials=config['trials'], m_dir=m_dir,
+            export=config['export'], standard_form=config['standard_form']
+        )
+        conv.convert_data()
+        with open(manifest, 'w') as f:
+            json.dump(manifest_entry(config, digest), f, indent=2)
+        status = 'done'
+    except Exception as e:
+        status = '{t}: {e}'.format(t=type(e).__name__, e=e)
+    return (m_dir, status, time.time() - start)
+
+def run_sweep(
+        grid, root='../../OflowEstimationFull/tests/', processes=None,
+        force=False, cache_dir=None, verbose=True
+    ):
+    """Generates the test data of all configurations of a grid over a process
+    pool, skipping those whose outputs are up to date. Raises a ValueError if
+    two different configurations are written to the same directory, such as
+    histograms which differ only in the plotted parameter.
+
+    Arguments:
+        grid {dict or list} -- Grid of configurations, as taken by
+            expand_grid.
+
+    Keyword Arguments:
+        root {str} -- Directory where configuration directories are created
+            (default: {'../../OflowEstimationFull/tests/'})
+        processes {int} -- Number of worker processes, all cores if None
+            (default: {None})
+        force {bool} -- Whether to regenerate configurations which are up to
+            date (default: {False})
+        cache_dir {str} -- Directory of cached topologies, reused across
+            configurations with the same seed and topology, see
+            Network.build_topology (default: {None})
+        verbose {bool} -- Whether to print progress (default: {True})
+
+    Returns:
+        {dict} -- Status of each configuration directory: 'up to date',
+            'done', or the error message.
+    """
+    digest = sources_hash()
+    statuses = {}
+    jobs = []
+    configs = {}
+    for config in expand_grid(grid):
+        m_dir = config_dir(config, root)
+        if m_dir in configs:
+            if configs[m_dir] != config:
+                raise ValueError(
+                    'Configurations {a} and {b} are both written to {d}'.format(
+                        a=configs[m_dir], b=config, d=m_dir
+                    )
+                )
+            continue
+        configs[m_dir] = config
+        if not force and is_up_to_date(m_dir, config, digest):
+            statuses[m_dir] = 'up to date'
+        else:
+            jobs.append((config, m_dir, digest, cache_dir))
+    if verbose:
+        print('{n} configurations to generate, {s} up to date'.format(
+            n=len(jobs), s=len(statuses)
+        ))
+    if jobs:
+        with Pool(processes) as pool:
+            for (m_dir, status, elapsed) in pool.imap_unordered(run_config, jobs):
+                statuses[m_dir] = status
+                if verbose:
+                    print('{dir}: {status} ({t:.1f} s)'.format(
+                        dir=m_dir, status=status, t=elapsed
+                    ))
+    return statuses
+
+if __name__ == '__main__':
+    # Full set of test data, for all steps, costs and assignments
+    GRID = [
+        {
+            'step': ['multi', 'single'],
+            'costs': ['rigid', 'mult_int', 'real'],
+            'assment': 'shortest_path',
+            'tau_max': 4,
+            'trials': 10
+        },
+        {
+            'step': ['multi', 'single'],
+            'costs': 'rigid',
+            'assment': 'random',
+            'tau_max': 4,
+            'trials': [5, 10]
+        },
+        {
+            'step': ['multi', 'single'],
+            'costs': 'real',
+            'assment': 'shortest_path',
+            'tau_max': 'mpl',
+            'trials': 10
+        },
+        {
+            'data': 'plot',
+            'param': 'size',
+            'size': [(2,2), (2,3), (3,3), (3,4), (4,4), (4,5), (5,5), (5,6), (6,6), (7,7), (8,8)],
+            'trials': 1
+        }
+    ]
+    run_sweep(GRID)
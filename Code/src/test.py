@@ -1,23 +1,52 @@
-"""Script to quickly test Network's class features.
+"""Script to quickly test Network's class features. Randomised tests are run
+in parallel over a process pool, each network with its own reproducible seed.
 """
 
 import numpy as np
-from network import Network
+from multiprocessing import Pool
+from network import Network, to_dense
 from solver import Solver
 
+CHECKS = [
+    'path_length', 'shortest_path',
+    'ss_c3', 'ss_c4', 'ss_c5',
+    'ms_c3', 'ms_c4', 'ms_c5', 'ms_c7'
+]
+
 def network_check(net, verbose=False):
+    """Checks paths and assignment matrices of a network against the Solver
+    constraints.
+
+    Arguments:
+        net {Network} -- Network instance, where assignment matrices have
+            already been computed.
+
+    Keyword Arguments:
+        verbose {bool} -- Whether to print the outcome of each check
+            (default: {False})
+
+    Returns:
+        {dict} -- Whether each check of CHECKS passed. Checks of shortest
+            paths and of C7 are only made for shortest path assignment.
+    """
+    results = {}
+
+    def report(check, passed, message):
+        results[check] = bool(passed)
+        if verbose:
+            print(('' if passed else 'FAILED: ') + message.format(
+                neg='' if passed else 'NOT '
+            ))
+
     # ----------------------------
     # Check that all paths are shorter than maximum path length
-    for pl in net.paths_links:
-        assert(
-            sum(net.c[l] for l in pl) <= net.tau_max
-        ), 'Path_link {pl} is longer than tau_max'.format(pl=pl)
-    else:
-        if verbose:
-            print('All paths are within max path length')
+    report('path_length', all(
+        sum(net.c[l] for l in pl) <= net.tau_max for pl in net.paths_links
+    ), 'All paths are {neg}within max path length')
     # ----------------------------
     # If shortest path assignment, check that paths between nodes are the shortest ones
     if net.assignment == 'shortest_path':
+        passed = True
         for (node, os) in enumerate(net.F):
             for (o, spl) in enumerate(os):
                 path_o_node_idxs = list(filter(
@@ -25,99 +54,89 @@ def network_check(net, verbose=False):
                     range(len(net.paths))
                 ))
                 for p_idx in path_o_node_idxs:
-                    assert(
-                        sum(net.c[l] for l in net.paths_links[p_idx]) == spl
-                    ), 'Path link {pl} is not a shortest path'.format(pl=net.paths_links[p_idx])
-        else:
-            if verbose:
-                print('All paths are shortest paths')
+                    if sum(net.c[l] for l in net.paths_links[p_idx]) != spl:
+                        passed = False
+        report('shortest_path', passed, 'All paths are {neg}shortest paths')
     # ----------------------------
     # Check that matrices P and P_ms are valid, as well as constraints by
     # verifying that all constraints are satified
     solver_ss = Solver(net)
+    P = to_dense(net.P)
     # ----------------------------
     #   Single-step
     solver_ss.get_single_step_constraints()
     # Build link count vector: times a flow is counted over a link in the
     # shortest path case. Otherwise set everything to 1 since random accepts
     # only rigid costs
-
+    passed = True
     for (o_i,o) in enumerate(net.origins):
         c3_cons = np.sum(np.divide(
-            net.P[:,o_i][solver_ss.c3[:,o_i]],
+            P[:,o_i][solver_ss.c3[:,o_i]],
             net.lc[:,o_i][solver_ss.c3[:,o_i]]
             ))
         if not np.isclose(c3_cons, 1.0):
-            print('FAILED: SS C3 observability constraint NOT satisifed for origin {o}'.format(o=o))
-            exit()
-    else:
-        if verbose:
-            print('SS C3 observability constraint satisifed')
-    
+            passed = False
+    report('ss_c3', passed, 'SS C3 observability constraint {neg}satisifed')
+
+    passed = True
     if not (
-            np.all(net.P[solver_ss.c4] >= 0) and 
-            np.all(net.P[solver_ss.c4] <= net.lc[solver_ss.c4]) and
-            np.all(net.P[np.logical_not(solver_ss.c4)] == 0)
+            np.all(P[solver_ss.c4] >= 0) and
+            np.all(P[solver_ss.c4] <= net.lc[solver_ss.c4]) and
+            np.all(P[np.logical_not(solver_ss.c4)] == 0)
         ):
-        check1 = net.P[solver_ss.c4] - net.lc[solver_ss.c4]
-        check2 = net.P[np.logical_not(solver_ss.c4)]
+        check1 = P[solver_ss.c4] - net.lc[solver_ss.c4]
+        check2 = P[np.logical_not(solver_ss.c4)]
         if max(check1) > 1e-10 or max(np.abs(check2)) > 1e-10:
-            print('FAILED: SS C4 speed constraint NOT satisifed')
-            exit()
-    elif verbose:
-        print('SS C4 speed constraint satisifed')
+            passed = False
+    report('ss_c4', passed, 'SS C4 speed constraint {neg}satisifed')
 
+    passed = True
     for (n_i,_) in enumerate(net.nodes):
         rows_in = solver_ss.c5_in_edges[:,n_i]
         cols_in = solver_ss.c5_in_check[:,n_i]
         rows_out = solver_ss.c5_out_edges[:,n_i]
         cols_out = solver_ss.c5_out_check[:,n_i]
         inflow_n = np.sum(np.divide(
-            net.P[rows_in,:][:,cols_in],
+            P[rows_in,:][:,cols_in],
             net.lc[rows_in,:][:,cols_in]
             ), 0
         )
         outflow_n = np.sum(np.divide(
-            net.P[rows_out,:][:,cols_out],
+            P[rows_out,:][:,cols_out],
             net.lc[rows_out,:][:,cols_out]
             ), 0
         )
         check = inflow_n - outflow_n
         if not np.all(np.greater_equal(inflow_n, outflow_n)):
             if min(check) < -1e-10:
-                print('FAILED: SS C5 flow constraint NOT satisifed')
-                exit()
-    else:
-        if verbose:
-            print('SS C5 flow constraint satisifed')
+                passed = False
+    report('ss_c5', passed, 'SS C5 flow constraint {neg}satisifed')
     # ----------------------------
     #   Multi-step
     solver_ms = Solver(net)
     solver_ms.get_multi_step_constraints()
     # c_arr_ms = np.ceil(np.array(net.c))
-    P_ms = np.concatenate(net.P_ms, axis=-1)
+    P_ms = np.concatenate([to_dense(p) for p in net.P_ms], axis=-1)
+    passed = True
     for (o_i,o) in enumerate(net.origins):
         c3_cons = np.sum(P_ms[:,o_i][solver_ms.c3[:,o_i]])
         if not np.isclose(c3_cons,1.0):
-            print('FAILED: MS C3 observability constraint NOT satisifed for origin {o}'.format(o=o))
-            exit()
-    else:
-        if verbose:
-            print('MS C3 observability constraint satisifed')
+            passed = False
+    report('ms_c3', passed, 'MS C3 observability constraint {neg}satisifed')
 
+    passed = True
     if not (
-            np.all(P_ms[solver_ms.c4] >= 0) and 
+            np.all(P_ms[solver_ms.c4] >= 0) and
             np.all(P_ms[solver_ms.c4] <= 1) and
             np.all(P_ms[np.logical_not(solver_ms.c4)] == 0)
         ):
         check1 = P_ms[solver_ms.c4]
         check2 = P_ms[np.logical_not(solver_ms.c4)]
         if max(check1) - 1 > 1e-10 or max(np.abs(check2)) > 1e-10:
-            print('FAILED: MS C4 speed constraint NOT satisifed')
-            exit()
-    elif verbose:
-        print('MS C4 speed constraint satisifed')
+            passed = False
+    report('ms_c4', passed, 'MS C4 speed constraint {neg}satisifed')
 
+    passed = True
     for (n_i,_) in enumerate(net.nodes):
         rows_in = solver_ms.c5_in_edges[:,n_i]
         cols_in = solver_ms.c5_in_check[:,n_i]
@@ -128,28 +147,37 @@ def network_check(net, verbose=False):
         check = inflow_n - outflow_n
         if not np.all(inflow_n - outflow_n >= 0):
             if min(check) < -1e-10:
-                print('FAILED: MS C5 flow constraint NOT satisifed')
-                exit()
-    else:
-        if verbose:
-            print('MS C5 flow constraint satisifed')
-    
+                passed = False
+    report('ms_c5', passed, 'MS C5 flow constraint {neg}satisifed')
+
     if net.assignment == 'shortest_path':
+        passed = True
         for (l_i,_) in enumerate(net.links):
             for (o_i,o) in enumerate(net.origins):
                 enter_tau = solver_ms.c7_enter_link[l_i,o_i]
                 end_tau = solver_ms.c7_end_link[l_i,o_i]
                 for tau in range(enter_tau+1, end_tau+1):
                     if not np.isclose(P_ms[l_i,o_i+tau*len(net.origins)], P_ms[l_i,o_i+enter_tau*len(net.origins)]):
-                        print('FAILED: MS C7 flow constraint NOT satisifed')
-                        exit()
-        else:
-            if verbose:
-                print('MS C7 flow constraint satisifed')
-
-def make_test(uni_bi, h, w, tau_max, costs, assment, num_tests=1000):
-    for _ in range(num_tests):
-        net = Network(uni_bi, h=h, w=w)
+                        passed = False
+        report('ms_c7', passed, 'MS C7 flow constraint {neg}satisifed')
+    return results
+
+def check_seed(config):
+    """Builds the network of a test configuration with a given seed and checks
+    it. Exceptions are caught, so that a failing network does not stop the
+    other tests.
+
+    Arguments:
+        config {tuple} -- Arguments (uni_bi, h, w, tau_max, costs, assment,
+            sparse, seed).
+
+    Returns:
+        {(int*dict*str)} -- Seed, results of network_check, and error message
+            if an exception was raised, or None.
+    """
+    (uni_bi, h, w, tau_max, costs, assment, sparse, seed) = config
+    try:
+        net = Network(uni_bi, h=h, w=w, seed=seed, sparse=sparse)
         net.assign_link_costs(costs)
         net.find_all_paths(tau_max=tau_max, assignment=assment)
         net.generate_od_pairs()
@@ -157,28 +185,103 @@ def make_test(uni_bi, h, w, tau_max, costs, assment, num_tests=1000):
         net.generate_random_proportions(like_paper=True)
         net.compute_assignment_matrix()
         # net.P_ms = [np.ones(net.P.shape) for _ in range(net.tau_max)]
-        network_check(net)
+        return (seed, network_check(net), None)
+    except Exception as e:
+        return (seed, {}, '{t}: {e}'.format(t=type(e).__name__, e=e))
+
+def make_test(
+        uni_bi, h, w, tau_max, costs, assment, num_tests=1000, sparse=False,
+        seed=0, processes=None, pool=None
+    ):
+    """Runs randomised tests of a configuration over a process pool, and
+    prints a summary of failed checks with the seeds of the offending
+    networks. Seeds of the networks are drawn from a seed sequence, so that
+    any failing test can be rebuilt alone with Network(..., seed=seed).
+
+    Arguments:
+        uni_bi {str} -- Network direction, 'uni' or 'bi'.
+        h {int} -- Height of network.
+        w {int} -- Width of network.
+        tau_max {int or str} -- Maximum path length, or 'mpl'.
+        costs {str} -- Link costs.
+        assment {str} -- Assignment.
+
+    Keyword Arguments:
+        num_tests {int} -- Number of networks to test (default: {1000})
+        sparse {bool} -- Whether networks are sparse (default: {False})
+        seed {int} -- Seed of the sequence of network seeds (default: {0})
+        processes {int} -- Number of worker processes, all cores if None
+            (default: {None})
+        pool {multiprocessing.Pool} -- Existing pool to run tests on, instead
+            of starting one (default: {None})
+
+    Returns:
+        {dict} -- Summary with the number of tests, the seeds failing each
+            check, and the errors raised by seed.
+    """
+    seeds = np.random.SeedSequence(seed).generate_state(num_tests)
+    configs = [
+        (uni_bi, h, w, tau_max, costs, assment, sparse, int(s)) for s in seeds
+    ]
+    chunksize = max(1, num_tests // (8*(processes or 8)))
+    if pool is None:
+        with Pool(processes) as own_pool:
+            outcomes = own_pool.map(check_seed, configs, chunksize)
+    else:
+        outcomes = pool.map(check_seed, configs, chunksize)
+
+    summary = {
+        'num_tests': num_tests,
+        'failed': {check: [] for check in CHECKS},
+        'errors': {}
+    }
+    for (s, results, error) in outcomes:
+        if error is not None:
+            summary['errors'][s] = error
+        for (check, passed) in results.items():
+            if not passed:
+                summary['failed'][check].append(s)
+    summary['failed'] = {c: s for (c, s) in summary['failed'].items() if s}
+
+    print('{uni_bi}directional, {h} by {w}, tau_max:{tau_max}, {costs} link costs, {assment} assignment:'.format(
+        uni_bi=uni_bi,
+        h=h,
+        w=w,
+        tau_max=tau_max,
+        costs=costs,
+        assment=assment
+    ))
+    if not summary['failed'] and not summary['errors']:
+        print('\tAll {n} tests passed successfully\n'.format(n=num_tests))
     else:
-        print(
-            '{uni_bi}directional, {h} by {w}, tau_max:{tau_max}, {costs} link costs, {assment} assignment:\n\tAll tests passed successfully\n'.format(
-                uni_bi=uni_bi,
-                h=h,
-                w=w,
-                tau_max=tau_max,
-                costs=costs,
-                assment=assment
+        for (check, failed) in summary['failed'].items():
+            print('\tFAILED: {check} in {n}/{t} tests, seeds {s}'.format(
+                check=check, n=len(failed), t=num_tests, s=failed[:10]
             ))
+        for (s, error) in list(summary['errors'].items())[:10]:
+            print('\tERROR with seed {s}: {e}'.format(s=s, e=error))
+        print()
+    return summary
 
 if __name__ == '__main__':
     # Change parameters to test different assignments and topologies
     N_TESTS = 1000
-    make_test('uni', 3, 3, 4, 'rigid', 'random', N_TESTS)
-    make_test('uni', 3, 3, 4, 'rigid', 'shortest_path', N_TESTS)
-    make_test('uni', 3, 3, 4, 'real', 'shortest_path', N_TESTS)
-    make_test('uni', 3, 3, 'mpl', 'real', 'shortest_path', N_TESTS)
-    make_test('bi', 3, 3, 4, 'rigid', 'random', N_TESTS)
-    make_test('bi', 3, 3, 4, 'rigid', 'shortest_path', N_TESTS)
-    make_test('bi', 3, 3, 4, 'real', 'shortest_path', N_TESTS)
-    make_test('bi', 3, 3, 'mpl', 'real', 'shortest_path', N_TESTS)
-    make_test('bi', 3, 3, 2, 'real', 'shortest_path', N_TESTS)
-    make_test('bi', 8, 8, 4, 'real', 'shortest_path', 50)
\ No newline at end of file
+    CONFIGS = [
+        ('uni', 3, 3, 4, 'rigid', 'random', N_TESTS),
+        ('uni', 3, 3, 4, 'rigid', 'shortest_path', N_TESTS),
+        ('uni', 3, 3, 4, 'real', 'shortest_path', N_TESTS),
+        ('uni', 3, 3, 'mpl', 'real', 'shortest_path', N_TESTS),
+        ('bi', 3, 3, 4, 'rigid', 'random', N_TESTS),
+        ('bi', 3, 3, 4, 'rigid', 'shortest_path', N_TESTS),
+        ('bi', 3, 3, 4, 'real', 'shortest_path', N_TESTS),
+        ('bi', 3, 3, 'mpl', 'real', 'shortest_path', N_TESTS),
+        ('bi', 3, 3, 2, 'real', 'shortest_path', N_TESTS),
+        ('bi', 8, 8, 4, 'real', 'shortest_path', 50)
+    ]
+    with Pool() as pool:
+        summaries = [make_test(*config, pool=pool) for config in CONFIGS]
+    n_failed = sum(
+        len(s['errors']) + sum(len(f) for f in s['failed'].values())
+        for s in summaries
+    )
+    print('{n} failures over {c} configurations'.format(n=n_failed, c=len(CONFIGS)))
@@ -0,0 +1,9 @@
+"""
+Makes the modules of Code/src importable by the tests, which are run with
+python -m pytest tests from Code/src.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
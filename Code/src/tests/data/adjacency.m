@@ -0,0 +1,7 @@
+function [A]=AdjacentMatrixSmall (~)
+% Four nodes as in AdjacentMatrixGEANT.m, the last one isolated
+n=5;
+A=zeros (n,n);
+A(1,2)=1;A(2,1)=1;A(2,3)=2.5; % A(4,1)=1;
+A(3,2)=2.5;A(3,4)=1;
+A(4,3)=1;
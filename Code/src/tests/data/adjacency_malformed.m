@@ -0,0 +1,4 @@
+function [A]=AdjacentMatrixMalformed (~)
+n=3;
+A=zeros (n,n);
+A(1,2)=1;A(2,1)=one;
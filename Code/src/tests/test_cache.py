@@ -0,0 +1,69 @@
+"""
+Checks that topologies loaded from the on-disk cache equal topologies built
+from scratch, and that changing any input of a topology misses the cache.
+"""
+
+import numpy as np
+import pytest
+
+from network import Network, to_dense
+
+CASES = [
+    ('real', 4, 'shortest_path', None, False),
+    ('mult_int', 4, 'shortest_path', None, True),
+    ('rigid', 4, 'random', None, False),
+    ('rigid', 5, 'random', 2, True)
+]
+
+def build(seed=1, costs='rigid', tau_max=4, assignment='shortest_path', k_paths=None,
+          sparse=False, cache_dir=None):
+    net = Network('bi', h=3, w=3, seed=seed, sparse=sparse)
+    cached = net.build_topology(costs, tau_max, assignment, cache_dir=cache_dir, k_paths=k_paths)
+    return (net, cached)
+
+@pytest.mark.parametrize('case', CASES)
+def test_cache_round_trip(case, tmp_path):
+    (costs, tau_max, assignment, k_paths, sparse) = case
+    kwargs = dict(costs=costs, tau_max=tau_max, assignment=assignment, k_paths=k_paths, sparse=sparse)
+    (fresh, _) = build(**kwargs)
+    (_, cached) = build(cache_dir=str(tmp_path), **kwargs)
+    assert not cached
+    (net, cached) = build(cache_dir=str(tmp_path), **kwargs)
+    assert cached
+    assert net.tau_max == fresh.tau_max and net.k_paths == fresh.k_paths
+    assert list(net.c) == list(fresh.c)
+    assert net.paths == fresh.paths and net.paths_links == fresh.paths_links
+    assert net.od_pairs == fresh.od_pairs and net.origins == fresh.origins
+    assert np.array_equal(net.F, fresh.F)
+    assert np.array_equal(net.T_plus, fresh.T_plus)
+    assert np.array_equal(net.T_minus, fresh.T_minus)
+    assert np.array_equal(net.lc, fresh.lc)
+    assert len(net.Delta_ms) == len(fresh.Delta_ms)
+    for (a, b) in zip(net.Delta_ms, fresh.Delta_ms):
+        assert np.array_equal(to_dense(a), to_dense(b))
+    # The random state is restored, so later draws are the same
+    net.generate_random_proportions()
+    fresh.generate_random_proportions()
+    net.compute_assignment_matrix()
+    fresh.compute_assignment_matrix()
+    for (a, b) in zip(net.P_ms, fresh.P_ms):
+        assert np.array_equal(to_dense(a), to_dense(b))
+
+def test_cache_keys(tmp_path):
+    configs = [
+        {},
+        {'seed': 2},
+        {'costs': 'mult_int'},
+        {'tau_max': 3},
+        {'assignment': 'random'},
+        {'assignment': 'random', 'k_paths': 2}
+    ]
+    # Each configuration misses the cache the first time, so that no two of
+    # them share a key, and hits it the second time
+    for config in configs:
+        (_, cached) = build(cache_dir=str(tmp_path), **config)
+        assert not cached, config
+    assert len(list(tmp_path.iterdir())) == len(configs)
+    for config in configs:
+        (_, cached) = build(cache_dir=str(tmp_path), **config)
+        assert cached, config
@@ -0,0 +1,282 @@
+"""
+Checks the vectorised path assignment, assignment, convolution and constraint
+builders against the loop implementations they replaced, on small grids for
+both assignments, with dense and sparse storage.
+"""
+
+import heapq
+
+import networkx as nx
+import numpy as np
+import pytest
+
+import network
+from network import Network, conv_link_counts, mat_conv, stack_ms, to_dense
+from solver import Solver
+from convolver import StreamConvolver
+
+CASES = [
+    (uni_bi, h, costs, assignment, sparse)
+    for uni_bi in ('uni', 'bi')
+    for h in (3, 4)
+    for (costs, assignment) in (('rigid', 'random'), ('real', 'shortest_path'))
+    for sparse in (False, True)
+]
+
+def build(uni_bi, h, costs, assignment, sparse, seed=3):
+    net = Network(uni_bi, h=h, w=h, seed=seed, sparse=sparse)
+    net.build_topology(costs, 4, assignment)
+    net.generate_random_proportions()
+    net.compute_assignment_matrix()
+    return net
+
+# Loop implementations of the original code
+def loop_path_assignment(net):
+    """Returns Delta_ms and lc."""
+    Delta_ms = [
+        np.zeros((len(net.links), len(net.paths)), np.int8)
+        for _ in range(net.tau_max)
+    ]
+    if net.assignment == 'random':
+        lc = np.ones((len(net.links), len(net.origins)))
+        for (p_idx, pl) in enumerate(net.paths_links):
+            for tau in range(min(net.tau_max, len(pl))):
+                Delta_ms[tau][pl[tau],p_idx] = 1
+        return (Delta_ms, lc)
+    T_minus = np.ceil(net.F)
+    T_plus = np.floor(net.F + 1)
+    lc = np.zeros((len(net.links), len(net.origins)))
+    for (l_i, l) in enumerate(net.links):
+        for (o_i, o) in enumerate(net.origins):
+            if T_plus[l[0],o] != np.inf and T_plus[l[1],o] != np.inf:
+                lc[l_i,o_i] = max(T_minus[l[1],o] - T_plus[l[0],o] + 1, 1)
+            else:
+                lc[l_i,o_i] = 1
+    for (p_idx, pl) in enumerate(net.paths_links):
+        o = net.links[pl[0]][0]
+        for l_idx in pl:
+            (i, j) = net.links[l_idx]
+            for tau in range(net.tau_max):
+                if tau+1 >= T_plus[i,o] and tau+1 <= T_minus[j,o] and T_minus[j,o] != np.inf:
+                    Delta_ms[tau][l_idx,p_idx] = 1
+    return (Delta_ms, lc)
+
+def loop_assignment(net, Delta_ms):
+    """Returns A_ms and P_ms from the proportions of the network."""
+    od_path = to_dense(net.od_path_proportions)
+    o_od = to_dense(net.o_od_proportions)
+    A_ms = [np.zeros((len(net.links), len(net.od_pairs))) for _ in range(net.tau_max)]
+    P_ms = [np.zeros((len(net.links), len(net.origins))) for _ in range(net.tau_max)]
+    for (od_i, od) in enumerate(net.od_pairs):
+        for (p_i, p) in enumerate(net.paths):
+            if (p[0], p[-1]) == od:
+                for tau in range(net.tau_max):
+                    A_ms[tau][:,od_i] += Delta_ms[tau][:,p_i]*od_path[od_i,p_i]
+    for (o_i, o) in enumerate(net.origins):
+        for (od_i, od) in enumerate(net.od_pairs):
+            if od[0] == o:
+                for tau in range(net.tau_max):
+                    P_ms[tau][:,o_i] += A_ms[tau][:,od_i]*o_od[o_i,od_i]
+    return (A_ms, P_ms)
+
+def loop_conv(M, v):
+    tau_max = len(M)
+    full_flows = [np.zeros(len(v[0])) for _ in range(tau_max-1)] + list(v)
+    res = []
+    for t in range(len(v)):
+        y = np.zeros(M[0].shape[0])
+        for tau in range(tau_max):
+            y = y + M[tau] @ full_flows[t-tau+tau_max-1]
+        res.append(y)
+    return np.array(res)
+
+def loop_multi_step_constraints(net, P_ms):
+    """Returns c3, c4, c5 masks and, for shortest path assignment, c7, with
+    the shapes of Solver.get_multi_step_constraints. c4 is the support of
+    P_ms, whose proportions are all positive."""
+    (n_l, n_o, n_n) = (len(net.links), len(net.origins), len(net.nodes))
+    c3 = np.full((net.tau_max, n_l, n_o), False)
+    for (l_i, l) in enumerate(net.links):
+        for (o_i, o) in enumerate(net.origins):
+            c3[0,l_i,o_i] = l[0] == o
+    c4 = np.stack(P_ms) > 0
+    c5_in_edges = np.full((n_l, n_n), False)
+    c5_out_edges = np.full((n_l, n_n), False)
+    for (l_i, l) in enumerate(net.links):
+        for (n_i, n) in enumerate(net.nodes):
+            if l[1] == n:
+                c5_in_edges[l_i,n_i] = True
+            elif l[0] == n:
+                c5_out_edges[l_i,n_i] = True
+    c5_in_check = np.full((net.tau_max, n_o, n_n), False)
+    c5_out_check = np.full((net.tau_max, n_o, n_n), False)
+    c7 = None
+    for (o_i, o) in enumerate(net.origins):
+        for (n_i, n) in enumerate(net.nodes):
+            if o == n:
+                continue
+            if net.assignment == 'random':
+                c5_in_check[:net.tau_max-1,o_i,n_i] = True
+                c5_out_check[1:,o_i,n_i] = True
+                continue
+            arr_tau = net.T_minus[n_i,o] - 1
+            dep_tau = net.T_plus[n_i,o] - 1
+            if 0 <= arr_tau <= dep_tau < net.tau_max:
+                c5_in_check[int(arr_tau),o_i,n_i] = True
+                c5_out_check[int(dep_tau),o_i,n_i] = True
+    if net.assignment == 'shortest_path':
+        c7 = (np.zeros((n_l, n_o), int), np.zeros((n_l, n_o), int))
+        for (l_i, l) in enumerate(net.links):
+            for (o_i, o) in enumerate(net.origins):
+                enter_tau = net.T_plus[l[0],o] - 1
+                leave_tau = net.T_minus[l[1],o] - 1
+                if leave_tau < net.tau_max - 1 and leave_tau > enter_tau:
+                    c7[0][l_i,o_i] = enter_tau
+                    c7[1][l_i,o_i] = leave_tau
+    return (
+        np.concatenate(c3, axis=1), np.concatenate(c4, axis=1),
+        c5_in_edges, c5_out_edges,
+        np.concatenate(c5_in_check, axis=0), np.concatenate(c5_out_check, axis=0),
+        c7
+    )
+
+@pytest.mark.parametrize('case', CASES)
+def test_spl_engines(case):
+    net = build(*case)
+    F = np.array(net.F)
+    assert np.array_equal(net.compute_spl_matrix(engine='networkx'), F)
+
+@pytest.mark.parametrize('case', CASES)
+def test_path_assignment_matrix(case):
+    net = build(*case)
+    (Delta_ms, lc) = loop_path_assignment(net)
+    assert np.array_equal(stack_ms(net.Delta_ms), np.stack(Delta_ms))
+    assert np.array_equal(to_dense(net.Delta), sum(Delta_ms))
+    assert np.array_equal(net.lc, lc)
+
+@pytest.mark.parametrize('case', CASES)
+def test_assignment_matrix(case):
+    net = build(*case)
+    (A_ms, P_ms) = loop_assignment(net, loop_path_assignment(net)[0])
+    assert np.allclose(stack_ms(net.A_ms), np.stack(A_ms))
+    assert np.allclose(stack_ms(net.P_ms), np.stack(P_ms))
+    assert np.allclose(to_dense(net.P), sum(P_ms))
+
+@pytest.mark.parametrize('case', CASES[::2])
+def test_dense_sparse_storage(case):
+    dense = build(*case)
+    sparse = build(*case[:-1], True)
+    for name in ('Delta_ms', 'A_ms', 'P_ms'):
+        assert np.allclose(stack_ms(getattr(dense, name)), stack_ms(getattr(sparse, name)))
+
+@pytest.mark.parametrize('case', CASES)
+def test_conv_link_counts(case):
+    net = build(*case)
+    X = np.random.RandomState(0).rand(2, 30, len(net.origins))
+    Y = np.stack([loop_conv([to_dense(p) for p in net.P_ms], x) for x in X])
+    for method in ('direct', 'fft'):
+        assert np.allclose(conv_link_counts(net.P_ms, X, method=method), Y)
+    assert np.allclose(np.array(mat_conv(net.P_ms, list(X[0]))), Y[0])
+
+@pytest.mark.parametrize('case', CASES)
+def test_multi_step_constraints(case):
+    net = build(*case)
+    solver = Solver(net)
+    solver.get_multi_step_constraints()
+    (c3, c4, in_edges, out_edges, in_check, out_check, c7) = loop_multi_step_constraints(
+        net, loop_assignment(net, loop_path_assignment(net)[0])[1]
+    )
+    assert np.array_equal(solver.c3, c3)
+    assert np.array_equal(solver.c4, c4)
+    assert np.array_equal(solver.c5_in_edges, in_edges)
+    assert np.array_equal(solver.c5_out_edges, out_edges)
+    assert np.array_equal(solver.c5_in_check, in_check)
+    assert np.array_equal(solver.c5_out_check, out_check)
+    if c7 is not None:
+        assert np.array_equal(solver.c7_enter_link, c7[0])
+        assert np.array_equal(solver.c7_end_link, c7[1])
+
+@pytest.mark.parametrize('case', CASES)
+def test_single_step_constraints(case):
+    net = build(*case)
+    solver = Solver(net)
+    solver.get_single_step_constraints()
+    P = sum(loop_assignment(net, loop_path_assignment(net)[0])[1])
+    (_, _, in_edges, out_edges, _, _, _) = loop_multi_step_constraints(net, [P])
+    assert np.array_equal(solver.c4, P > 0)
+    assert np.array_equal(solver.c3, np.array(
+        [[l[0] == o for o in net.origins] for l in net.links]
+    ))
+    assert np.array_equal(solver.c5_in_edges, in_edges)
+    assert np.array_equal(solver.c5_out_edges, out_edges)
+    assert np.array_equal(solver.c5_in_check, np.array(net.origins)[:,None] != np.array(net.nodes)[None,:])
+
+@pytest.mark.parametrize('case', CASES)
+def test_stream_convolver(case):
+    net = build(*case)
+    X = np.random.RandomState(0).rand(40, len(net.origins))
+    conv = StreamConvolver(net)
+    Y = [conv.push(x).copy() for x in X[:10]]
+    Y.extend(conv.push_many(X[10:30]))
+    Y.extend(conv.push(x).copy() for x in X[30:])
+    assert np.allclose(np.array(Y), conv_link_counts(net.P_ms, X))
+
+@pytest.mark.parametrize('uni_bi, h, costs, tau_max', [
+    ('bi', 3, 'real', 2.5), ('uni', 4, 'real', 3), ('bi', 4, 'mult_int', 4),
+    ('bi', 5, 'real', 2.5), ('bi', 4, 'rigid', 2), ('bi', 4, 'real', 'mpl')
+])
+def test_pruned_shortest_paths(uni_bi, h, costs, tau_max):
+    for seed in range(5):
+        net = Network(uni_bi, h=h, w=h, seed=seed+1)
+        net.assign_link_costs(costs)
+        net.find_all_paths(tau_max, 'shortest_path')
+        # Shortest paths of all OD pairs, filtered afterwards
+        mpl = np.amax(net.F)
+        if tau_max != 'mpl':
+            mpl = min(mpl, tau_max)
+        link_idxs = {link:l for (l,link) in enumerate(net.links)}
+        paths = sorted(
+            ([link_idxs[link] for link in zip(p[:-1], p[1:])], p)
+            for p in net.shortest_paths()
+        )
+        paths = [
+            (pl, p) for (pl, p) in paths if sum(net.c[l] for l in pl) <= mpl
+        ]
+        assert list(zip(net.paths_links, net.paths)) == paths
+
+@pytest.mark.parametrize('uni_bi, h, tau_max, k_paths', [
+    ('bi', 3, 4, 1), ('bi', 4, 5, 2), ('uni', 4, 6, 3), ('bi', 4, 6, 5)
+])
+def test_k_shortest_paths(uni_bi, h, tau_max, k_paths):
+    net = Network(uni_bi, h=h, w=h, seed=1)
+    net.assign_link_costs('rigid')
+    net.find_all_paths(tau_max, 'random', k_paths=k_paths)
+    # k first of all simple paths by number of links, then link indexes
+    link_idxs = {link:l for (l,link) in enumerate(net.links)}
+    paths = []
+    for (n1, n2) in net.node_pairs():
+        od_paths = sorted(
+            ([link_idxs[link] for link in zip(p[:-1], p[1:])], p)
+            for p in nx.all_simple_paths(net.G, n1, n2, cutoff=tau_max)
+        )
+        od_paths.sort(key=lambda pl_p: len(pl_p[0]))
+        paths.extend(od_paths[:k_paths])
+    assert list(zip(net.paths_links, net.paths)) == sorted(paths)
+
+def test_k_shortest_paths_ties(monkeypatch):
+    # Grids have many paths of the same length, which are not enumerated
+    pops = []
+    pop = heapq.heappop
+    def heappop(heap):
+        pops.append(1)
+        return pop(heap)
+    monkeypatch.setattr(network.heapq, 'heappop', heappop)
+    net = Network('bi', h=8, w=8, seed=1)
+    net.assign_link_costs('rigid')
+    net.find_all_paths(14, 'random', k_paths=1)
+    net.generate_od_pairs()
+    assert len(net.paths) == len(net.od_pairs) == 64*63
+    # Ties are followed depth first, so each OD pair pops one partial path
+    # per node of its shortest path
+    dist = net.F[np.ix_(net.nodes, net.nodes)]
+    assert len(pops) == np.sum(dist + 1) - len(net.nodes)
@@ -0,0 +1,49 @@
+"""
+Checks that the sparse X step of the Estimator returns nonnegative O-flows
+within the error bound whenever any are, and flags them otherwise.
+"""
+
+import numpy as np
+import pytest
+from scipy.fft import idct
+
+from estimator import Estimator, link_counts
+from network import Network, stack_ms
+from solver import Solver
+
+@pytest.fixture(scope='module')
+def problem():
+    rng = np.random.RandomState(0)
+    net = Network('bi', h=3, w=3, seed=3)
+    net.build_topology('real', 4, 'shortest_path')
+    net.generate_random_proportions()
+    net.compute_assignment_matrix()
+    solver = Solver(net)
+    solver.get_multi_step_constraints()
+    P = stack_ms(net.P_ms)
+    # O-flows with a sparse DCT, and noisy link counts
+    C = np.zeros((len(net.origins), 20))
+    C[:,:3] = rng.rand(len(net.origins), 3)
+    C[:,0] += 2
+    Y = link_counts(P, idct(C, norm='ortho', axis=1))
+    Y += 3e-3*rng.randn(*Y.shape)
+    estimator = Estimator(net, solver)
+    X_ls = estimator.estimate_X(Y, P)
+    return (estimator, Y, P, np.linalg.norm(link_counts(P, X_ls) - Y))
+
+@pytest.mark.parametrize('scale, max_iter', [(4, 5000), (1.2, 200), (1.2, 5000)])
+def test_sparse_x_feasible(problem, scale, max_iter):
+    (estimator, Y, P, residual_ls) = problem
+    bound = scale*residual_ls
+    (X, converged) = estimator.estimate_X_sparse(Y, P, bound, max_iter=max_iter)
+    assert X.min() >= 0
+    assert np.linalg.norm(link_counts(P, X) - Y) <= bound*(1 + 1e-6)
+    if max_iter == 200:
+        assert not converged
+
+def test_sparse_x_infeasible(problem):
+    (estimator, Y, P, residual_ls) = problem
+    (X, converged) = estimator.estimate_X_sparse(Y, P, residual_ls/2)
+    assert not converged
+    assert X.min() >= 0
+    assert np.isclose(np.linalg.norm(link_counts(P, X) - Y), residual_ls)
@@ -0,0 +1,149 @@
+"""
+Checks that link cost changes, removals and additions repair the topology,
+assignment matrices and constraints as a network and Solver built from
+scratch with the new links and costs.
+"""
+
+import copy
+
+import numpy as np
+import pytest
+
+from network import Network, to_dense
+from solver import Solver
+
+CASES = [
+    ('bi', 3, 'real', 4, 'shortest_path', None, False),
+    ('bi', 4, 'mult_int', 4, 'shortest_path', None, True),
+    ('uni', 4, 'real', 4, 'shortest_path', None, False),
+    ('bi', 3, 'rigid', 3, 'shortest_path', None, True),
+    ('bi', 3, 'rigid', 4, 'random', None, False),
+    ('uni', 3, 'rigid', 4, 'random', None, True),
+    ('bi', 4, 'rigid', 5, 'random', 2, True),
+    ('uni', 4, 'rigid', 5, 'random', 1, False)
+]
+MASKS = ['c3', 'c4', 'c5_in_edges', 'c5_out_edges', 'c5_in_check', 'c5_out_check']
+
+def rebuild(net):
+    ref = Network(None, nodes=net.nodes, links=net.links, seed=0, sparse=net.sparse)
+    ref.assign_link_costs(list(net.c))
+    ref.find_all_paths(net.tau_max, net.assignment, k_paths=net.k_paths)
+    # Repairs keep tau_max, which find_all_paths may reduce to the longest
+    # path, leaving the paths unchanged
+    ref.tau_max = net.tau_max
+    ref.generate_od_pairs()
+    ref.compute_path_assignment_matrix()
+    return ref
+
+def random_update(net, rng):
+    ops = ['remove', 'add'] + (['cost'] if net.assignment == 'shortest_path' else [])
+    op = ops[rng.randint(len(ops))]
+    rigid = all(cst == 1 for cst in net.c)
+    if op == 'cost':
+        link = net.links[rng.randint(len(net.links))]
+        net.update_link_cost(link, int(rng.randint(1, 3)) if rigid else float(rng.rand()*4 + 0.1))
+    elif op == 'remove':
+        net.remove_link(net.links[rng.randint(len(net.links))])
+    else:
+        missing = [
+            (i, j) for i in net.nodes for j in net.nodes
+            if i != j and not net.G.has_edge(i, j)
+        ]
+        net.add_link(missing[rng.randint(len(missing))], 1 if rigid else 2)
+
+def check_topology(net, ref):
+    assert net.paths == ref.paths and net.paths_links == ref.paths_links
+    assert net.od_pairs == ref.od_pairs and net.origins == ref.origins
+    assert np.array_equal(net.F, ref.F)
+    assert np.array_equal(net.T_plus, ref.T_plus) and np.array_equal(net.T_minus, ref.T_minus)
+    assert np.array_equal(net.lc, ref.lc)
+    assert (net.Delta_tall != ref.Delta_tall).nnz == 0
+    for (a, b) in zip(net.Delta_ms, ref.Delta_ms):
+        assert np.array_equal(to_dense(a), to_dense(b))
+
+def check_assignment(net):
+    full = copy.copy(net)
+    full.compute_assignment_matrix()
+    for name in ('A_ms', 'P_ms'):
+        for (a, b) in zip(getattr(net, name), getattr(full, name)):
+            assert np.allclose(to_dense(a), to_dense(b))
+    for name in ('A', 'P'):
+        assert np.allclose(to_dense(getattr(net, name)), to_dense(getattr(full, name)))
+
+def check_constraints(solver, net):
+    ref = Solver(net)
+    ref.get_multi_step_constraints()
+    masks = MASKS + (['c7_enter_link', 'c7_end_link'] if net.assignment == 'shortest_path' else [])
+    for name in masks:
+        assert np.array_equal(getattr(solver, name), getattr(ref, name)), name
+    (A_eq, _, A_ineq, _, _, ub) = solver.get_standard_form()
+    (A_eq_ref, _, A_ineq_ref, _, _, ub_ref) = ref.get_standard_form()
+    assert (A_eq != A_eq_ref).nnz == 0 and (A_ineq != A_ineq_ref).nnz == 0
+    assert np.array_equal(ub, ub_ref)
+
+@pytest.mark.parametrize('case', CASES)
+def test_random_updates(case):
+    (uni_bi, h, costs, tau_max, assignment, k_paths, sparse) = case
+    rng = np.random.RandomState(0)
+    for seed in range(8):
+        net = Network(uni_bi, h=h, w=h, seed=seed, sparse=sparse)
+        net.build_topology(costs, tau_max, assignment, k_paths=k_paths)
+        net.generate_random_proportions()
+        net.compute_assignment_matrix()
+        solver = Solver(net)
+        solver.get_multi_step_constraints()
+        for step in range(4):
+            random_update(net, rng)
+            check_topology(net, rebuild(net))
+            check_assignment(net)
+            # Constraints are also updated after several repairs
+            if step % 2:
+                solver.update_constraints()
+                check_constraints(solver, net)
+
+@pytest.mark.parametrize('case', [c for c in CASES if c[4] == 'shortest_path'])
+def test_cost_updates(case):
+    # Links and origins are kept, so constraints are patched
+    (uni_bi, h, costs, tau_max, assignment, k_paths, sparse) = case
+    rng = np.random.RandomState(2)
+    for seed in range(4):
+        net = Network(uni_bi, h=h, w=h, seed=seed, sparse=sparse)
+        net.build_topology(costs, tau_max, assignment)
+        net.generate_random_proportions()
+        net.compute_assignment_matrix()
+        solver = Solver(net)
+        solver.get_multi_step_constraints()
+        for step in range(6):
+            link = net.links[rng.randint(len(net.links))]
+            net.update_link_cost(
+                link, int(rng.randint(1, 3)) if costs == 'rigid' else float(rng.rand()*4 + 0.1)
+            )
+            check_assignment(net)
+            if step % 2:
+                solver.update_constraints()
+                check_constraints(solver, net)
+
+def test_single_step_update():
+    net = Network('bi', h=4, w=4, seed=1)
+    net.build_topology('real', 4, 'shortest_path')
+    solver = Solver(net)
+    solver.get_single_step_constraints()
+    rng = np.random.RandomState(1)
+    for _ in range(6):
+        link = net.links[rng.randint(len(net.links))]
+        net.update_link_cost(link, float(rng.rand()*4 + 0.1))
+        solver.update_constraints()
+        ref = Solver(net)
+        ref.get_single_step_constraints()
+        for name in MASKS:
+            assert np.array_equal(getattr(solver, name), getattr(ref, name)), name
+
+def test_unchanged_cost():
+    net = Network('bi', h=4, w=4, seed=1)
+    net.build_topology('real', 4, 'shortest_path')
+    net.generate_random_proportions()
+    net.compute_assignment_matrix()
+    (paths, P) = (net.paths, [p.copy() for p in net.P_ms])
+    net.update_link_cost(net.links[0], net.c[0])
+    assert net.paths is paths
+    assert all(np.array_equal(a, b) for (a, b) in zip(net.P_ms, P))
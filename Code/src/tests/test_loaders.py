@@ -0,0 +1,95 @@
+"""
+Checks the readers of loaders.py on the small files of tests/data, and that
+malformed files raise a ValueError naming the file.
+"""
+
+import os
+
+import numpy as np
+import pytest
+import scipy.io as io
+import scipy.sparse as sp
+
+from loaders import read_adjacency, read_edge_list, read_graphml, read_matlab_adjacency
+from network import Network
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+def data(name):
+    return os.path.join(DATA, name)
+
+def link_costs(links, costs):
+    return {tuple(link): cost for (link, cost) in zip(links.tolist(), costs.tolist())}
+
+def test_read_adjacency(tmp_path):
+    adj = np.array([[0, 1, 0], [2, 0, 0], [0, 3, 0]])
+    expected = {(0, 1): 1, (1, 0): 2, (2, 1): 3}
+    (labels, links, costs) = read_adjacency(adj)
+    assert labels == [0, 1, 2] and link_costs(links, costs) == expected
+    sp.save_npz(str(tmp_path / 'adj.npz'), sp.csr_matrix(adj))
+    (labels, links, costs) = read_adjacency(str(tmp_path / 'adj.npz'))
+    assert labels == [0, 1, 2] and link_costs(links, costs) == expected
+    io.savemat(str(tmp_path / 'adj.mat'), {'A': adj, 'B': np.eye(2)})
+    (labels, links, costs) = read_adjacency(str(tmp_path / 'adj.mat'), key='A')
+    assert labels == [0, 1, 2] and link_costs(links, costs) == expected
+    with pytest.raises(ValueError, match='pass the key'):
+        read_adjacency(str(tmp_path / 'adj.mat'))
+    with pytest.raises(ValueError, match='not square'):
+        read_adjacency(np.ones((2, 3)))
+
+def test_read_matlab_adjacency():
+    (labels, links, costs) = read_adjacency(data('adjacency.m'))
+    # The declared size keeps the isolated node, and comments are skipped
+    assert labels == list(range(5))
+    assert link_costs(links, costs) == {
+        (0, 1): 1, (1, 0): 1, (1, 2): 2.5, (2, 1): 2.5, (2, 3): 1, (3, 2): 1
+    }
+    net = Network.from_adjacency(data('adjacency.m'))
+    assert len(net.nodes) == 5 and len(net.links) == 6
+
+def test_read_edge_list():
+    (labels, links, costs) = read_edge_list(data('edges.txt'))
+    # Integer labels are sorted numerically, and links reindexed
+    assert labels == [2, 7, 10]
+    assert link_costs(links, costs) == {(2, 0): 1.5, (0, 1): 2, (1, 2): 0.5, (2, 1): 3}
+    net = Network.from_edge_list(data('edges.txt'))
+    assert net.node_labels == [2, 7, 10]
+    assert net.links == [(0, 1), (1, 2), (2, 0), (2, 1)]
+    assert list(net.c) == [2, 0.5, 1.5, 3]
+
+def test_read_edge_list_undirected():
+    (labels, links, costs) = read_edge_list(
+        data('edges_labels.csv'), delimiter=',', directed=False
+    )
+    # Other labels are kept in order of appearance, and each line gives
+    # links in both directions
+    assert labels == ['lon', 'par', 'ber']
+    assert costs is None
+    assert sorted(map(tuple, links.tolist())) == [(0, 1), (0, 2), (1, 0), (1, 2), (2, 0), (2, 1)]
+
+def test_read_graphml():
+    (labels, links, costs) = read_graphml(data('graph.graphml'))
+    assert labels == ['b', 'a', 'c']
+    # Undirected edges give links in both directions, and edges without a
+    # cost take the default
+    assert link_costs(links, costs) == {
+        (0, 1): 2, (1, 0): 2, (1, 2): 1, (2, 1): 1, (2, 0): 0.5
+    }
+
+@pytest.mark.parametrize('reader, name, message', [
+    (read_matlab_adjacency, 'adjacency_malformed.m', "Line 4 of .* gives cost 'one'"),
+    (read_edge_list, 'edges_malformed.txt', "Line 2 of .* gives cost 'fast'"),
+    (read_graphml, 'graph_malformed.graphml', 'not well-formed XML')
+])
+def test_malformed(reader, name, message):
+    with pytest.raises(ValueError, match=message):
+        reader(data(name))
+
+def test_malformed_matlab_indexes(tmp_path):
+    path = tmp_path / 'adj.m'
+    path.write_text('A(0,1)=1;\n')
+    with pytest.raises(ValueError, match='start from 1'):
+        read_matlab_adjacency(str(path))
+    path.write_text('n=2;\nA(1,3)=1;\n')
+    with pytest.raises(ValueError, match='declares n=2'):
+        read_matlab_adjacency(str(path))
@@ -0,0 +1,40 @@
+"""
+Checks that the true proportions of a network satisfy the standard form of
+the Solver constraints, for both models and assignments.
+"""
+
+import numpy as np
+import pytest
+
+from network import Network, stack_ms, to_dense
+from solver import Solver
+
+CASES = [
+    (uni_bi, costs, assignment, step, sparse)
+    for uni_bi in ('uni', 'bi')
+    for (costs, assignment) in (('rigid', 'random'), ('real', 'shortest_path'), ('mult_int', 'shortest_path'))
+    for step in ('multi', 'single')
+    for sparse in (False, True)
+]
+
+@pytest.mark.parametrize('case', CASES)
+def test_standard_form_feasible(case):
+    (uni_bi, costs, assignment, step, sparse) = case
+    for seed in range(3):
+        net = Network(uni_bi, h=3, w=3, seed=seed, sparse=sparse)
+        net.build_topology(costs, 4, assignment)
+        net.generate_random_proportions()
+        net.compute_assignment_matrix()
+        solver = Solver(net)
+        if step == 'multi':
+            solver.get_multi_step_constraints()
+            # P(:) of the (n_l, n_o, tau_max) Matlab array
+            p = stack_ms(net.P_ms).transpose(1, 2, 0).ravel(order='F')
+        else:
+            solver.get_single_step_constraints()
+            p = to_dense(net.P).ravel(order='F')
+        (A_eq, b_eq, A_ineq, b_ineq, lb, ub) = solver.get_standard_form()
+        assert A_eq.shape[1] == A_ineq.shape[1] == len(p)
+        assert np.allclose(A_eq @ p, b_eq)
+        assert np.all(A_ineq @ p <= b_ineq + 1e-9)
+        assert np.all(lb <= p) and np.all(p <= ub + 1e-9)
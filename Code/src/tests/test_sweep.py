@@ -0,0 +1,33 @@
+"""
+Checks that the sweep runner writes every configuration of a grid to its own
+directory, and hashes all the sources which generate the data.
+"""
+
+import os
+
+import pytest
+
+import sweep
+from sweep import DEFAULTS, config_dir, expand_grid, run_sweep
+
+def test_config_dirs_distinct():
+    grid = {
+        'direction': ['bi', 'uni'],
+        'seed': [None, 1],
+        'export': ['mat', 'hdf5'],
+        'standard_form': [False, True]
+    }
+    configs = expand_grid(grid)
+    assert len({config_dir(c) for c in configs}) == len(configs)
+    # Default configurations keep the Matlab names
+    assert config_dir(dict(DEFAULTS), '') == 'multi_real_shortest_path_3by3_4taumax_3trials/'
+
+def test_config_dir_collision(tmp_path):
+    with pytest.raises(ValueError, match='both written'):
+        run_sweep({'param': ['n_T', 'size']}, root=str(tmp_path), verbose=False)
+
+def test_sources_include_imports():
+    src_dir = os.path.dirname(os.path.abspath(sweep.__file__))
+    sources = sweep.local_imports(sweep.SOURCES, src_dir)
+    for name in ['network.py', 'solver.py', 'to_matlab.py', 'profiler.py', 'loaders.py', 'topology.py']:
+        assert name in sources
@@ -0,0 +1,121 @@
+"""
+Checks the Matlab export of ToMatlab: MAT-files written per variable group
+and read back with scipy.io.loadmat, and the single version 7.3 MAT-file read
+back with MatH5Reader, hold the same arrays, whatever the number of trials
+generated at once.
+"""
+
+import numpy as np
+import pytest
+import scipy.io as io
+import scipy.sparse as sp
+
+import to_matlab
+from network import Network, to_dense
+from to_matlab import MatH5File, MatH5Reader, MatStreamWriter, ToMatlab
+
+TRIALS = 5
+
+def build(assignment):
+    net = Network('bi', h=3, w=3, seed=4)
+    if assignment == 'shortest_path':
+        net.build_topology('real', 4, 'shortest_path')
+    else:
+        net.build_topology('rigid', 4, 'random')
+    return net
+
+def export(tmp_path, assignment, step, export, block_trials):
+    m_dir = tmp_path / '{e}_{b}'.format(e=export, b=block_trials)
+    m_dir.mkdir()
+    conv = ToMatlab(
+        build(assignment), step=step, trials=TRIALS, m_dir=str(m_dir)+'/',
+        block_trials=block_trials, export=export, standard_form=True
+    )
+    conv.convert_data()
+    return m_dir
+
+def expected_P(assignment, step):
+    # Trials of P_target, drawn as by a single block
+    net = build(assignment)
+    P_ms = net.compute_assignment_matrix_batch(
+        *net.generate_random_proportions_batch(TRIALS, dense=False)
+    )
+    if step == 'multi':
+        return P_ms.transpose(2, 3, 1, 0)
+    return np.sum(P_ms, 1).transpose(1, 2, 0)
+
+def load_mat(m_dir):
+    variables = {}
+    for path in sorted(m_dir.iterdir()):
+        variables.update({
+            k: v for (k, v) in io.loadmat(str(path)).items() if not k.startswith('__')
+        })
+    return variables
+
+def assert_equal(a, b):
+    a = to_dense(a) if sp.issparse(a) else a
+    b = to_dense(b) if sp.issparse(b) else b
+    assert a.shape == b.shape
+    assert np.array_equal(a, b)
+
+@pytest.mark.parametrize('assignment', ['shortest_path', 'random'])
+@pytest.mark.parametrize('step', ['multi', 'single'])
+def test_round_trip(tmp_path, assignment, step):
+    P = expected_P(assignment, step)
+    ref = load_mat(export(tmp_path, assignment, step, 'mat', 100))
+    assert np.allclose(ref['P_target'], P)
+    # Blocks of 2 trials, whose last one is partial
+    blocks = load_mat(export(tmp_path, assignment, step, 'mat', 2))
+    assert set(blocks) == set(ref)
+    for (name, value) in blocks.items():
+        assert_equal(value, ref[name])
+    for block_trials in (2, 100):
+        path = export(tmp_path, assignment, step, 'hdf5', block_trials) / 'data.mat'
+        with MatH5Reader(str(path)) as reader:
+            assert set(reader.keys()) == set(ref)
+            for name in ref:
+                assert_equal(reader[name], ref[name])
+            assert reader.shape('P_target') == P.shape
+            for tr in range(TRIALS):
+                assert np.array_equal(reader.trial('P_target', tr), ref['P_target'][...,tr])
+
+def test_large_P(tmp_path, monkeypatch):
+    # P too large for a version 5 MAT-file is written to a version 7.3 one
+    monkeypatch.setattr(to_matlab, 'MAT5_MAX_BYTES', 1024)
+    m_dir = export(tmp_path, 'shortest_path', 'multi', 'mat', 2)
+    with MatH5Reader(str(m_dir / 'P_target.mat')) as reader:
+        assert np.allclose(reader['P_target'], expected_P('shortest_path', 'multi'))
+    assert 'lc' in io.loadmat(str(m_dir / 'lc.mat'))
+
+def test_stream_writers(tmp_path):
+    rng = np.random.RandomState(0)
+    value = rng.rand(3, 4, 7)
+    path = str(tmp_path / 'stream.mat')
+    with MatStreamWriter(path, 'value', value.shape) as writer:
+        for start in range(0, 7, 3):
+            writer.write(value[...,start:start+3])
+    assert np.array_equal(io.loadmat(path)['value'], value)
+    path = str(tmp_path / 'h5.mat')
+    with MatH5File(path) as h5:
+        with h5.array_writer('value', value.shape) as writer:
+            for start in range(0, 7, 3):
+                writer.write(value[...,start:start+3])
+        h5.save({
+            'empty': np.zeros((0, 3)),
+            'sparse': sp.random(5, 4, density=0.3, random_state=rng, format='csr'),
+            'mask': rng.rand(4, 2) > 0.5,
+            'scalar': 3
+        })
+    with MatH5Reader(path) as reader:
+        assert np.array_equal(reader['value'], value)
+        assert reader['empty'].shape == (0, 3)
+        assert reader['mask'].dtype == bool and reader['mask'].shape == (4, 2)
+        assert reader['sparse'].shape == (5, 4)
+        assert np.array_equal(reader['scalar'], [[3]])
+
+def test_no_trials(tmp_path):
+    net = Network('bi', h=2, w=2, seed=1)
+    net.build_topology('rigid', 3, 'shortest_path')
+    for (trials, block_trials) in ((0, 100), (5, 0)):
+        with pytest.raises(ValueError, match='At least one trial'):
+            ToMatlab(net, trials=trials, block_trials=block_trials, m_dir=str(tmp_path)+'/')
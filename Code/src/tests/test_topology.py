@@ -0,0 +1,19 @@
+"""
+Checks that the synthetic topology generators build sparse networks at the
+sizes of scaling studies.
+"""
+
+import numpy as np
+
+from topology import waxman
+
+def test_waxman_degree():
+    for n in (200, 2000):
+        (n_nodes, links) = waxman(n, seed=1)
+        assert n_nodes == n
+        # Each edge gives a link in both directions
+        assert 3.5 < len(links)/n < 4.5
+        assert np.all(links[:,0] != links[:,1])
+        assert len(np.unique(links, axis=0)) == len(links)
+    (_, links) = waxman(200, degree=10, seed=1)
+    assert 9 < len(links)/200 < 11
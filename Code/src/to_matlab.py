@@ -5,11 +5,363 @@ optimisation routine.
 """
 
 import os
+import time
 import numpy as np
 import scipy.io as io
+import scipy.sparse as sp
+try:
+    import h5py
+except ImportError:
+    # Only needed to export to, or read from, a single HDF5 file
+    h5py = None
 
 from network import Network
 from solver import Solver
+from profiler import profiled
+
+# MAT-file (version 5) data types and array class used when streaming arrays
+MI_INT8 = 1
+MI_INT32 = 5
+MI_UINT32 = 6
+MI_DOUBLE = 9
+MI_MATRIX = 14
+MX_DOUBLE_CLASS = 6
+# Matlab does not reliably load variables of 2 GB or more from version 5 and
+# version 7 MAT-files, so larger arrays are written to version 7.3 MAT-files
+MAT5_MAX_BYTES = 2**31
+
+class MatStreamWriter:
+    """
+    Writes a single double array to an uncompressed MAT-file (version 5), one
+    block at a time along its last dimension. Matlab arrays are stored in
+    column-major order, so each block is a contiguous chunk of the file and
+    only one block needs to be held in memory. The file can be read with
+    Matlab's load, or scipy.io.loadmat. Arrays of MAT5_MAX_BYTES or more are
+    rejected before the file is created, see fits.
+    """
+
+    @staticmethod
+    def fits(shape):
+        """Returns whether a double array of given shape can be written to a
+        version 5 MAT-file.
+        """
+        return 8*int(np.prod(shape)) < MAT5_MAX_BYTES
+
+    def __init__(self, path, name, shape):
+        """Writes the headers of the MAT-file
+        
+        Arguments:
+            path {str} -- Path of the MAT-file.
+            name {str} -- Name of the Matlab variable.
+            shape {int tuple} -- Shape of the full array.
+        """
+        if not self.fits(shape):
+            raise ValueError(
+                'Array {n} of shape {s} takes 2 GB or more, which Matlab does not load from a version 5 MAT-file, use export=\'hdf5\''.format(
+                    n=name, s=tuple(shape)
+                )
+            )
+        self.shape = tuple(shape)
+        self.written = 0
+        name = name.encode('ascii')
+        ndims = len(self.shape)
+        data_bytes = 8*int(np.prod(self.shape))
+        # Subelements: array flags, dimensions, name, real part
+        size = (
+            16 +
+            8 + pad8(4*ndims) +
+            8 + pad8(len(name)) +
+            8 + data_bytes
+        )
+
+        self.file = open(path, 'wb')
+        text = 'MATLAB 5.0 MAT-file, Platform: {p}, Created on: {t}'.format(
+            p=os.name,
+            t=time.asctime()
+        ).encode('ascii')
+        self.file.write(text.ljust(116, b' '))
+        self.file.write(b'\x00'*8)                     # subsystem data offset
+        self.file.write(np.array(0x0100, '<u2').tobytes())
+        self.file.write(b'IM')                          # little-endian
+        self.write_tag(MI_MATRIX, size)
+        self.write_tag(MI_UINT32, 8)
+        self.file.write(np.array([MX_DOUBLE_CLASS, 0], '<u4').tobytes())
+        self.write_tag(MI_INT32, 4*ndims)
+        self.file.write(np.array(self.shape, '<i4').tobytes().ljust(pad8(4*ndims), b'\x00'))
+        self.write_tag(MI_INT8, len(name))
+        self.file.write(name.ljust(pad8(len(name)), b'\x00'))
+        self.write_tag(MI_DOUBLE, data_bytes)
+
+    def write_tag(self, data_type, n_bytes):
+        self.file.write(np.array([data_type, n_bytes], '<u4').tobytes())
+
+    def write(self, block):
+        """Appends a block to the array
+        
+        Arguments:
+            block {np.ndarray} -- Block of the array, with the same shape as
+                the full array except for its last dimension.
+        """
+        assert(block.shape[:-1] == self.shape[:-1]), 'Block shape does not match array'
+        assert(self.written + block.shape[-1] <= self.shape[-1]), 'Too many blocks written'
+        self.file.write(np.asarray(block, '<f8').tobytes(order='F'))
+        self.written += block.shape[-1]
+
+    def close(self):
+        assert(self.written == self.shape[-1]), 'Array was not fully written'
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+
+def pad8(n_bytes):
+    """Number of bytes taken by data of n_bytes, padded to 64-bit boundary"""
+    return n_bytes + (-n_bytes % 8)
+
+# Matlab classes of NumPy data types, in MAT-files (version 7.3)
+MATLAB_CLASSES = {
+    np.dtype(np.float64): 'double',
+    np.dtype(np.float32): 'single',
+    np.dtype(np.int64): 'int64',
+    np.dtype(np.int32): 'int32',
+    np.dtype(np.int16): 'int16',
+    np.dtype(np.int8): 'int8',
+    np.dtype(np.uint64): 'uint64',
+    np.dtype(np.uint32): 'uint32',
+    np.dtype(np.uint16): 'uint16',
+    np.dtype(np.uint8): 'uint8',
+    np.dtype(bool): 'logical'
+}
+H5_USERBLOCK = 512
+H5_COMPRESSION = 4
+
+def require_h5py():
+    if h5py is None:
+        raise ImportError('h5py is required to export to, or read from, HDF5 files')
+
+class MatH5File:
+    """
+    Writes variables to a single MAT-file (version 7.3), which is an HDF5 file
+    preceded by a 512-byte Matlab header. Matlab arrays are column-major, so
+    every array is stored with its dimensions reversed, and tagged with its
+    Matlab class. Arrays are chunked and compressed, and large arrays can be
+    written one block at a time along their last dimension, each block being
+    one chunk. The file can be read with Matlab's load, or MatH5Reader.
+    """
+
+    def __init__(self, path):
+        """Creates the MAT-file
+        
+        Arguments:
+            path {str} -- Path of the MAT-file.
+        """
+        require_h5py()
+        self.path = path
+        self.file = h5py.File(path, 'w', userblock_size=H5_USERBLOCK)
+
+    def save(self, variables, oned_as='row'):
+        """Writes variables, as io.savemat
+        
+        Arguments:
+            variables {dict} -- Arrays, sparse matrices or scalars by name.
+        
+        Keyword Arguments:
+            oned_as {str} -- Whether 1-dimensional arrays are written as
+                'row' or 'column' vectors (default: {'row'})
+        """
+        for (name, value) in variables.items():
+            if sp.issparse(value):
+                self.save_sparse(name, value)
+            else:
+                value = np.asarray(value)
+                if value.ndim == 0:
+                    value = value.reshape(1, 1)
+                elif value.ndim == 1:
+                    value = value.reshape((1, -1) if oned_as == 'row' else (-1, 1))
+                self.save_array(name, value)
+
+    def save_array(self, name, value):
+        """Writes a dense array, as a dataset of reversed dimensions. Empty
+        arrays hold their dimensions, as Matlab writes them.
+        """
+        matlab_class = MATLAB_CLASSES[value.dtype]
+        if value.size == 0:
+            dset = self.file.create_dataset(
+                name, data=np.array(value.shape, np.uint64)
+            )
+            dset.attrs['MATLAB_empty'] = np.uint8(1)
+        else:
+            if value.dtype == bool:
+                value = value.astype(np.uint8)
+            dset = self.file.create_dataset(
+                name, data=value.T,
+                **self.compression(value.shape)
+            )
+        self.tag(dset, matlab_class)
+
+    def save_sparse(self, name, value):
+        """Writes a sparse matrix as Matlab does, as a group holding its
+        nonzeros, their row indexes and column pointers, in CSC format.
+        """
+        value = sp.csc_matrix(value)
+        value.sort_indices()
+        group = self.file.create_group(name)
+        if value.nnz > 0:
+            data = value.data.astype(np.uint8 if value.dtype == bool else np.float64)
+            group.create_dataset('data', data=data, **self.compression(data.shape))
+            group.create_dataset(
+                'ir', data=value.indices.astype(np.uint64),
+                **self.compression(value.indices.shape)
+            )
+        group.create_dataset('jc', data=value.indptr.astype(np.uint64))
+        self.tag(group, 'logical' if value.dtype == bool else 'double')
+        group.attrs['MATLAB_sparse'] = np.uint64(value.shape[0])
+
+    def array_writer(self, name, shape):
+        """Returns a writer of an array of given shape, one block at a time
+        along its last dimension, as MatStreamWriter.
+        """
+        return H5ArrayWriter(self, name, shape)
+
+    def compression(self, shape):
+        if int(np.prod(shape)) <= 1:
+            return {}
+        return {'compression': 'gzip', 'compression_opts': H5_COMPRESSION, 'shuffle': True}
+
+    def tag(self, obj, matlab_class):
+        obj.attrs['MATLAB_class'] = np.bytes_(matlab_class)
+
+    def close(self):
+        """Closes the HDF5 file, and writes the Matlab header in its userblock.
+        """
+        self.file.close()
+        text = 'MATLAB 7.3 MAT-file, Platform: {p}, Created on: {t} HDF5 schema 1.00 .'.format(
+            p=os.name,
+            t=time.asctime()
+        ).encode('ascii')
+        with open(self.path, 'r+b') as f:
+            f.write(text.ljust(116, b' '))
+            f.write(b'\x00'*8)                         # subsystem data offset
+            f.write(np.array(0x0200, '<u2').tobytes())
+            f.write(b'IM')                              # little-endian
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class H5ArrayWriter:
+    """
+    Writes a single double array to a MatH5File, one block at a time along its
+    last dimension, which is the first dimension of the dataset. Each slice
+    along that dimension, such as a trial, is one chunk, so that it can be
+    read alone. The file is closed with the writer if it is owned by it.
+    """
+
+    def __init__(self, h5, name, shape, owned=False):
+        self.h5 = h5
+        self.owned = owned
+        self.shape = tuple(shape)
+        self.written = 0
+        self.dset = h5.file.create_dataset(
+            name, shape=self.shape[::-1], dtype=np.float64,
+            chunks=(1,) + self.shape[-2::-1],
+            **h5.compression(self.shape)
+        )
+        h5.tag(self.dset, 'double')
+
+    def write(self, block):
+        assert(block.shape[:-1] == self.shape[:-1]), 'Block shape does not match array'
+        assert(self.written + block.shape[-1] <= self.shape[-1]), 'Too many blocks written'
+        self.dset[self.written:self.written+block.shape[-1]] = block.T
+        self.written += block.shape[-1]
+
+    def close(self):
+        assert(self.written == self.shape[-1]), 'Array was not fully written'
+        if self.owned:
+            self.h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.owned:
+            self.h5.close()
+
+class MatH5Reader:
+    """
+    Reads variables of a MAT-file (version 7.3) lazily, with Matlab
+    dimensions. Nothing is read until a variable, or a slice of it, is
+    requested.
+    """
+
+    def __init__(self, path):
+        """Opens the MAT-file
+        
+        Arguments:
+            path {str} -- Path of the MAT-file.
+        """
+        require_h5py()
+        self.file = h5py.File(path, 'r')
+
+    def keys(self):
+        return list(self.file.keys())
+
+    def __contains__(self, name):
+        return name in self.file
+
+    def __getitem__(self, name):
+        """Reads a whole variable, as a dense array or a CSC matrix.
+        """
+        obj = self.file[name]
+        matlab_class = obj.attrs['MATLAB_class'].decode('ascii')
+        if isinstance(obj, h5py.Group):
+            (n_rows, jc) = (int(obj.attrs['MATLAB_sparse']), obj['jc'][()])
+            if 'data' in obj:
+                (data, ir) = (obj['data'][()], obj['ir'][()])
+            else:
+                (data, ir) = (np.zeros(0), np.zeros(0, np.int64))
+            dtype = bool if matlab_class == 'logical' else np.float64
+            return sp.csc_matrix(
+                (data.astype(dtype), ir.astype(np.int64), jc.astype(np.int64)),
+                shape=(n_rows, len(jc)-1)
+            )
+        if obj.attrs.get('MATLAB_empty', 0):
+            return np.zeros(tuple(int(d) for d in obj[()]))
+        value = obj[()].T
+        if matlab_class == 'logical':
+            value = value.astype(bool)
+        return value
+
+    def trial(self, name, tr):
+        """Reads one slice of a variable along its last Matlab dimension, such
+        as one trial of P_target or P_initialise, without reading the others.
+        """
+        return self.file[name][tr].T
+
+    def shape(self, name):
+        """Returns the Matlab dimensions of a dense variable, without reading
+        it.
+        """
+        return self.file[name].shape[::-1]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 class ToMatlab:
     """
@@ -22,76 +374,133 @@ class ToMatlab:
             net,
             step='multi',
             trials=5,
-            m_dir='../../OflowEstimationFull/tests/'
+            m_dir='../../OflowEstimationFull/tests/',
+            block_trials=100,
+            export='mat',
+            standard_form=False
         ):
+        if trials < 1 or block_trials < 1:
+            raise ValueError('At least one trial is needed, got trials={t}, block_trials={b}'.format(
+                t=trials, b=block_trials
+            ))
         self.net = net
         self.step = step
         self.trials = trials
         self.m_dir = m_dir
+        # Number of trials generated and held in memory at once
+        self.block_trials = block_trials
+        # Either 'mat' for one MAT-file per variable group, or 'hdf5' for a
+        # single MAT-file (version 7.3), data.mat, holding all of them
+        if export not in ('mat', 'hdf5'):
+            raise ValueError('Export \'{e}\' is not recognised'.format(e=export))
+        if export == 'hdf5':
+            require_h5py()
+        self.export = export
+        # Whether the constraints are also exported in the standard form of a
+        # linear program, whose sparse matrices are costly to build for large
+        # networks
+        self.standard_form = standard_form
+        self.h5 = None
+        # Stages are recorded in the profiler of the network, if any
+        self.profiler = getattr(net, 'profiler', None)
+
+    @profiled('ToMatlab.save')
+    def save(self, name, variables, **kwargs):
+        """Saves variables to MAT-file name.mat, or to the single HDF5 file
+        when it is open.
+        """
+        if self.h5 is not None:
+            self.h5.save(variables, **kwargs)
+        else:
+            io.savemat(self.m_dir+name+'.mat', variables, **kwargs)
+
+    def array_writer(self, name, shape):
+        """Returns a writer of a large array, one block at a time along its
+        last dimension, to MAT-file name.mat or to the single HDF5 file.
+        Arrays too large for a version 5 MAT-file are written alone to a
+        version 7.3 MAT-file name.mat, which Matlab loads the same way.
+        """
+        if self.h5 is not None:
+            return self.h5.array_writer(name, shape)
+        path = self.m_dir+name+'.mat'
+        if MatStreamWriter.fits(shape):
+            return MatStreamWriter(path, name, shape)
+        return H5ArrayWriter(MatH5File(path), name, shape, owned=True)
+
+    def P_shape(self):
+        """Returns the shape of P_target and P_initialise: links, origins,
+        time steps for the multi-step model, and trials.
+        """
+        if self.step == 'multi':
+            return (
+                len(self.net.links),
+                len(self.net.origins),
+                self.net.tau_max,
+                self.trials
+            )
+        return (len(self.net.links), len(self.net.origins), self.trials)
 
     def save_assignment(self):
         sp = self.net.assignment == 'shortest_path'
-        io.savemat(self.m_dir+'shortest_path', {'shortest_path':sp})
+        self.save('shortest_path', {'shortest_path':sp})
 
     def save_trials(self):
-        io.savemat(self.m_dir+'trials', {'trials':self.trials})
+        self.save('trials', {'trials':self.trials})
 
     def save_tau_max(self):
-        io.savemat(self.m_dir+'tau_max', {'tau_max':self.net.tau_max})
+        self.save('tau_max', {'tau_max':self.net.tau_max})
 
+    def set_trial_proportions(self, fractions, tr):
+        (o_od_fractions, od_path_fractions) = fractions
+        (self.net.o_od_proportions, self.net.od_path_proportions) = (
+            self.net.expand_proportions(o_od_fractions[tr], od_path_fractions[tr])
+        )
+
+    @profiled('convert_P', lambda conv: {'trials': conv.trials})
     def convert_P(self, ext):
-        if self.step == 'multi':
-            # 4-dimensional array
-            P_py = np.zeros((
-                len(self.net.links),    # links
-                len(self.net.origins),  # origins
-                self.net.tau_max,       # time steps
-                self.trials             # trials
-            ))
-            for tr in range(self.trials):
-                self.net.generate_random_proportions()
-                self.net.compute_assignment_matrix()
-                P_py[:,:,:,tr] = np.dstack(self.net.P_ms)
-                # print('P'+ext)
-                # print(P_py[:,:,:,0])
-
-        if self.step == 'single':
-            # 3-dimensional array
-            P_py = np.zeros((
-                len(self.net.links),    # links
-                len(self.net.origins),  # origins
-                self.trials             # trials
-            ))
-            for tr in range(self.trials):
-                self.net.generate_random_proportions()
-                self.net.compute_assignment_matrix()
-                P_py[:,:,tr] = self.net.P
+        # Trials are generated and written to disk one block at a time
+        with self.array_writer('P_'+ext, self.P_shape()) as writer:
+            for start in range(0, self.trials, self.block_trials):
+                block = min(self.block_trials, self.trials-start)
+                fractions = self.net.generate_random_proportions_batch(
+                    block, dense=False
+                )
+                # Multi-step matrices of the block, of shape (block, tau_max,
+                # links, origins)
+                P_ms = self.net.compute_assignment_matrix_batch(*fractions)
+                if self.step == 'multi':
+                    writer.write(P_ms.transpose(2, 3, 1, 0))
+                elif self.step == 'single':
+                    writer.write(np.sum(P_ms, 1).transpose(1, 2, 0))
 
-        io.savemat(self.m_dir+'P_'+ext, {'P_'+ext:P_py})
+        # Leave the network with the proportions of the last trial
+        self.set_trial_proportions(fractions, block-1)
+        self.net.compute_assignment_matrix()
 
     def convert_o_list(self):
         o_list_py = np.array(self.net.origins) + 1
-        io.savemat(self.m_dir+'o_list', {'o_list':o_list_py})
+        self.save('o_list', {'o_list':o_list_py})
 
     def convert_e_list(self):
         e_list_py = np.array(self.net.links) + 1
-        io.savemat(self.m_dir+'e_list', {'e_list':e_list_py})
+        self.save('e_list', {'e_list':e_list_py})
 
     def convert_od_list(self):
         od_list_py = np.array(self.net.od_pairs) + 1
-        io.savemat(self.m_dir+'od_list', {'od_list':od_list_py})
+        self.save('od_list', {'od_list':od_list_py})
 
     def convert_lc(self):
         lc_py = self.net.lc
-        io.savemat(self.m_dir+'lc', {'lc':lc_py})
+        self.save('lc', {'lc':lc_py})
 
+    @profiled('convert_constraints')
     def convert_constraints(self):
         solver = Solver(self.net)
         if self.step == 'multi':
             solver.get_multi_step_constraints()
             if self.net.assignment == 'shortest_path':
-                io.savemat(
-                    self.m_dir+'constraints',
+                self.save(
+                    'constraints',
                     {
                         'c3':solver.c3,
                         'c4':solver.c4,
@@ -104,8 +513,8 @@ class ToMatlab:
                     }
                 )
             elif self.net.assignment == 'random':
-                io.savemat(
-                    self.m_dir+'constraints',
+                self.save(
+                    'constraints',
                     {
                         'c3':solver.c3,
                         'c4':solver.c4,
@@ -117,8 +526,8 @@ class ToMatlab:
                 )
         elif self.step == 'single':
             solver.get_single_step_constraints()
-            io.savemat(
-                    self.m_dir+'constraints',
+            self.save(
+                    'constraints',
                     {
                         'c3':solver.c3,
                         'c4':solver.c4,
@@ -131,8 +540,48 @@ class ToMatlab:
                     }
                 )
 
+    @profiled('convert_standard_form')
+    def convert_standard_form(self):
+        solver = Solver(self.net)
+        if self.step == 'multi':
+            solver.get_multi_step_constraints()
+        elif self.step == 'single':
+            solver.get_single_step_constraints()
+        (A_eq, b_eq, A_ineq, b_ineq, lb, ub) = solver.get_standard_form()
+        # Sparse matrices are saved as Matlab sparse matrices
+        self.save(
+            'standard_form',
+            {
+                'Aeq':A_eq,
+                'beq':b_eq,
+                'Aineq':A_ineq,
+                'bineq':b_ineq,
+                'lb':lb,
+                'ub':ub
+            },
+            oned_as='column'
+        )
+
+    @profiled('convert_data')
     def convert_data(self):
-        
+        if self.export == 'mat' and h5py is None and not MatStreamWriter.fits(self.P_shape()):
+            # Checked before any file is written
+            raise ImportError(
+                'P of shape {s} takes 2 GB or more, h5py is required to write it to a version 7.3 MAT-file'.format(
+                    s=self.P_shape()
+                )
+            )
+        if self.export == 'hdf5':
+            self.h5 = MatH5File(self.m_dir+'data.mat')
+            try:
+                self.convert_all()
+            finally:
+                self.h5.close()
+                self.h5 = None
+        else:
+            self.convert_all()
+
+    def convert_all(self):
         # One will be P_target, the second will be P_initialise
         self.save_assignment()
         self.save_trials()
@@ -144,6 +593,8 @@ class ToMatlab:
         self.convert_od_list()
         self.convert_lc()
         self.convert_constraints()
+        if self.standard_form:
+            self.convert_standard_form()
 
 if __name__ == '__main__':
     # SETTING UP EXPERIMENT
@@ -160,96 +611,23 @@ if __name__ == '__main__':
     PARAM = 'n_T' # n_T or 'size'
 
     # NO NEED TO MODIFY AFTER THIS POINT
-    if DATA == 'histogram':
-        m_dir = '../../OflowEstimationFull/tests/{step}_{costs}_{assment}_{h}by{w}_{tau_max}taumax_{trials}trials/'.format(
-        # m_dir = '../../temp/tests/RANDCONSC4C5_{step}_{costs}_{assment}_{h}by{w}_{tau_max}taumax_{trials}trials/'.format(
-            step=STEP,
-            costs=COSTS,
-            assment=ASSMENT,
-            h=H,
-            w=W,
-            tau_max=TAU_MAX,
-            trials=TRIALS
-        )
-        if not os.path.exists(m_dir):
-            os.mkdir(m_dir)
-        else:
-            print('WARNING: test data in {dir} will be overwritten'.format(dir=m_dir))
-            ans = input('Press any key to continue, or \'n\' to stop execution')
-            if ans == 'n':
-                print('Stopping execution.')
-                exit()
-            else:
-                print('Overwriting files.')
-
-        net = Network(DIRECTION, h=H, w=W)
-        net.assign_link_costs(COSTS)
-        net.find_all_paths(tau_max=TAU_MAX, assignment=ASSMENT)
-        net.generate_od_pairs()
-        net.compute_path_assignment_matrix()
-        conv = ToMatlab(
-            net, step=STEP, trials=TRIALS,
-            m_dir=m_dir
-        )
-        conv.convert_data()
-    elif DATA == 'plot':
-        m_dir = '../../OflowEstimationFull/tests/{param}_{step}_{costs}_{assment}_{h}by{w}_{tau_max}taumax_{trials}trials/'.format(
-            param=PARAM,
-            step=STEP,
-            costs=COSTS,
-            assment=ASSMENT,
-            h=H,
-            w=W,
-            tau_max=TAU_MAX,
-            trials=1
-        )
-        if not os.path.exists(m_dir):
-            os.mkdir(m_dir)
-        else:
-            print('WARNING: test data in {dir} will be overwritten'.format(dir=m_dir))
-            ans = input('Press any key to continue, or \'n\' to stop execution')
-            if ans == 'n':
-                print('Stopping execution.')
-                exit()
-            else:
-                print('Overwriting files.')
-        if PARAM == 'n_T':
-            TRIALS = 1
-            net = Network(DIRECTION, h=H, w=W)
-            net.assign_link_costs(COSTS)
-            net.find_all_paths(tau_max=TAU_MAX, assignment=ASSMENT)
-            net.generate_od_pairs()
-            net.compute_path_assignment_matrix()
-            conv = ToMatlab(
-                net, step=STEP, trials=1,
-                m_dir=m_dir
-            )
-            conv.convert_data()
-        elif PARAM == 'size':
-            TRIALS=1
-            #size: 4, 6, 9, 12, 16,  
-            hw_list = [(2,2), (2,3), (3,3), (3,4), (4,4), (4,5), (5,5), (5,6), (6,6), (7,7), (8,8)]
-            for i in range(len(hw_list)):
-                (H,W) = hw_list[i]
-                net = Network(DIRECTION, h=H, w=W)
-                net.assign_link_costs(COSTS)
-                net.find_all_paths(tau_max=TAU_MAX, assignment=ASSMENT)
-                net.generate_od_pairs()
-                net.compute_path_assignment_matrix()
-                m_dir = '../../OflowEstimation/tests/{param}_{step}_{costs}_{assment}_{h}by{w}_{tau_max}taumax_{trials}trials/'.format(
-                    param=PARAM,
-                    step=STEP,
-                    costs=COSTS,
-                    assment=ASSMENT,
-                    h=H,
-                    w=W,
-                    tau_max=TAU_MAX,
-                    trials=1
-                )
-                if not os.path.exists(m_dir):
-                    os.mkdir(m_dir)
-                conv = ToMatlab(
-                    net, step=STEP, trials=1,
-                    m_dir=m_dir
-                )
-                conv.convert_data()
\ No newline at end of file
+    # Data already generated for the configuration is kept if up to date, and
+    # overwritten otherwise
+    from sweep import run_sweep
+    grid = {
+        'data': DATA,
+        'param': PARAM,
+        'step': STEP,
+        'costs': COSTS,
+        'assment': ASSMENT,
+        'direction': DIRECTION,
+        'size': (H, W),
+        'tau_max': TAU_MAX,
+        'trials': TRIALS
+    }
+    if DATA == 'plot':
+        grid['trials'] = 1
+        if PARAM == 'size':
+            #size: 4, 6, 9, 12, 16,
+            grid['size'] = [(2,2), (2,3), (3,3), (3,4), (4,4), (4,5), (5,5), (5,6), (6,6), (7,7), (8,8)]
+    run_sweep(grid)
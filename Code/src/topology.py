@@ -0,0 +1,190 @@
+"""
+Generators of synthetic topologies for scaling studies are declared in this
+file: random geometric, Waxman, Barabasi-Albert, fat-tree and ring-of-grids
+networks. Links are built directly as arrays, without NetworkX graphs, and
+all edges are bidirectional, as in 'bi' grids. Networks are built from them
+with Network.from_topology.
+
+All generators return the number of nodes, and the links as an array of
+shape (n_links, 2) of node indexes from 0 to n_nodes-1.
+"""
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.spatial.distance import cdist
+
+# Number of node pairs whose distances are held in memory at once by the
+# Waxman generator
+WAXMAN_BLOCK = 2**22
+
+def bidirectional(edges):
+    """Returns links in both directions of each edge, of shape
+    (2*n_edges, 2).
+    """
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    return np.concatenate((edges, edges[:,::-1]))
+
+def random_geometric(n, radius, dim=2, seed=None):
+    """Generates a random geometric network: nodes are placed uniformly in
+    the unit hypercube, and linked when closer than radius. The network may
+    be disconnected for small radii.
+
+    Arguments:
+        n {int} -- Number of nodes.
+        radius {float} -- Distance under which nodes are linked.
+
+    Keyword Arguments:
+        dim {int} -- Dimension of the hypercube (default: {2})
+        seed {int} -- Random seed (default: {None})
+    """
+    rng = np.random.RandomState(seed)
+    pos = rng.rand(n, dim)
+    edges = cKDTree(pos).query_pairs(radius, output_type='ndarray')
+    return (n, bidirectional(edges))
+
+def waxman(n, alpha=0.1, beta=None, degree=4, dim=2, seed=None):
+    """Generates a Waxman network: nodes are placed uniformly in the unit
+    hypercube, and nodes u, v at distance d are linked with probability
+    beta*exp(-d/(alpha*L)), where L is the diagonal of the hypercube.
+    Distances are computed for blocks of nodes at once, so that memory does
+    not grow with n^2.
+
+    With a fixed beta, the average degree grows linearly with n: it is about
+    87 for alpha=0.4, beta=0.1 and n=2000. By default, beta is instead set
+    from the node positions so that the expected average degree is degree,
+    which keeps large networks sparse.
+
+    Arguments:
+        n {int} -- Number of nodes.
+
+    Keyword Arguments:
+        alpha {float} -- Decay of the probability with distance, the larger
+            the more long links (default: {0.1})
+        beta {float} -- Probability of linking nodes at the same position,
+            the larger the denser the network, set from degree if None
+            (default: {None})
+        degree {float} -- Expected average degree, when beta is None. Fewer
+            links are drawn if it needs beta above 1 (default: {4})
+        dim {int} -- Dimension of the hypercube (default: {2})
+        seed {int} -- Random seed (default: {None})
+    """
+    rng = np.random.RandomState(seed)
+    pos = rng.rand(n, dim)
+    scale = alpha*np.sqrt(dim)
+    block = max(1, WAXMAN_BLOCK//max(n, 1))
+    def weights(start):
+        # Pairs of each node of the block with all later nodes, for beta 1
+        stop = min(start + block, n)
+        return np.triu(np.exp(-cdist(pos[start:stop], pos[start:])/scale), 1)
+    if beta is None:
+        # Expected number of links for beta 1
+        total = sum(np.sum(weights(start)) for start in range(0, n, block))
+        beta = min(1.0, degree*n/(2*total)) if total > 0 else 1.0
+    edges = []
+    for start in range(0, n, block):
+        prob = beta*weights(start)
+        (rows, cols) = np.nonzero(rng.rand(*prob.shape) < prob)
+        edges.append(np.stack((rows + start, cols + start), axis=1))
+    return (n, bidirectional(np.concatenate(edges) if edges else []))
+
+def barabasi_albert(n, m, seed=None):
+    """Generates a Barabasi-Albert network by preferential attachment: each
+    new node is linked to m distinct existing nodes, chosen with probability
+    proportional to their degree. The first new node is linked to the m
+    initial nodes.
+
+    Arguments:
+        n {int} -- Number of nodes.
+        m {int} -- Number of edges of each new node, from 1 to n-1.
+
+    Keyword Arguments:
+        seed {int} -- Random seed (default: {None})
+    """
+    if m < 1 or m >= n:
+        raise ValueError('Barabasi-Albert networks need 1 <= m < n, got m={m}, n={n}'.format(m=m, n=n))
+    rng = np.random.RandomState(seed)
+    edges = np.empty((m*(n - m), 2), np.int64)
+    # Each node appears once per edge it belongs to, so that uniform draws
+    # from this list are proportional to degrees
+    repeated = np.empty(2*m*(n - m), np.int64)
+    targets = np.arange(m)
+    for (k, v) in enumerate(range(m, n)):
+        edges[k*m:(k+1)*m,0] = v
+        edges[k*m:(k+1)*m,1] = targets
+        repeated[2*k*m:(2*k+1)*m] = targets
+        repeated[(2*k+1)*m:2*(k+1)*m] = v
+        size = 2*(k+1)*m
+        chosen = set()
+        while len(chosen) < m:
+            chosen.update(repeated[rng.randint(size, size=m - len(chosen))].tolist())
+        targets = np.array(sorted(chosen))
+    return (n, bidirectional(edges))
+
+def fat_tree(k, hosts=True):
+    """Generates a k-ary fat-tree: (k/2)^2 core switches, and k pods of k/2
+    aggregation and k/2 edge switches. Aggregation switch a of each pod is
+    linked to core switches a*k/2 to (a+1)*k/2-1, and all aggregation and edge
+    switches of a pod are linked. Each edge switch connects k/2 hosts.
+
+    Nodes are numbered core switches first, then pod by pod aggregation and
+    edge switches, then hosts.
+
+    Arguments:
+        k {int} -- Number of ports of each switch, even.
+
+    Keyword Arguments:
+        hosts {bool} -- Whether to include hosts (default: {True})
+    """
+    if k < 2 or k % 2:
+        raise ValueError('Fat-trees need an even number of ports, got k={k}'.format(k=k))
+    half = k//2
+    n_core = half**2
+    # Aggregation and edge switch of index i in pod p
+    def agg(p, i):
+        return n_core + p*k + i
+    def edge(p, i):
+        return n_core + p*k + half + i
+    (p, a, c) = np.meshgrid(np.arange(k), np.arange(half), np.arange(half), indexing='ij')
+    core_agg = np.stack((a*half + c, agg(p, a)), axis=-1)
+    (p, a, e) = np.meshgrid(np.arange(k), np.arange(half), np.arange(half), indexing='ij')
+    agg_edge = np.stack((agg(p, a), edge(p, e)), axis=-1)
+    edges = [core_agg.reshape(-1, 2), agg_edge.reshape(-1, 2)]
+    n = n_core + k*k
+    if hosts:
+        (p, e, h) = np.meshgrid(np.arange(k), np.arange(half), np.arange(half), indexing='ij')
+        host = n + (p*half + e)*half + h
+        edges.append(np.stack((edge(p, e), host), axis=-1).reshape(-1, 2))
+        n += k*half*half
+    return (n, bidirectional(np.concatenate(edges)))
+
+def ring_of_grids(n_grids, h=3, w=3):
+    """Generates a ring of h by w grids, where the last node of each grid is
+    linked to the first node of the next grid. Node (r, c) of grid g is
+    numbered g*h*w + r*w + c, as in grid_2d_graph for a single grid.
+
+    Arguments:
+        n_grids {int} -- Number of grids.
+
+    Keyword Arguments:
+        h {int} -- Height of each grid (default: {3})
+        w {int} -- Width of each grid (default: {3})
+    """
+    size = h*w
+    idxs = np.arange(size).reshape(h, w)
+    grid = np.concatenate((
+        np.stack((idxs[:,:-1].ravel(), idxs[:,1:].ravel()), axis=1),
+        np.stack((idxs[:-1].ravel(), idxs[1:].ravel()), axis=1)
+    ))
+    offsets = size*np.arange(n_grids)
+    edges = [(grid[None] + offsets[:,None,None]).reshape(-1, 2)]
+    if n_grids > 1:
+        edges.append(np.stack((offsets + size - 1, np.roll(offsets, -1)), axis=1))
+    return (n_grids*size, bidirectional(np.concatenate(edges)))
+
+GENERATORS = {
+    'random_geometric': random_geometric,
+    'waxman': waxman,
+    'barabasi_albert': barabasi_albert,
+    'fat_tree': fat_tree,
+    'ring_of_grids': ring_of_grids
+}